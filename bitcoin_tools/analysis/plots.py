@@ -47,6 +47,28 @@ def get_cdf(samples, normalize=False):
     return [xs, ys]
 
 
+def get_cdf_from_counts(counts, normalize=False):
+    """
+    Compute the cumulative count from the number of occurrences of each value (same result as get_cdf over the samples).
+
+    :param counts: dict (or Counter) with the number of occurrences of each value
+    :param normalize: boolean, indicates if counts have to be normalized
+    :return: list of two lists: first list returns x values (unique values in samples), second list returns cumulative
+    occurrence counts (number of samples with value <= xi).
+    """
+
+    xs = sorted(counts.keys())
+    ys = [counts[x] for x in xs]
+
+    if normalize:
+        total = sum(ys)
+        ys = [float(y)/float(total) for y in ys]
+
+    ys = np.cumsum(ys)
+
+    return [np.array(xs), ys]
+
+
 def plot_distribution(xs, ys, title, xlabel, ylabel, log_axis=None, save_fig=False, legend=None, legend_loc=1,
                       font_size=20, y_sup_lim=None):
     """
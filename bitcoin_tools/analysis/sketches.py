@@ -0,0 +1,390 @@
+"""
+Streaming summaries of sample sets, used to build cdfs (same output as plots.get_cdf) without holding all the samples in
+memory. Summaries are fed chunk by chunk (update) and can be merged, so different parts of the data can be summarized
+separately (e.g. in different processes).
+
+    KLLSketch       approximate quantile sketch for any numeric attribute (e.g. amount), with bounded rank error.
+    CountHistogram  exact histogram for integer attributes with a bounded range of values (e.g. out_type or height).
+
+Set membership can also be summarized (e.g. the outpoints of a chainstate) with a BloomFilter.
+"""
+
+from math import ceil, log
+from hashlib import md5
+import numpy as np
+
+
+class KLLSketch(object):
+    """ KLL quantile sketch (Karnin, Lang and Liberty, "Optimal Quantile Approximation in Streams", 2016).
+
+    Samples are kept in a hierarchy of compactors. When a compactor is over its capacity, it is sorted and half of its
+    samples (either the odd or the even ones, at random) are promoted to the next level, where every sample stands for
+    twice as many. The rank of any value can then be estimated with an error that depends on the capacity of the top
+    compactor (k), while the size of the sketch is around 3k samples regardless of the number of samples fed.
+
+    The sketch is exact as long as less than k samples have been fed. Null samples (None or NaN) are ignored.
+    """
+
+    def __init__(self, eps=0.01, seed=None):
+        """
+        :param eps: Target normalized rank error. k is set to 4 / eps, which keeps the rank error of the estimated cdf
+        below eps with high probability.
+        :type eps: float
+        :param seed: Seed of the random compactions (for reproducible sketches).
+        :type seed: int
+        """
+
+        self.eps = eps
+        self.k = int(ceil(4.0 / eps))
+        self.n = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.RandomState(seed)
+        # Samples are kept as floats, but the cdf is given back as integers if all the samples fed were integers.
+        self.integer = True
+
+    def __len__(self):
+        return self.n
+
+    def capacity(self, level):
+        """
+        Gets the capacity of a compactor. Capacities decrease geometrically (by 2/3) from the top compactor (k) down.
+
+        :param level: Level of the compactor.
+        :type level: int
+        :return: The capacity of the compactor.
+        :rtype: int
+        """
+
+        depth = len(self.levels) - level - 1
+
+        return max(int(ceil(self.k * (2 / 3.0) ** depth)), 2)
+
+    def update(self, values):
+        """
+        Adds a chunk of samples to the sketch.
+
+        :param values: Samples.
+        :type values: list or numpy.ndarray
+        :return: None
+        :rtype: None
+        """
+
+        values = np.asarray(values)
+        integer = values.dtype.kind in 'iub'
+        values = values.astype(np.float64).ravel()
+
+        # Null samples (NaN) are ignored.
+        values = values[~np.isnan(values)]
+
+        if len(values):
+            self.integer = self.integer and integer
+            self.n += len(values)
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self.compress()
+
+    def merge(self, other):
+        """
+        Merges another sketch into this one.
+
+        :param other: Sketch to be merged.
+        :type other: KLLSketch
+        :return: This sketch.
+        :rtype: KLLSketch
+        """
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+
+        for level, samples in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], samples])
+
+        self.n += other.n
+        self.integer = self.integer and other.integer
+        self.compress()
+
+        return self
+
+    def compress(self):
+        """
+        Compacts the compactors that are over their capacity, from the bottom up.
+
+        :return: None
+        :rtype: None
+        """
+
+        level = 0
+        while level < len(self.levels):
+            samples = self.levels[level]
+
+            if len(samples) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                samples = np.sort(samples)
+
+                # If the number of samples is odd, one of them stays in the compactor, so the total weight is kept.
+                if len(samples) % 2:
+                    self.levels[level] = samples[:1]
+                    samples = samples[1:]
+                else:
+                    self.levels[level] = np.empty(0)
+
+                promoted = samples[self.rng.randint(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+                # Capacities depend on the number of levels, so the bottom ones are checked again.
+                level = 0
+            else:
+                level += 1
+
+    def get_cdf(self, normalize=False):
+        """
+        Computes the (estimated) cumulative count over the samples fed to the sketch.
+
+        :param normalize: boolean, indicates if counts have to be normalized
+        :return: list of two lists: first list returns x values (sampled values), second list returns the estimated
+        cumulative occurrence counts (number of samples with value <= xi).
+        """
+
+        samples = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(s), 2 ** level, dtype=np.int64) for level, s in enumerate(self.levels)])
+
+        order = np.argsort(samples, kind='mergesort')
+        samples, weights = samples[order], weights[order]
+
+        xs, first = np.unique(samples, return_index=True)
+        ys = np.add.reduceat(weights, first) if len(first) else weights
+
+        if self.integer:
+            xs = xs.astype(np.int64)
+
+        if normalize:
+            ys = ys / float(np.sum(ys))
+
+        return [xs, np.cumsum(ys)]
+
+
+class CountHistogram(object):
+    """ Exact histogram of integer samples. Counts are stored in an array that covers the range of values found so far,
+    so memory is bounded by the range of the attribute (max_bins) instead of by the number of samples.
+    """
+
+    def __init__(self, max_bins=2 ** 24):
+        """
+        :param max_bins: Maximum range of values the histogram can hold.
+        :type max_bins: int
+        """
+
+        self.max_bins = max_bins
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return int(np.sum(self.counts))
+
+    def _extend(self, low, high):
+        """
+        Extends the range of the histogram so it covers [low, high].
+
+        :param low: Lowest value.
+        :type low: int
+        :param high: Highest value.
+        :type high: int
+        :return: None
+        :rtype: None
+        """
+
+        if len(self.counts):
+            low = min(low, self.offset)
+            high = max(high, self.offset + len(self.counts) - 1)
+
+        if high - low + 1 > self.max_bins:
+            raise Exception("The range of values ({}, {}) exceeds the maximum number of bins of the histogram ({})."
+                            .format(low, high, self.max_bins))
+
+        counts = np.zeros(high - low + 1, dtype=np.int64)
+        counts[self.offset - low:self.offset - low + len(self.counts)] = self.counts
+
+        self.offset = low
+        self.counts = counts
+
+    def add_counts(self, offset, counts):
+        """
+        Adds the counts of a range of values to the histogram.
+
+        :param offset: Value of the first count.
+        :type offset: int
+        :param counts: Number of occurrences of every value from offset onwards.
+        :type counts: numpy.ndarray
+        :return: None
+        :rtype: None
+        """
+
+        if len(counts) == 0:
+            return
+
+        if not len(self.counts) or offset < self.offset or offset + len(counts) > self.offset + len(self.counts):
+            self._extend(offset, offset + len(counts) - 1)
+
+        start = offset - self.offset
+        self.counts[start:start + len(counts)] += counts
+
+    def update(self, values):
+        """
+        Adds a chunk of samples to the histogram.
+
+        :param values: Samples (integer values).
+        :type values: list or numpy.ndarray
+        :return: None
+        :rtype: None
+        """
+
+        values = np.asarray(values)
+
+        if len(values) == 0:
+            return
+
+        int_values = values.astype(np.int64)
+        if np.any(int_values != values):
+            raise Exception("CountHistogram only accepts integer values.")
+
+        low = int(int_values.min())
+        self.add_counts(low, np.bincount(int_values - low))
+
+    def merge(self, other):
+        """
+        Merges another histogram into this one.
+
+        :param other: Histogram to be merged.
+        :type other: CountHistogram
+        :return: This histogram.
+        :rtype: CountHistogram
+        """
+
+        self.add_counts(other.offset, other.counts)
+
+        return self
+
+    def get_cdf(self, normalize=False):
+        """
+        Computes the cumulative count over the samples (same result as plots.get_cdf).
+
+        :param normalize: boolean, indicates if counts have to be normalized
+        :return: list of two lists: first list returns x values (unique values in samples), second list returns cumulative
+        occurrence counts (number of samples with value <= xi).
+        """
+
+        values = np.flatnonzero(self.counts)
+        xs, ys = values + self.offset, self.counts[values]
+
+        if normalize:
+            ys = ys / float(np.sum(ys))
+
+        return [xs, np.cumsum(ys)]
+
+
+class BloomFilter(object):
+    """ Bloom filter for byte strings (e.g. chainstate keys). Membership queries may give false positives (with
+    probability error_rate once capacity items have been added), but never false negatives. The filter takes around
+    1.2 bytes per item for a 1% error rate, regardless of the size of the items.
+
+    Items are hashed with md5 (two 64-bit halves, combined by double hashing to get the k bit positions), and added or
+    queried in batches, so bit positions are computed with numpy.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """
+        :param capacity: Expected number of items.
+        :type capacity: int
+        :param error_rate: False positive rate once capacity items have been added.
+        :type error_rate: float
+        """
+
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.m = int(ceil(-self.capacity * log(error_rate) / log(2) ** 2))
+        self.k = max(int(round(self.m / float(self.capacity) * log(2))), 1)
+        self.bits = np.zeros((self.m + 7) // 8, dtype=np.uint8)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def _positions(self, items):
+        """
+        Computes the bit positions of a batch of items.
+
+        :param items: Items to be hashed.
+        :type items: list of str
+        :return: Array with the k bit positions of every item (one row per item).
+        :rtype: numpy.ndarray
+        """
+
+        digests = np.frombuffer("".join([md5(item).digest() for item in items]), dtype='<u8').reshape(-1, 2)
+
+        # Unsigned overflows just wrap around, which is fine for hashing.
+        with np.errstate(over='ignore'):
+            hashes = digests[:, :1] + np.arange(self.k, dtype=np.uint64) * digests[:, 1:]
+
+        return hashes % np.uint64(self.m)
+
+    def update(self, items):
+        """
+        Adds a batch of items to the filter.
+
+        :param items: Items to be added.
+        :type items: list of str
+        :return: None
+        :rtype: None
+        """
+
+        if len(items):
+            positions = self._positions(items).ravel()
+            np.bitwise_or.at(self.bits, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+            self.n += len(items)
+
+    def contains(self, items):
+        """
+        Checks whether a batch of items may be in the filter.
+
+        :param items: Items to be checked.
+        :type items: list of str
+        :return: Boolean array, False for the items that are certainly not in the filter.
+        :rtype: numpy.ndarray
+        """
+
+        if not len(items):
+            return np.zeros(0, dtype=bool)
+
+        positions = self._positions(items)
+        found = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+
+        return found.all(axis=1)
+
+    def get_error_rate(self):
+        """
+        Computes the current false positive rate of the filter, from the fraction of bits set.
+
+        :return: The probability of an item not in the filter being found.
+        :rtype: float
+        """
+
+        return (np.unpackbits(self.bits)[:self.m].sum() / float(self.m)) ** self.k
+
+    def merge(self, other):
+        """
+        Merges another filter (with the same capacity and error rate) into this one.
+
+        :param other: Filter to be merged.
+        :type other: BloomFilter
+        :return: This filter.
+        :rtype: BloomFilter
+        """
+
+        if (self.m, self.k) != (other.m, other.k):
+            raise Exception("Only Bloom filters with the same size and number of hashes can be merged.")
+
+        self.bits |= other.bits
+        self.n += other.n
+
+        return self
@@ -0,0 +1,187 @@
+"""
+Stage cache for the STATUS pipeline. Every stage (parse_ldb, transaction_dump, utxo_dump, the dust aggregation, the
+plots, ...) is identified by a fingerprint built from its name, its parameters (coin, count_p2sh, non_std_only, ...) and
+the fingerprints of its inputs (the chainstate tip, the estimation data hash or the fingerprint of the stage that
+created an input file). Since fingerprints are chained, any change in a stage changes the fingerprint of every stage
+downstream, while the rest of them are still found in the cache and skipped.
+
+Fingerprints of the completed stages are stored in an index file (STAGES_FILE) in CFG.data_path.
+"""
+
+from bitcoin_tools import CFG
+from hashlib import sha256
+import ujson
+import os
+
+
+STAGES_FILE = "stages.json"
+ESTIMATION_FILES = ["p2pkh_pubkey_avg_size_height_output.json", "p2sh.json", "nonstd.json", "p2wsh.json"]
+
+
+def get_fingerprint(stage, params=None, inputs=None):
+    """
+    Computes the fingerprint of a stage.
+
+    :param stage: Name of the stage.
+    :type stage: str
+    :param params: Parameters of the stage (must be json serializable).
+    :type params: dict
+    :param inputs: Fingerprints of the inputs of the stage. If any of them is None (unknown), so is the fingerprint.
+    :type inputs: list of str
+    :return: The fingerprint (hex), or None if it can not be computed.
+    :rtype: str
+    """
+
+    inputs = inputs or []
+
+    if None in inputs:
+        return None
+
+    return sha256(ujson.dumps([stage, params or {}, inputs], sort_keys=True)).hexdigest()
+
+
+def get_file_hash(fin_path, block_size=2 ** 20):
+    """
+    Computes the sha256 hash of the content of a file.
+
+    :param fin_path: Path of the file.
+    :type fin_path: str
+    :param block_size: Number of bytes read at once.
+    :type block_size: int
+    :return: The hash (hex).
+    :rtype: str
+    """
+
+    h = sha256()
+
+    with open(fin_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def get_estimation_data_hash(coin):
+    """
+    Computes a hash of the estimation data of a given coin (see utils.load_estimation_data).
+
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :return: The hash (hex). If no estimation data is found, the hash of an empty set of files is returned, so results
+    computed without estimation data can also be cached.
+    :rtype: str
+    """
+
+    hashes = []
+
+    for file_name in ESTIMATION_FILES:
+        try:
+            hashes.append(get_file_hash(CFG.estimated_data_dir + coin + "/" + file_name))
+        except IOError:
+            return get_fingerprint("estimation_data")
+
+    return get_fingerprint("estimation_data", inputs=hashes)
+
+
+class StageCache(object):
+    """ Index of the stages completed so far, with their fingerprints and the files they output (relative to
+    CFG.data_path). A stage is cached if it has been completed with the same fingerprint and all its output files are
+    still there.
+    """
+
+    def __init__(self, fin_name=STAGES_FILE, enabled=True):
+        """
+        :param fin_name: Name of the index file.
+        :type fin_name: str
+        :param enabled: Whether cached stages are skipped. If not, every stage is run (but the index is still updated).
+        :type enabled: bool
+        """
+
+        self.path = CFG.data_path + fin_name
+        self.enabled = enabled
+
+        try:
+            with open(self.path) as f:
+                self.stages = ujson.load(f)
+        except (IOError, ValueError):
+            self.stages = dict()
+
+    @staticmethod
+    def get_key(stage, outputs):
+        # The same stage can be run with different outputs (e.g. utxo_dump with and without P2SH).
+        return "|".join([stage] + list(outputs))
+
+    def is_cached(self, stage, fingerprint, outputs=()):
+        """
+        Checks whether a stage is cached.
+
+        :param stage: Name of the stage.
+        :type stage: str
+        :param fingerprint: Fingerprint of the stage (see get_fingerprint).
+        :type fingerprint: str
+        :param outputs: Files created by the stage.
+        :type outputs: list of str
+        :return: True if the stage can be skipped, False otherwise.
+        :rtype: bool
+        """
+
+        if not self.enabled or fingerprint is None:
+            return False
+
+        if self.stages.get(self.get_key(stage, outputs)) != fingerprint:
+            return False
+
+        return all(os.path.exists(CFG.data_path + fout_name) for fout_name in outputs)
+
+    def store(self, stage, fingerprint, outputs=()):
+        """
+        Records a stage as completed (or forgets it, if the fingerprint is None).
+
+        :param stage: Name of the stage.
+        :type stage: str
+        :param fingerprint: Fingerprint of the stage (see get_fingerprint).
+        :type fingerprint: str
+        :param outputs: Files created by the stage.
+        :type outputs: list of str
+        :return: None
+        :rtype: None
+        """
+
+        key = self.get_key(stage, outputs)
+
+        if fingerprint is None:
+            self.stages.pop(key, None)
+        else:
+            self.stages[key] = fingerprint
+
+        # The index is replaced at once, so it is never left half-written.
+        with open(self.path + ".tmp", 'w') as f:
+            f.write(ujson.dumps(self.stages, sort_keys=True, indent=1))
+        os.rename(self.path + ".tmp", self.path)
+
+    def run(self, stage, fingerprint, outputs, func, *args, **kwargs):
+        """
+        Runs a stage unless it is cached.
+
+        :param stage: Name of the stage.
+        :type stage: str
+        :param fingerprint: Fingerprint of the stage (see get_fingerprint).
+        :type fingerprint: str
+        :param outputs: Files created by the stage.
+        :type outputs: list of str
+        :param func: Function that runs the stage (called with the remaining arguments).
+        :type func: function
+        :return: True if the stage has been run, False if it has been skipped.
+        :rtype: bool
+        """
+
+        if self.is_cached(stage, fingerprint, outputs):
+            print "{} is up to date ({}). Skipping.".format(stage, ", ".join(outputs) or fingerprint[:16])
+            return False
+
+        # The stage is forgotten before running it, so an interrupted run is never taken as a valid one.
+        self.store(stage, None, outputs)
+        func(*args, **kwargs)
+        self.store(stage, fingerprint, outputs)
+
+        return True
@@ -0,0 +1,648 @@
+"""
+Columnar on-disk format for the files dumped by STATUS (parse_ldb, transaction_dump and utxo_dump).
+
+A columnar dump is a folder that contains one file per column and a meta.json file describing them. Every column is
+stored as a fixed-width little-endian array (one entry per row), so it can be memory-mapped with numpy and a single
+attribute can be loaded without parsing the rest of the data. Variable-length data (scripts) is stored as a blob of
+raw bytes plus an array of offsets (rows + 1 entries), and transaction ids are stored as raw 32-byte values.
+
+Transaction ids can be handed to the writers either as hex or raw (32 bytes) strings, so they can be kept raw while the
+data is processed. They are only turned into hex when json rows are encoded.
+
+Column kinds:
+    numpy dtype     fixed-width numeric column (e.g. '<i4').
+    nullable        signed 64-bit integer column where None values are stored as NULL.
+    category        small set of json values (e.g. non_std_type), stored as 16-bit codes plus a list of categories.
+    txid            32-byte transaction ids (hex or raw), stored raw.
+    hex             variable-length hex values, stored raw as a blob plus offsets.
+
+Nested fields (e.g. the out of a decoded utxo) are represented with dotted names (e.g. out.amount).
+"""
+
+from bitcoin_tools import CFG
+from bitcoin_tools.analysis.status.compression import open_dump, get_file_state
+from binascii import hexlify, unhexlify
+import numpy as np
+import ujson
+import os
+
+
+META_FILE = "meta.json"
+NULL = -1
+
+# Schemas of the dumped files. Columns are listed in the same order fields are found in the json dumps, so rows read
+# from both formats are built the same way. Signed types are used so values are read back as Python ints (unsigned
+# 32-bit values are read as longs, and some checks in STATUS rely on int identity).
+DECODED_UTXOS = [("coinbase", "<u1"), ("height", "<i4"), ("index", "<i4"), ("len", "<i4"), ("out.amount", "<i8"),
+                 ("out.data", "hex"), ("out.out_type", "<i4"), ("tx_id", "txid")]
+
+PARSED_TXS = [("tx_id", "txid"), ("num_utxos", "<i4"), ("total_value", "<i8"), ("total_len", "<i8"),
+              ("height", "<i4"), ("coinbase", "<u1")]
+
+PARSED_UTXOS = [("tx_id", "txid"), ("tx_height", "<i4"), ("utxo_data_len", "<i4"), ("dust", "nullable"),
+                ("non_profitable", "nullable"), ("non_profitable_est", "nullable"), ("non_std_type", "category"),
+                ("index", "<i4"), ("register_len", "<i4"), ("amount", "<i8"), ("out_type", "<i4"), ("data", "hex")]
+
+# Binary outpoint: the raw 32-byte tx_id (as stored in the chainstate) followed by the output index (little-endian
+# uint32), 36 bytes in total. Outpoints are packed in plain strings with the same layout (see utils.pack_outpoint), so a
+# list of them can be turned into an array of this dtype at once (see utils.get_outpoint_array).
+OUTPOINT = np.dtype([("tx_id", np.uint8, (32,)), ("index", "<u4")])
+
+
+def get_raw_tx_id(tx_id):
+    """
+    Gets the raw representation of a transaction id.
+
+    :param tx_id: Transaction id, either hex or raw.
+    :type tx_id: str
+    :return: The raw (32-byte) transaction id.
+    :rtype: str
+    """
+
+    return tx_id if len(tx_id) == 32 else unhexlify(tx_id)
+
+
+def get_hex_tx_id(tx_id):
+    """
+    Gets the hex representation of a transaction id.
+
+    :param tx_id: Transaction id, either hex or raw.
+    :type tx_id: str
+    :return: The hex (64-char) transaction id.
+    :rtype: str
+    """
+
+    return hexlify(tx_id) if len(tx_id) == 32 else tx_id
+
+
+def get_field(row, name):
+    """
+    Gets the value of a (possibly nested) field from a row.
+
+    :param row: Row from which the value will be extracted.
+    :type row: dict
+    :param name: Name of the field (dotted for nested fields).
+    :type name: str
+    :return: The value of the field.
+    """
+
+    for k in name.split("."):
+        row = row[k]
+
+    return row
+
+
+def set_field(row, name, value):
+    """
+    Sets the value of a (possibly nested) field in a row, creating the nested dictionaries if necessary.
+
+    :param row: Row to be updated.
+    :type row: dict
+    :param name: Name of the field (dotted for nested fields).
+    :type name: str
+    :param value: Value to be set.
+    :return: None
+    :rtype: None
+    """
+
+    keys = name.split(".")
+    for k in keys[:-1]:
+        row = row.setdefault(k, dict())
+
+    row[keys[-1]] = value
+
+
+def encode_rows(schema, rows):
+    """
+    Encodes a list of rows into columns, following a given schema. Categories are not encoded here (since codes have to
+    be consistent across the whole file), so raw values are returned for them.
+
+    The function does not depend on the writer state, so rows can be encoded by worker processes.
+
+    :param schema: Schema of the rows.
+    :type schema: list of tuple
+    :param rows: Rows to be encoded.
+    :type rows: list of dict
+    :return: The number of encoded rows and a dictionary with the encoded columns.
+    :rtype: int, dict
+    """
+
+    columns = dict()
+
+    for name, kind in schema:
+        values = [get_field(row, name) for row in rows]
+
+        if kind == "txid":
+            columns[name] = "".join([get_raw_tx_id(v) for v in values])
+        elif kind == "hex":
+            raw = [unhexlify(v) for v in values]
+            columns[name] = ("".join(raw), np.array([len(r) for r in raw], dtype='<i8'))
+        elif kind == "nullable":
+            columns[name] = np.array([NULL if v is None else v for v in values], dtype='<i8')
+        elif kind == "category":
+            columns[name] = values
+        else:
+            columns[name] = np.array(values, dtype=kind)
+
+    return len(rows), columns
+
+
+class ColumnWriter(object):
+    """ Writes rows to a columnar dump. Rows are buffered and encoded in chunks of chunk_size rows. Already encoded
+    chunks (from encode_rows) can also be written directly.
+    """
+
+    def __init__(self, fout_name, schema, chunk_size=100000, state=None):
+        """
+        :param fout_name: Dump name.
+        :type fout_name: str
+        :param schema: Schema of the rows.
+        :type schema: list of tuple
+        :param chunk_size: Number of rows encoded at once.
+        :type chunk_size: int
+        :param state: State of a previous writer of the same dump (from get_state). If given, the dump is truncated to
+        that state and new rows are appended from there.
+        :type state: dict
+        """
+
+        self.path = CFG.data_path + fout_name
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.buffer = []
+        self.categories = {name: [] for name, kind in schema if kind == "category"}
+        self.codes = {name: dict() for name, kind in schema if kind == "category"}
+        self.blob_sizes = {name: 0 for name, kind in schema if kind == "hex"}
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        # Remove the meta file (if any) so a half-written dump is never taken as a valid one.
+        if os.path.isfile(os.path.join(self.path, META_FILE)):
+            os.remove(os.path.join(self.path, META_FILE))
+
+        self.files = dict()
+        for name, kind in schema:
+            self.files[name] = open(os.path.join(self.path, name + ".bin"), 'wb' if state is None else 'r+b')
+            if kind == "hex":
+                self.files[name + ".offsets"] = open(os.path.join(self.path, name + ".offsets.bin"),
+                                                     'wb' if state is None else 'r+b')
+                if state is None:
+                    np.zeros(1, dtype='<i8').tofile(self.files[name + ".offsets"])
+
+        if state is not None:
+            self.rows = state["rows"]
+            self.blob_sizes.update(state["blob_sizes"])
+
+            for name, values in state["categories"].items():
+                self.categories[name] = values
+                self.codes[name] = {ujson.dumps(v): code for code, v in enumerate(values)}
+
+            for name, f in self.files.items():
+                f.truncate(state["sizes"][name])
+                f.seek(0, os.SEEK_END)
+
+    def write(self, row):
+        """ Writes a row.
+
+        :param row: Row to be written.
+        :type row: dict
+        :return: None
+        :rtype: None
+        """
+
+        self.buffer.append(row)
+
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Encodes and writes the buffered rows.
+
+        :return: None
+        :rtype: None
+        """
+
+        if self.buffer:
+            buffered, self.buffer = self.buffer, []
+            self.write_chunk(encode_rows(self.schema, buffered))
+
+    def write_chunk(self, encoded):
+        """ Writes a chunk of already encoded rows (from encode_chunk).
+
+        :param encoded: Number of rows and encoded columns.
+        :type encoded: tuple
+        :return: None
+        :rtype: None
+        """
+
+        # Buffered rows go first, so the order of the rows is kept.
+        self.flush()
+
+        n, columns = encoded
+
+        for name, kind in self.schema:
+            column = columns[name]
+
+            if kind == "txid":
+                self.files[name].write(column)
+            elif kind == "hex":
+                data, lengths = column
+                self.files[name].write(data)
+                offsets = self.blob_sizes[name] + np.cumsum(lengths, dtype='<i8')
+                offsets.tofile(self.files[name + ".offsets"])
+                if len(offsets):
+                    self.blob_sizes[name] = int(offsets[-1])
+            elif kind == "category":
+                np.array([self.get_code(name, v) for v in column], dtype='<u2').tofile(self.files[name])
+            else:
+                column.tofile(self.files[name])
+
+        self.rows += n
+
+    def get_state(self):
+        """ Writes all the buffered rows to disk and gets the state of the writer, so the dump can be resumed from this
+        point later on (see the state parameter of the constructor).
+
+        :return: The state of the writer.
+        :rtype: dict
+        """
+
+        self.flush()
+
+        sizes = dict()
+        for name, f in self.files.items():
+            f.flush()
+            os.fsync(f.fileno())
+            sizes[name] = f.tell()
+
+        return {"rows": self.rows, "blob_sizes": self.blob_sizes, "categories": self.categories, "sizes": sizes}
+
+    def get_code(self, name, value):
+        """ Gets the code of a value for a given category column, adding it to the categories if it is new.
+
+        :param name: Column name.
+        :type name: str
+        :param value: Value to be encoded.
+        :return: The code of the value.
+        :rtype: int
+        """
+
+        # Values are indexed by their json representation, since False == 0 for Python dicts.
+        k = ujson.dumps(value)
+        code = self.codes[name].get(k)
+
+        if code is None:
+            code = len(self.categories[name])
+            self.codes[name][k] = code
+            self.categories[name].append(value)
+
+        return code
+
+    def close(self):
+        """ Flushes the remaining rows, closes the column files and stores the meta file.
+
+        :return: None
+        :rtype: None
+        """
+
+        self.flush()
+
+        for f in self.files.values():
+            f.close()
+
+        meta = {"schema": self.schema, "rows": self.rows, "categories": self.categories}
+
+        with open(os.path.join(self.path, META_FILE), 'w') as f:
+            f.write(ujson.dumps(meta))
+
+
+class ColumnReader(object):
+    """ Reads a columnar dump. Columns are memory-mapped, so loading a single column does not require reading the rest
+    of the data.
+    """
+
+    def __init__(self, fin_name):
+        self.path = CFG.data_path + fin_name
+
+        with open(os.path.join(self.path, META_FILE)) as f:
+            meta = ujson.load(f)
+
+        self.schema = [(str(name), str(kind)) for name, kind in meta["schema"]]
+        self.kinds = dict(self.schema)
+        self.rows = meta["rows"]
+        self.categories = meta["categories"]
+
+    def __len__(self):
+        return self.rows
+
+    def resolve(self, name):
+        """ Gets the full name of a column, so nested columns can be also requested by their last key (e.g. amount for
+        out.amount).
+
+        :param name: Column name.
+        :type name: str
+        :return: The full column name.
+        :rtype: str
+        """
+
+        if name in self.kinds:
+            return name
+
+        candidates = [c for c in self.kinds if c.split(".")[-1] == name]
+        if len(candidates) != 1:
+            raise KeyError(name)
+
+        return candidates[0]
+
+    def _map(self, file_name, dtype, shape):
+        """ Memory-maps a column file.
+
+        :param file_name: Name of the file inside the dump folder.
+        :type file_name: str
+        :param dtype: Data type of the entries.
+        :param shape: Shape of the mapped array.
+        :type shape: tuple
+        :return: The memory-mapped array.
+        :rtype: numpy.memmap
+        """
+
+        # Empty files can not be mapped.
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+
+        return np.memmap(os.path.join(self.path, file_name), dtype=dtype, mode='r', shape=shape)
+
+    def get_raw(self, name):
+        """ Gets the raw (memory-mapped) data of a column. For hex columns, the blob and the offsets are returned. Null
+        values are kept as NULL and categories as codes.
+
+        :param name: Column name.
+        :type name: str
+        :return: The column data.
+        :rtype: numpy.memmap or tuple
+        """
+
+        name = self.resolve(name)
+        kind = self.kinds[name]
+
+        if kind == "txid":
+            return self._map(name + ".bin", np.uint8, (self.rows, 32))
+        elif kind == "hex":
+            offsets = self._map(name + ".offsets.bin", '<i8', (self.rows + 1,))
+            blob = self._map(name + ".bin", np.uint8, (int(offsets[-1]),))
+            return blob, offsets
+        elif kind == "nullable":
+            return self._map(name + ".bin", '<i8', (self.rows,))
+        elif kind == "category":
+            return self._map(name + ".bin", '<u2', (self.rows,))
+        else:
+            return self._map(name + ".bin", kind, (self.rows,))
+
+    def get_column(self, name, start=0, stop=None):
+        """ Gets the values of a column (or a slice of it). Numeric columns are returned as numpy arrays (memory-mapped
+        if no slice is requested), while the rest are decoded into lists of values, as found in the json dumps.
+
+        :param name: Column name.
+        :type name: str
+        :param start: First row of the slice.
+        :type start: int
+        :param stop: Row after the last one of the slice (None for the end of the column).
+        :type stop: int
+        :return: The column values.
+        :rtype: numpy.ndarray or list
+        """
+
+        name = self.resolve(name)
+        kind = self.kinds[name]
+        stop = self.rows if stop is None else min(stop, self.rows)
+        raw = self.get_raw(name)
+
+        if kind == "txid":
+            return [hexlify(v.tostring()) for v in raw[start:stop]]
+        elif kind == "hex":
+            blob, offsets = raw
+            offsets = np.array(offsets[start:stop + 1])
+            data = blob[offsets[0]:offsets[-1]].tostring() if len(offsets) else ""
+            offsets -= offsets[0] if len(offsets) else 0
+            return [hexlify(data[o0:o1]) for o0, o1 in zip(offsets[:-1], offsets[1:])]
+        elif kind == "nullable":
+            return [None if v == NULL else v for v in raw[start:stop].tolist()]
+        elif kind == "category":
+            categories = self.categories[name]
+            return [categories[c] for c in raw[start:stop].tolist()]
+        elif start == 0 and stop == self.rows:
+            return raw
+        else:
+            return raw[start:stop]
+
+    def get_outpoints(self, start=0, stop=None):
+        """ Gets the outpoints (tx_id and index columns) of the rows of a utxo dump (or a slice of them), without
+        turning transaction ids into hex.
+
+        :param start: First row of the slice.
+        :type start: int
+        :param stop: Row after the last one of the slice (None for the end of the dump).
+        :type stop: int
+        :return: The outpoints.
+        :rtype: numpy.ndarray (of OUTPOINT items)
+        """
+
+        stop = self.rows if stop is None else min(stop, self.rows)
+
+        outpoints = np.empty(max(stop - start, 0), dtype=OUTPOINT)
+        outpoints["tx_id"] = self.get_raw("tx_id")[start:stop]
+        outpoints["index"] = self.get_raw("index")[start:stop]
+
+        return outpoints
+
+    def iter_rows(self, columns=None, chunk_size=100000):
+        """ Iterates over the rows of the dump, building the same dictionaries found in the json dumps.
+
+        :param columns: Columns to be included in the rows (all by default).
+        :type columns: list of str
+        :param chunk_size: Number of rows decoded at once.
+        :type chunk_size: int
+        :return: Generator of rows.
+        """
+
+        names = [c for c, _ in self.schema] if columns is None else [self.resolve(c) for c in columns]
+
+        for start in range(0, self.rows, chunk_size):
+            values = []
+            for name in names:
+                column = self.get_column(name, start, start + chunk_size)
+                values.append(column.tolist() if isinstance(column, np.ndarray) else column)
+
+            for row_values in zip(*values):
+                row = dict()
+                for name, value in zip(names, row_values):
+                    set_field(row, name, value)
+                yield row
+
+
+class JsonWriter(object):
+    """ Writes rows to a json dump (one json object per line). Same interface as ColumnWriter.
+    """
+
+    def __init__(self, fout_name, sort_keys=False, state=None, schema=None):
+        self.sort_keys = sort_keys
+        self.schema = schema
+
+        # Compressed or not, depending on the name of the dump (see compression.py).
+        self.fout = open_dump(fout_name, 'w', state=state)
+
+    def write(self, row):
+        self.fout.write(encode_chunk([row], "json", self.schema, self.sort_keys))
+
+    def write_chunk(self, lines):
+        self.fout.write(lines)
+
+    def get_state(self):
+        return get_file_state(self.fout)
+
+    def close(self):
+        self.fout.close()
+
+
+def encode_chunk(rows, fmt, schema, sort_keys=False):
+    """
+    Encodes a chunk of rows, so it can be written with the write_chunk method of a writer of the given format. The
+    function does not depend on the writer state, so chunks can be encoded by worker processes.
+
+    :param rows: Rows to be encoded.
+    :type rows: list of dict
+    :param fmt: Output format, either 'json' or 'columnar'.
+    :type fmt: str
+    :param schema: Schema of the rows (only the txid columns are used for json dumps).
+    :type schema: list of tuple
+    :param sort_keys: Whether the keys of the json rows are sorted (only used for json dumps).
+    :type sort_keys: bool
+    :return: The encoded chunk.
+    :rtype: str or tuple
+    """
+
+    if fmt == "columnar":
+        return encode_rows(schema, rows)
+
+    # Raw transaction ids are turned into hex (rows are updated in place).
+    for name in [name for name, kind in schema or [] if kind == "txid"]:
+        for row in rows:
+            set_field(row, name, get_hex_tx_id(get_field(row, name)))
+
+    return "".join([ujson.dumps(row, sort_keys=sort_keys) + "\n" for row in rows])
+
+
+def is_columnar(fin_name):
+    """
+    Checks whether a given dump is stored in columnar format.
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: True if the dump is a columnar one, False otherwise.
+    :rtype: bool
+    """
+
+    return os.path.isfile(os.path.join(CFG.data_path + fin_name, META_FILE))
+
+
+def get_sidecar_name(fin_name):
+    """
+    Gets the name of the columnar sidecar of a json dump (a columnar copy of the same data, see build_sidecar).
+
+    :param fin_name: Json dump name.
+    :type fin_name: str
+    :return: The name of the sidecar.
+    :rtype: str
+    """
+
+    return fin_name + ".col"
+
+
+def build_sidecar(fin_name, schema):
+    """
+    Builds a columnar sidecar for a json dump, so attributes can be loaded from it without parsing the json file.
+
+    :param fin_name: Json dump name.
+    :type fin_name: str
+    :param schema: Schema of the rows (DECODED_UTXOS, PARSED_TXS or PARSED_UTXOS).
+    :type schema: list of tuple
+    :return: The name of the sidecar.
+    :rtype: str
+    """
+
+    sidecar_name = get_sidecar_name(fin_name)
+    writer = ColumnWriter(sidecar_name, schema)
+
+    for row in iter_dump(fin_name):
+        writer.write(row)
+
+    writer.close()
+
+    return sidecar_name
+
+
+def find_columnar(fin_name):
+    """
+    Finds the columnar version of a given dump: the dump itself if it is columnar, or its sidecar if it exists and it is
+    up to date (newer than the json dump).
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: The name of the columnar dump, or None if there is none.
+    :rtype: str
+    """
+
+    if is_columnar(fin_name):
+        return fin_name
+
+    sidecar_name = get_sidecar_name(fin_name)
+    if is_columnar(sidecar_name) and os.path.getmtime(os.path.join(CFG.data_path + sidecar_name, META_FILE)) >= \
+            os.path.getmtime(CFG.data_path + fin_name):
+        return sidecar_name
+
+    return None
+
+
+def open_writer(fout_name, fmt, schema, sort_keys=False, state=None):
+    """
+    Opens a writer for a dump in the given format.
+
+    :param fout_name: Dump name.
+    :type fout_name: str
+    :param fmt: Output format, either 'json' or 'columnar'.
+    :type fmt: str
+    :param schema: Schema of the rows (only the txid columns are used for json dumps).
+    :type schema: list of tuple
+    :param sort_keys: Whether the keys of the json rows are sorted (only used for json dumps).
+    :type sort_keys: bool
+    :param state: State of a previous writer (from its get_state method), to resume a dump from that point.
+    :type state: dict
+    :return: The writer.
+    :rtype: JsonWriter or ColumnWriter
+    """
+
+    if fmt == "json":
+        return JsonWriter(fout_name, sort_keys, state=state, schema=schema)
+    elif fmt == "columnar":
+        return ColumnWriter(fout_name, schema, state=state)
+    else:
+        raise Exception("Unknown output format: {}".format(fmt))
+
+
+def iter_dump(fin_name):
+    """
+    Iterates over the rows of a dump, regardless of its format (json or columnar).
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: Generator of rows.
+    """
+
+    if is_columnar(fin_name):
+        for row in ColumnReader(fin_name).iter_rows():
+            yield row
+    else:
+        with open_dump(fin_name) as fin:
+            for line in fin:
+                yield ujson.loads(line[:-1])
@@ -0,0 +1,514 @@
+"""
+Compressed streams for the files dumped by STATUS (decoded_utxos, parsed_txs, parsed_utxos, ...).
+
+The codec of a dump is given by the extension of its name (see CODECS): '.gz' (gzip, always available), '.zst' (zstd,
+requires the zstandard package) or '.lz4' (lz4, requires the lz4 package). Any other name is a plain text file.
+
+Compressed dumps are written as a sequence of independent frames of the codec (each one holding frame_size bytes of
+uncompressed data), so they are still valid gzip / zstd / lz4 files (e.g. they can be read with zcat or zstdcat).
+Frames are compressed by a background thread while the next one is being filled. The position of every frame (both in
+the compressed and in the uncompressed stream) is stored in an index next to the dump (see get_index_name), so readers
+can seek to any uncompressed offset by decompressing a single frame.
+
+open_dump gives back a file-like object (read, readline, iteration, seek and tell over uncompressed offsets, write) for
+both plain and compressed dumps, so the rest of the code does not need to know whether a dump is compressed or not.
+"""
+
+from bitcoin_tools import CFG
+from bisect import bisect_right
+from threading import Thread
+from Queue import Queue
+import numpy as np
+import zlib
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+CODECS = {".gz": "gzip", ".zst": "zstd", ".lz4": "lz4"}
+
+
+def get_codec(fin_name):
+    """
+    Gets the codec of a dump from its name.
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: The codec name ('gzip', 'zstd' or 'lz4'), or None for plain dumps.
+    :rtype: str
+    """
+
+    codec = CODECS.get(os.path.splitext(fin_name)[1])
+
+    if codec == "zstd" and zstandard is None:
+        raise Exception("zstd compressed dumps require the zstandard package.")
+    elif codec == "lz4" and lz4_frame is None:
+        raise Exception("lz4 compressed dumps require the lz4 package.")
+
+    return codec
+
+
+def get_index_name(fin_name):
+    """
+    Gets the name of the frame index of a compressed dump.
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: The name of the index file.
+    :rtype: str
+    """
+
+    return fin_name + ".idx"
+
+
+def compress_frame(data, codec, level=None):
+    """
+    Compresses a block of data into a single, self-contained frame of the given codec.
+
+    :param data: Data to be compressed.
+    :type data: str
+    :param codec: Codec name.
+    :type codec: str
+    :param level: Compression level (None for the default level: 1 for gzip, which is several times faster than the
+    usual 6 for a slightly worse ratio, and the usual default for zstd and lz4).
+    :type level: int
+    :return: The compressed frame.
+    :rtype: str
+    """
+
+    if codec == "gzip":
+        # wbits = 31 gives gzip members (header and trailer included).
+        compressor = zlib.compressobj(1 if level is None else level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    elif codec == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level, write_content_size=True).compress(data)
+    else:
+        return lz4_frame.compress(data) if level is None else lz4_frame.compress(data, compression_level=level)
+
+
+class FrameDecompressor(object):
+    """ Streaming decompressor for a sequence of frames of a given codec. Unlike the decompressors of the codecs, it
+    keeps going after the end of a frame.
+    """
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.decompressor = self.new_decompressor()
+
+    def new_decompressor(self):
+        if self.codec == "gzip":
+            return zlib.decompressobj(31)
+        elif self.codec == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj()
+        else:
+            return lz4_frame.LZ4FrameDecompressor()
+
+    def decompress(self, data):
+        """
+        Decompresses a block of compressed data.
+
+        :param data: Compressed data (any amount, not necessarily aligned to frames).
+        :type data: str
+        :return: The decompressed data.
+        :rtype: str
+        """
+
+        out = []
+
+        while data:
+            out.append(self.decompressor.decompress(data))
+            data = self.decompressor.unused_data
+
+            # The current frame is over, so the rest of the data belongs to the next one.
+            if data or getattr(self.decompressor, "eof", False):
+                self.decompressor = self.new_decompressor()
+
+        return "".join(out)
+
+
+def load_index(fin_name):
+    """
+    Loads the frame index of a compressed dump.
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: Array of (compressed offset, uncompressed offset) pairs, one per frame plus a final one with the size of
+    both streams, or None if the dump has no index.
+    :rtype: numpy.ndarray
+    """
+
+    try:
+        return np.fromfile(CFG.data_path + get_index_name(fin_name), dtype='<i8').reshape(-1, 2)
+    except IOError:
+        return None
+
+
+class CompressedReader(object):
+    """ File-like reader over the uncompressed data of a compressed dump.
+    """
+
+    def __init__(self, fin_name, block_size=2 ** 20):
+        self.codec = get_codec(fin_name)
+        self.fin = open(CFG.data_path + fin_name, 'rb')
+        self.block_size = block_size
+        self.index = load_index(fin_name)
+        self.decompressor = FrameDecompressor(self.codec)
+
+        # Decompressed data not read yet: buffer[i:] starts at the uncompressed offset pos + i.
+        self.buffer = ""
+        self.i = 0
+        self.pos = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        # Lines are split a whole block at a time, which is much faster than calling readline for each of them.
+        while True:
+            last = self.buffer.rfind("\n")
+
+            if last >= self.i:
+                lines = self.buffer[self.i:last].split("\n")
+                self.i = last + 1
+                for line in lines:
+                    yield line + "\n"
+
+            if not self._fill():
+                if self.i < len(self.buffer):
+                    line, self.i = self.buffer[self.i:], len(self.buffer)
+                    yield line
+                return
+
+    def next(self):
+        line = self.readline()
+
+        if not line:
+            raise StopIteration
+
+        return line
+
+    def _fill(self):
+        """ Decompresses the next block of the dump into the buffer.
+
+        :return: False if the end of the dump has been reached, True otherwise.
+        :rtype: bool
+        """
+
+        data = self.fin.read(self.block_size)
+
+        if not data:
+            return False
+
+        self.pos += self.i
+        self.buffer = self.buffer[self.i:] + self.decompressor.decompress(data)
+        self.i = 0
+
+        return True
+
+    def read(self, size=-1):
+        # Data is collected in parts, so the buffer is not copied over and over for large reads.
+        parts = []
+
+        while True:
+            available = len(self.buffer) - self.i
+
+            if 0 <= size <= available:
+                parts.append(self.buffer[self.i:self.i + size])
+                self.i += size
+                break
+
+            parts.append(self.buffer[self.i:])
+            self.i = len(self.buffer)
+            size -= available if size > 0 else 0
+
+            if not self._fill():
+                break
+
+        return "".join(parts)
+
+    def readline(self):
+        end = self.buffer.find("\n", self.i)
+
+        while end < 0:
+            searched = len(self.buffer) - self.i
+            if not self._fill():
+                end = len(self.buffer) - 1
+                break
+            end = self.buffer.find("\n", self.i + searched)
+
+        line = self.buffer[self.i:end + 1]
+        self.i = end + 1
+
+        return line
+
+    def tell(self):
+        return self.pos + self.i
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence != os.SEEK_SET:
+            raise Exception("Compressed dumps can only be seeked from the beginning.")
+
+        # Seeking within the buffered data.
+        if self.pos <= offset <= self.pos + len(self.buffer):
+            self.i = offset - self.pos
+            return
+
+        # The closest frame before the offset is found in the index. Otherwise, the dump is read from the beginning.
+        if self.index is not None and len(self.index):
+            frame = max(bisect_right(self.index[:, 1].tolist(), offset) - 1, 0)
+            compressed_offset, self.pos = [int(x) for x in self.index[frame]]
+        elif offset >= self.pos:
+            compressed_offset = None
+        else:
+            compressed_offset, self.pos = 0, 0
+
+        if compressed_offset is not None:
+            self.fin.seek(compressed_offset)
+            self.decompressor = FrameDecompressor(self.codec)
+            self.buffer, self.i = "", 0
+
+        # Data is skipped (and dropped) up to the offset.
+        while self.pos + len(self.buffer) < offset:
+            self.i = len(self.buffer)
+            if not self._fill():
+                break
+
+        self.i = min(offset - self.pos, len(self.buffer))
+
+    def get_size(self):
+        """ Gets the uncompressed size of the dump, by decompressing it up to the end. The read position is kept.
+
+        :return: The size of the dump in bytes.
+        :rtype: int
+        """
+
+        offset = self.tell()
+
+        while self._fill():
+            pass
+        size = self.pos + len(self.buffer)
+
+        self.seek(offset)
+
+        return size
+
+    def close(self):
+        self.fin.close()
+
+
+class CompressedWriter(object):
+    """ File-like writer for a compressed dump. Written data is split in frames of frame_size bytes, that are compressed
+    and written by a background thread.
+    """
+
+    def __init__(self, fout_name, frame_size=2 ** 22, level=None, state=None):
+        """
+        :param fout_name: Dump name.
+        :type fout_name: str
+        :param frame_size: Uncompressed size of every frame.
+        :type frame_size: int
+        :param level: Compression level (None for the default level of the codec).
+        :type level: int
+        :param state: State of a previous writer of the same dump (from get_state). If given, the dump is truncated to
+        that state and new data is appended from there.
+        :type state: dict
+        """
+
+        self.codec = get_codec(fout_name)
+        self.index_path = CFG.data_path + get_index_name(fout_name)
+        self.frame_size = frame_size
+        self.level = level
+        self.pending = []
+        self.pending_size = 0
+
+        if state is None:
+            self.fout = open(CFG.data_path + fout_name, 'wb')
+            self.index = []
+            self.size = 0
+        else:
+            self.fout = open(CFG.data_path + fout_name, 'r+b')
+            self.fout.truncate(state["offset"])
+            self.fout.seek(0, os.SEEK_END)
+            self.index = [(int(c), int(u)) for c, u in load_index(fout_name) if c < state["offset"]]
+            self.size = state["size"]
+
+        # Uncompressed size of the data already handed to the compression thread.
+        self.submitted = self.size
+        self.error = None
+
+        # Frames are handed to the compression thread through a bounded queue, so the writer blocks if the thread
+        # falls behind.
+        self.queue = Queue(maxsize=4)
+        self.thread = Thread(target=self._compress_frames)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _compress_frames(self):
+        while True:
+            data = self.queue.get()
+
+            try:
+                if data is not None and self.error is None:
+                    self.index.append((self.fout.tell(), self.size))
+                    self.fout.write(compress_frame(data, self.codec, self.level))
+                    self.size += len(data)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+            if data is None:
+                break
+
+    def _submit(self, final=False):
+        if self.error is not None:
+            raise self.error
+
+        if self.pending:
+            data = "".join(self.pending)
+
+            # Only full frames are submitted while writing. The remainder is kept pending, and is only submitted as a
+            # partial frame when the writer is flushed (final).
+            end = len(data) if final else len(data) - len(data) % self.frame_size
+
+            for start in range(0, end, self.frame_size):
+                frame = data[start:min(start + self.frame_size, end)]
+                self.queue.put(frame)
+                self.submitted += len(frame)
+
+            self.pending = [data[end:]] if end < len(data) else []
+            self.pending_size = len(data) - end
+
+    def write(self, data):
+        self.pending.append(data)
+        self.pending_size += len(data)
+
+        if self.pending_size >= self.frame_size:
+            self._submit()
+
+    def tell(self):
+        return self.submitted + self.pending_size
+
+    def flush(self):
+        """ Compresses and writes all the pending data (closing the current frame), and stores the index.
+
+        :return: None
+        :rtype: None
+        """
+
+        self._submit(final=True)
+        self.queue.join()
+
+        if self.error is not None:
+            raise self.error
+
+        self.fout.flush()
+
+        index = self.index + [(self.fout.tell(), self.size)]
+        np.array(index, dtype='<i8').tofile(self.index_path)
+
+    def get_state(self):
+        """ Writes all the pending data to disk and gets the state of the writer, so the dump can be resumed from this
+        point later on (see the state parameter of the constructor).
+
+        :return: The state of the writer.
+        :rtype: dict
+        """
+
+        self.flush()
+        os.fsync(self.fout.fileno())
+
+        return {"offset": self.fout.tell(), "size": self.size}
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+        self.fout.close()
+
+
+def open_dump(fin_name, mode='r', state=None):
+    """
+    Opens a dump for reading or writing, compressed or not depending on its name (see get_codec).
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :param mode: Either 'r' or 'w'.
+    :type mode: str
+    :param state: State of a previous writer of the same dump (from get_file_state), to resume writing from that point
+    (only for mode 'w').
+    :type state: dict
+    :return: The open dump.
+    :rtype: file, CompressedReader or CompressedWriter
+    """
+
+    if get_codec(fin_name) is None:
+        if mode == 'r' or state is None:
+            return open(CFG.data_path + fin_name, mode + 'b')
+
+        fout = open(CFG.data_path + fin_name, 'r+b')
+        fout.truncate(state["offset"])
+        fout.seek(0, os.SEEK_END)
+        return fout
+
+    elif mode == 'r':
+        return CompressedReader(fin_name)
+    else:
+        return CompressedWriter(fin_name, state=state)
+
+
+def get_file_state(fout):
+    """
+    Writes all the pending data of a dump open for writing to disk, and gets its state (see open_dump).
+
+    :param fout: Open dump.
+    :type fout: file or CompressedWriter
+    :return: The state of the dump.
+    :rtype: dict
+    """
+
+    if isinstance(fout, CompressedWriter):
+        return fout.get_state()
+
+    fout.flush()
+    os.fsync(fout.fileno())
+
+    return {"offset": fout.tell()}
+
+
+def get_dump_size(fin_name):
+    """
+    Gets the (uncompressed) size of a dump.
+
+    :param fin_name: Dump name.
+    :type fin_name: str
+    :return: The size of the dump in bytes.
+    :rtype: int
+    """
+
+    if get_codec(fin_name) is None:
+        return os.path.getsize(CFG.data_path + fin_name)
+
+    index = load_index(fin_name)
+    if index is not None and len(index):
+        return int(index[-1][1])
+
+    # Compressed dumps with no index (e.g. compressed by some other tool) have to be read.
+    with CompressedReader(fin_name) as fin:
+        return fin.get_size()
@@ -1,33 +1,32 @@
-from bitcoin_tools import CFG
 from bitcoin_tools.analysis.status import FEE_STEP
+from bitcoin_tools.analysis.status.columnar import PARSED_TXS, PARSED_UTXOS, open_writer, iter_dump, is_columnar, \
+    encode_chunk, ColumnReader
 from bitcoin_tools.analysis.status.utils import check_multisig, get_min_input_size, roundup_rate, check_multisig_type, \
-    get_serialized_size_fast, get_est_input_size, load_estimation_data, check_native_segwit
+    get_serialized_size_fast, get_est_input_size, load_estimation_data, check_native_segwit, get_outpoint_key, \
+    merge_walk, iter_chainstate, classify_scripts, get_min_input_size_batch, get_est_input_size_batch, \
+    get_serialized_size_batch, roundup_rate_batch, SCRIPT_P2WPKH, SCRIPT_P2WSH
+from bitcoin_tools.analysis.status.compression import open_dump, get_dump_size
+from multiprocessing import Pool
+import numpy as np
 import ujson
 
 
-def transaction_dump(fin_name, fout_name):
+class TxAggregator(object):
+    """ Aggregates a stream of decoded utxos (sorted in chainstate order) by transaction. Every aggregated transaction is
+    handed to the given sinks (any function that takes a dict, such as the write method of an output file or the add
+    method of an analysis consumer).
     """
-    Reads from a parsed utxo file and dumps additional metadata related to transactions.
 
-    :param fin_name: Name of the parsed utxo file.
-    :type fin_name: str
-    :param fout_name: Name of the file where the final data will be stored.
-    :type fout_name: str
-    :return: None
-    :rtype: None
-    """
-    # Transaction dump
-
-    # Set the input and output files
-    fin = open(CFG.data_path + fin_name, 'r')
-    fout = open(CFG.data_path + fout_name, 'w')
+    def __init__(self, sinks):
+        self.sinks = sinks
+        self.tx = dict()
 
-    # Initial definition
-    tx = dict()
+    def emit(self, tx):
+        for sink in self.sinks:
+            sink(tx)
 
-    # Read the ordered file and aggregate the data by transaction.
-    for line in fin:
-        utxo = ujson.loads(line[:-1])
+    def add(self, utxo):
+        tx = self.tx
 
         # If the read line contains information of the same transaction we are analyzing we add it to our dictionary
         if utxo.get('tx_id') == tx.get('tx_id'):
@@ -39,7 +38,8 @@ def transaction_dump(fin_name, fout_name):
         else:
             # Save previous transaction data
             if tx:
-                fout.write(ujson.dumps(tx) + '\n')
+                self.emit(tx)
+                tx = self.tx = dict()
 
             # Create the new transaction
             tx['tx_id'] = utxo.get('tx_id')
@@ -49,12 +49,230 @@ def transaction_dump(fin_name, fout_name):
             tx['height'] = utxo["height"]
             tx['coinbase'] = utxo["coinbase"]
 
-    fout.write(ujson.dumps(tx) + '\n')
-    fin.close()
+    def close(self):
+        """ Hands the last transaction to the sinks.
+
+        :return: None
+        :rtype: None
+        """
+
+        if self.tx:
+            self.emit(self.tx)
+            self.tx = dict()
+
+
+class UtxoMetadata(object):
+    """ Computes the additional metadata of a stream of decoded utxos. Utxos are processed in batches of batch_size (see
+    get_utxo_metadata_batch), and every result is handed to the given sinks (any function that takes a dict, such as the
+    write method of an output file or the add method of an analysis consumer), in the same order utxos were added.
+    """
+
+    def __init__(self, sinks, coin, count_p2sh=False, non_std_only=False, batch_size=10000):
+        self.sinks = sinks
+        self.coin = coin
+        self.count_p2sh = count_p2sh
+        self.non_std_only = non_std_only
+        self.batch_size = batch_size
+        self.batch = []
+
+        self.estimation_data = load_estimation_data(coin)
+
+    def add(self, utxo):
+        self.batch.append(utxo)
+
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Computes the metadata of the pending utxos and hands the results to the sinks.
+
+        :return: None
+        :rtype: None
+        """
+
+        batch, self.batch = self.batch, []
+
+        for result in get_utxo_metadata_batch(batch, self.coin, self.estimation_data, self.count_p2sh,
+                                              self.non_std_only):
+            for sink in self.sinks:
+                sink(result)
+
+    def close(self):
+        self.flush()
+
+
+def get_tx_ranges(fin_name, range_size):
+    """
+    Splits a decoded utxo file (sorted in chainstate order) in ranges that start and end on transaction boundaries, so
+    every range can be aggregated by transaction on its own.
+
+    :param fin_name: Name of the decoded utxo file (either json or columnar).
+    :type fin_name: str
+    :param range_size: Approximate size of every range, in bytes for json files and in rows for columnar ones.
+    :type range_size: int
+    :return: List of (start, stop) ranges (byte offsets for json files and rows for columnar ones).
+    :rtype: list of tuple
+    """
+
+    bounds = [0]
+
+    if is_columnar(fin_name):
+        tx_ids = ColumnReader(fin_name).get_raw("tx_id")
+        end = len(tx_ids)
+
+        pos = range_size
+        while pos < end:
+            # Moves forward up to the first utxo of the next transaction.
+            while pos < end and (tx_ids[pos] == tx_ids[pos - 1]).all():
+                pos += 1
+
+            if pos < end:
+                bounds.append(pos)
+
+            pos += range_size
+
+    else:
+        end = get_dump_size(fin_name)
+
+        with open_dump(fin_name) as fin:
+            pos = range_size
+            while pos < end:
+                # Moves to the beginning of the next line, and from there up to the first utxo of the next transaction.
+                fin.seek(pos - 1)
+                fin.readline()
+
+                tx_id = None
+                while True:
+                    pos = fin.tell()
+                    line = fin.readline()
+
+                    if not line:
+                        break
+
+                    line_tx_id = ujson.loads(line)['tx_id']
+                    if tx_id is not None and line_tx_id != tx_id:
+                        bounds.append(pos)
+                        break
+
+                    tx_id = line_tx_id
+
+                pos += range_size
+
+    bounds.append(end)
+
+    return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if start < stop]
+
+
+def _aggregate_tx_range(args):
+    """
+    Aggregates by transaction a range of a decoded utxo file (from get_tx_ranges). Runs inside the worker processes of
+    transaction_dump.
+
+    :param args: Decoded utxo file name, range start, range stop and output format.
+    :type args: tuple
+    :return: The transactions of the range, encoded in the output format (see columnar.encode_chunk).
+    :rtype: str or tuple
+    """
+
+    fin_name, start, stop, fmt = args
+
+    txs = []
+
+    if is_columnar(fin_name):
+        reader = ColumnReader(fin_name)
+        tx_ids = reader.get_raw("tx_id")[start:stop]
+
+        # Rows of the same transaction are consecutive, so they can be aggregated at once.
+        firsts = np.concatenate([[0], np.flatnonzero((tx_ids[1:] != tx_ids[:-1]).any(axis=1)) + 1])
+        num_utxos = np.diff(np.concatenate([firsts, [len(tx_ids)]]))
+        total_value = np.add.reduceat(reader.get_column("out.amount", start, stop).astype(np.int64), firsts)
+        total_len = np.add.reduceat(reader.get_column("len", start, stop).astype(np.int64), firsts)
+        heights = reader.get_column("height", start, stop)[firsts]
+        coinbase = reader.get_column("coinbase", start, stop)[firsts]
+
+        # Transactions are built with the same fields (and in the same order) TxAggregator does.
+        for i, first in enumerate(firsts.tolist()):
+            tx = dict()
+            # Transaction ids are kept raw, they are turned into hex only if the output is json (see encode_chunk).
+            tx['tx_id'] = tx_ids[first].tostring()
+            tx['num_utxos'] = int(num_utxos[i])
+            tx['total_value'] = int(total_value[i])
+            tx['total_len'] = int(total_len[i])
+            tx['height'] = int(heights[i])
+            tx['coinbase'] = int(coinbase[i])
+            txs.append(tx)
+
+    else:
+        with open_dump(fin_name) as fin:
+            fin.seek(start)
+            lines = fin.read(stop - start).splitlines()
+
+        stage = TxAggregator([txs.append])
+        for line in lines:
+            stage.add(ujson.loads(line))
+        stage.close()
+
+    return encode_chunk(txs, fmt, PARSED_TXS)
+
+
+def transaction_dump(fin_name, fout_name, fmt="json", n_workers=1, range_size=None):
+    """
+    Reads from a parsed utxo file and dumps additional metadata related to transactions.
+
+    If n_workers is bigger than one, the input file is split in ranges on transaction boundaries (see get_tx_ranges)
+    that are aggregated by a pool of worker processes, and written in order, so the result is the same as the one of a
+    single pass.
+
+    :param fin_name: Name of the parsed utxo file (either json or columnar).
+    :type fin_name: str
+    :param fout_name: Name of the file where the final data will be stored.
+    :type fout_name: str
+    :param fmt: Output format, either 'json' (default) or 'columnar' (see columnar.py).
+    :type fmt: str
+    :param n_workers: Number of worker processes.
+    :type n_workers: int
+    :param range_size: Size of the ranges handed to the workers, in bytes for json files (32 MB by default) and in rows
+    for columnar ones (1M by default).
+    :type range_size: int
+    :return: None
+    :rtype: None
+    """
+    # Transaction dump
+
+    # Set the output file
+    fout = open_writer(fout_name, fmt, PARSED_TXS)
+
+    if n_workers > 1:
+        if range_size is None:
+            range_size = 10 ** 6 if is_columnar(fin_name) else 2 ** 25
+
+        ranges = [(fin_name, start, stop, fmt) for start, stop in get_tx_ranges(fin_name, range_size)]
+
+        # Ranges are aggregated in parallel, but results are collected (and written) in order.
+        pool = Pool(n_workers)
+        try:
+            for encoded in pool.imap(_aggregate_tx_range, ranges):
+                fout.write_chunk(encoded)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    else:
+        stage = TxAggregator([fout.write])
+
+        # Read the ordered file and aggregate the data by transaction.
+        for utxo in iter_dump(fin_name):
+            stage.add(utxo)
+
+        stage.close()
+
     fout.close()
 
 
-def utxo_dump(fin_name, fout_name, coin, count_p2sh=False, non_std_only=False):
+def utxo_dump(fin_name, fout_name, coin, count_p2sh=False, non_std_only=False, fmt="json"):
     """
     Reads from a parsed utxo file and dumps additional metadata related to utxos.
 
@@ -62,91 +280,406 @@ def utxo_dump(fin_name, fout_name, coin, count_p2sh=False, non_std_only=False):
     :type non_std_only: bool
     :param count_p2sh: Whether or not count P2SH outputs in the analysis
     :type count_p2sh: bool
-    :param fin_name: Name of the parsed utxo file.
+    :param fin_name: Name of the parsed utxo file (either json or columnar).
     :type fin_name: str
     :param fout_name: Name of the file where the final data will be stored.
     :type fout_name: str
     :param coin: Currency that will be analysed 
+    :param fmt: Output format, either 'json' (default) or 'columnar' (see columnar.py).
+    :type fmt: str
     :return: None
     :rtype: None
     """
 
     # UTXO dump
 
-    # Input file
-    fin = open(CFG.data_path + fin_name, 'r')
     # Output file
-    fout = open(CFG.data_path + fout_name, 'w')
+    fout = open_writer(fout_name, fmt, PARSED_UTXOS)
+    stage = UtxoMetadata([fout.write], coin, count_p2sh, non_std_only)
+
+    for utxo in iter_dump(fin_name):
+        stage.add(utxo)
+
+    stage.close()
+    fout.close()
+
+
+def dump_chainstate(fin_name, ftxs_name, futxos_name, coin, count_p2sh=False, non_std_only=False, fmt="json",
+                    tx_consumers=None, utxo_consumers=None, n_workers=1):
+    """
+    Streams the decoded utxos straight from the chainstate into both the transaction and the utxo dumps, so the same
+    result as running parse_ldb, transaction_dump and utxo_dump is obtained without storing the decoded utxos in an
+    intermediate file. Besides (or instead of) being stored, the parsed data can be handed to analysis consumers (see
+    data_processing.AnalysisEngine).
+
+    :param fin_name: Name of the LevelDB folder.
+    :type fin_name: str
+    :param ftxs_name: Name of the file where the transaction data will be stored (or None, to not store it).
+    :type ftxs_name: str
+    :param futxos_name: Name of the file where the utxo data will be stored (or None, to not store it).
+    :type futxos_name: str
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :param count_p2sh: Whether or not count P2SH outputs in the analysis
+    :type count_p2sh: bool
+    :param non_std_only: Whether or not run the analysis only with non-standard outputs
+    :type non_std_only: bool
+    :param fmt: Output format, either 'json' (default) or 'columnar' (see columnar.py).
+    :type fmt: str
+    :param tx_consumers: Consumers to be fed with the transaction data (objects with an add method).
+    :type tx_consumers: list
+    :param utxo_consumers: Consumers to be fed with the utxo data (objects with an add method).
+    :type utxo_consumers: list
+    :param n_workers: Number of worker processes used to decode the chainstate (see iter_chainstate).
+    :type n_workers: int
+    :return: None
+    :rtype: None
+    """
+
+    fouts = []
+
+    def get_sinks(fout_name, schema, consumers):
+        # Parsed data is handed to the consumers and, if requested, stored.
+        sinks = [consumer.add for consumer in consumers or []]
+        if fout_name:
+            fouts.append(open_writer(fout_name, fmt, schema))
+            sinks.append(fouts[-1].write)
+        return sinks
+
+    stages = [TxAggregator(get_sinks(ftxs_name, PARSED_TXS, tx_consumers)),
+              UtxoMetadata(get_sinks(futxos_name, PARSED_UTXOS, utxo_consumers), coin, count_p2sh, non_std_only)]
+
+    adds = [stage.add for stage in stages]
+
+    for utxo in iter_chainstate(fin_name, n_workers=n_workers):
+        for add in adds:
+            add(utxo)
+
+    for stage in stages:
+        stage.close()
+
+    for fout in fouts:
+        fout.close()
+
+
+def get_utxo_metadata(utxo, coin, estimation_data, count_p2sh=False, non_std_only=False):
+    """
+    Computes the additional metadata of a decoded utxo (as dumped by utxo_dump).
+
+    :param utxo: Decoded utxo (from parse_ldb).
+    :type utxo: dict
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :param estimation_data: Estimation data (from load_estimation_data).
+    :type estimation_data: tuple
+    :param count_p2sh: Whether or not count P2SH outputs in the analysis
+    :type count_p2sh: bool
+    :param non_std_only: Whether or not run the analysis only with non-standard outputs
+    :type non_std_only: bool
+    :return: The utxo metadata, or None if the utxo is not part of the analysis.
+    :rtype: dict
+    """
 
     # Standard UTXO types
     std_types = [0, 1, 2, 3, 4, 5]
 
-    p2pkh_pksize, p2sh_scriptsize, nonstd_scriptsize, p2wsh_scriptsize, max_height = load_estimation_data(coin)
+    p2pkh_pksize, p2sh_scriptsize, nonstd_scriptsize, p2wsh_scriptsize, max_height = estimation_data
+
+    tx_id = utxo.get('tx_id')
+    out = utxo.get("out")
+
+    # Checks whether we are looking for every type of UTXO or just for non-standard ones.
+    if not non_std_only or (non_std_only and out["out_type"] not in std_types and not check_multisig(out['data'])):
+
+        # Calculates the dust threshold for every UTXO value and every fee per byte ratio between min and max.
+        min_size = get_min_input_size(out, utxo["height"], count_p2sh, coin)
+
+        if min_size > 0:
+            # For 0.15 onwards an estimation of the length of the transaction that will include the UTXO is
+            # computed.
+            out_size = get_serialized_size_fast(out)
+            # prev_tx_id (32 bytes) + prev_out_index (4 bytes) + scripSig_len (1 byte) + (PUSH sig + 72-byte
+            # sig) (73 bytes) + (PUSH pk + compressed pk) (34 bytes) + nSequence (4 bytes)
+            in_size = 32 + 4 + 1 + 73 + 34 + 4
+            raw_dust = out["amount"] / float(out_size + in_size)
+
+            raw_np = out["amount"] / float(min_size)
+            raw_np_est = out["amount"] / float(get_est_input_size(out, utxo["height"], p2pkh_pksize,
+                                                                  p2sh_scriptsize,nonstd_scriptsize,
+                                                                  p2wsh_scriptsize, max_height))
+
+            dust = roundup_rate(raw_dust, FEE_STEP)
+            non_profitable = roundup_rate(raw_np, FEE_STEP)
+            non_profitable_est = roundup_rate(raw_np_est, FEE_STEP)
+
+            # Adds multisig type info
+            if out["out_type"] in [0, 1, 2, 3, 4, 5]:
+                non_std_type = "std"
+            else:
+                multisig = check_multisig_type(out["data"])
+                segwit = check_native_segwit(out["data"])
+                if multisig:
+                    non_std_type = multisig
+                elif segwit[0]:
+                    non_std_type = segwit[1]
+                else:
+                    non_std_type = False
+
+            # Builds the output dictionary
+            result = {"tx_id": tx_id,
+                      "tx_height": utxo["height"],
+                      "utxo_data_len": len(out["data"]) / 2,
+                      "dust": dust,
+                      "non_profitable": non_profitable,
+                      "non_profitable_est": non_profitable_est,
+                      "non_std_type": non_std_type,
+                      "index": utxo['index'],
+                      "register_len": utxo['len']}
+
+            # Additional data used to explain dust figures (describes the size taken into account by each metric
+            # when computing dust/unprofitability). It is not used in most of the cases, and generates overhead
+            # in both size and time of execution, so ity is not added by default. Uncomment if necessary.
+
+            # result["dust_size"] = out_size + in_size
+            # result["min_size"] = min_size
+            # result["est_size"] = get_est_input_size(out, utxo["height"], p2pkh_pksize, p2sh_scriptsize,
+            #                                         nonstd_scriptsize, p2wsh_scriptsize)}
+
+            # Updates the dictionary with the remaining data from out.
+            result.update(out)
+
+            return result
+
+    return None
+
+
+def get_utxo_metadata_batch(utxos, coin, estimation_data, count_p2sh=False, non_std_only=False):
+    """
+    Computes the additional metadata of a batch of decoded utxos. The results are exactly the same as the ones of
+    get_utxo_metadata, but the dust and non-profitability rates of the whole batch are computed at once with numpy.
+
+    :param utxos: Decoded utxos (from parse_ldb).
+    :type utxos: list of dict
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :param estimation_data: Estimation data (from load_estimation_data).
+    :type estimation_data: tuple
+    :param count_p2sh: Whether or not count P2SH outputs in the analysis
+    :type count_p2sh: bool
+    :param non_std_only: Whether or not run the analysis only with non-standard outputs
+    :type non_std_only: bool
+    :return: The metadata of the utxos that are part of the analysis, in the same order.
+    :rtype: list of dict
+    """
+
+    # Standard UTXO types
+    std_types = [0, 1, 2, 3, 4, 5]
+
+    # Checks whether we are looking for every type of UTXO or just for non-standard ones.
+    if non_std_only:
+        utxos = [utxo for utxo in utxos if utxo["out"]["out_type"] not in std_types and
+                 not check_multisig(utxo["out"]["data"])]
+
+    if not utxos:
+        return []
+
+    outs = [utxo["out"] for utxo in utxos]
+    out_types = np.array([out["out_type"] for out in outs], dtype=np.int64)
+    heights = np.array([utxo["height"] for utxo in utxos], dtype=np.int64)
+    amounts = np.array([out["amount"] for out in outs], dtype=np.float64)
+    scripts = [out["data"] for out in outs]
+    data_lens = np.array([len(script) / 2 for script in scripts], dtype=np.int64)
+
+    classes, req_sigs = classify_scripts(out_types, scripts)
+
+    selected, raw_dust, raw_np, raw_np_est = get_raw_rates_batch(out_types, heights, amounts, data_lens, classes,
+                                                                 req_sigs, coin, estimation_data, count_p2sh)
+
+    dust = roundup_rate_batch(raw_dust, FEE_STEP)
+    np_rates = roundup_rate_batch(raw_np, FEE_STEP)
+    np_est = roundup_rate_batch(raw_np_est, FEE_STEP)
+
+    classes = classes.tolist()
+
+    results = []
+    for i, j in enumerate(selected.tolist()):
+        utxo = utxos[j]
+        out = outs[j]
+
+        # Adds multisig type info (native segwit scripts are never multisig).
+        if out["out_type"] in [0, 1, 2, 3, 4, 5]:
+            non_std_type = "std"
+        elif classes[j] == SCRIPT_P2WPKH:
+            non_std_type = "P2WPKH"
+        elif classes[j] == SCRIPT_P2WSH:
+            non_std_type = "P2WSH"
+        else:
+            non_std_type = check_multisig_type(out["data"])
+
+        # Builds the output dictionary (see get_utxo_metadata)
+        result = {"tx_id": utxo.get('tx_id'),
+                  "tx_height": utxo["height"],
+                  "utxo_data_len": len(out["data"]) / 2,
+                  "dust": dust[i],
+                  "non_profitable": np_rates[i],
+                  "non_profitable_est": np_est[i],
+                  "non_std_type": non_std_type,
+                  "index": utxo['index'],
+                  "register_len": utxo['len']}
+
+        # Updates the dictionary with the remaining data from out.
+        result.update(out)
+
+        results.append(result)
+
+    return results
+
+
+def get_raw_rates_batch(out_types, heights, amounts, data_lens, classes, req_sigs, coin, estimation_data,
+                        count_p2sh=False):
+    """
+    Computes the raw (not rounded) dust and non-profitability rates of a batch of utxos, given as columns. Utxos with no
+    minimum input size (P2SH when count_p2sh is not set) are not part of the analysis, so only the rates of the selected
+    ones are returned.
+
+    :param out_types: Output types.
+    :type out_types: numpy.ndarray
+    :param heights: Block heights where the utxos were created.
+    :type heights: numpy.ndarray
+    :param amounts: Amounts of the utxos (as floats).
+    :type amounts: numpy.ndarray
+    :param data_lens: Length (in bytes) of the stored data of every output.
+    :type data_lens: numpy.ndarray
+    :param classes: Script classes (from classify_scripts).
+    :type classes: numpy.ndarray
+    :param req_sigs: Required signatures of multisig scripts (from classify_scripts).
+    :type req_sigs: numpy.ndarray
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :param estimation_data: Estimation data (from load_estimation_data).
+    :type estimation_data: tuple
+    :param count_p2sh: Whether or not count P2SH outputs in the analysis
+    :type count_p2sh: bool
+    :return: The indexes of the selected utxos, and their dust, non-profitable and estimated non-profitable raw rates.
+    :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray
+    """
+
+    p2pkh_pksize, p2sh_scriptsize, nonstd_scriptsize, p2wsh_scriptsize, max_height = estimation_data
+
+    # Calculates the dust threshold for every UTXO value and every fee per byte ratio between min and max.
+    min_size = get_min_input_size_batch(out_types, heights, classes, req_sigs, count_p2sh, coin)
+    selected = np.flatnonzero(min_size > 0)
+
+    # prev_tx_id (32 bytes) + prev_out_index (4 bytes) + scripSig_len (1 byte) + (PUSH sig + 72-byte sig) (73 bytes) +
+    # (PUSH pk + compressed pk) (34 bytes) + nSequence (4 bytes)
+    in_size = 32 + 4 + 1 + 73 + 34 + 4
+    out_size = get_serialized_size_batch(out_types[selected], data_lens[selected])
+    est_size = get_est_input_size_batch(out_types[selected], heights[selected], classes[selected], req_sigs[selected],
+                                        p2pkh_pksize, p2sh_scriptsize, nonstd_scriptsize, p2wsh_scriptsize)
+
+    amounts = amounts[selected]
+
+    return selected, amounts / (out_size + in_size), amounts / min_size[selected], amounts / est_size
+
+
+def _read_keyed(fin):
+    """
+    Reads a dumped utxo file, yielding every entry along with its chainstate key.
+
+    :param fin: Dumped utxo file (sorted in chainstate order).
+    :type fin: file
+    :return: Generator of (key, (line, utxo)) tuples.
+    """
 
     for line in fin:
         utxo = ujson.loads(line[:-1])
-        tx_id = utxo.get('tx_id')
-        out = utxo.get("out")
-
-        # Checks whether we are looking for every type of UTXO or just for non-standard ones.
-        if not non_std_only or (non_std_only and out["out_type"] not in std_types and not check_multisig(out['data'])):
-
-            # Calculates the dust threshold for every UTXO value and every fee per byte ratio between min and max.
-            min_size = get_min_input_size(out, utxo["height"], count_p2sh, coin)
-
-            if min_size > 0:
-                # For 0.15 onwards an estimation of the length of the transaction that will include the UTXO is
-                # computed.
-                out_size = get_serialized_size_fast(out)
-                # prev_tx_id (32 bytes) + prev_out_index (4 bytes) + scripSig_len (1 byte) + (PUSH sig + 72-byte
-                # sig) (73 bytes) + (PUSH pk + compressed pk) (34 bytes) + nSequence (4 bytes)
-                in_size = 32 + 4 + 1 + 73 + 34 + 4
-                raw_dust = out["amount"] / float(out_size + in_size)
-
-                raw_np = out["amount"] / float(min_size)
-                raw_np_est = out["amount"] / float(get_est_input_size(out, utxo["height"], p2pkh_pksize,
-                                                                      p2sh_scriptsize,nonstd_scriptsize,
-                                                                      p2wsh_scriptsize, max_height))
-
-                dust = roundup_rate(raw_dust, FEE_STEP)
-                np = roundup_rate(raw_np, FEE_STEP)
-                np_est = roundup_rate(raw_np_est, FEE_STEP)
-
-                # Adds multisig type info
-                if out["out_type"] in [0, 1, 2, 3, 4, 5]:
-                    non_std_type = "std"
-                else:
-                    multisig = check_multisig_type(out["data"])
-                    segwit = check_native_segwit(out["data"])
-                    if multisig:
-                        non_std_type = multisig
-                    elif segwit[0]:
-                        non_std_type = segwit[1]
-                    else:
-                        non_std_type = False
-
-                # Builds the output dictionary
-                result = {"tx_id": tx_id,
-                          "tx_height": utxo["height"],
-                          "utxo_data_len": len(out["data"]) / 2,
-                          "dust": dust,
-                          "non_profitable": np,
-                          "non_profitable_est": np_est,
-                          "non_std_type": non_std_type,
-                          "index": utxo['index'],
-                          "register_len": utxo['len']}
-
-                # Additional data used to explain dust figures (describes the size taken into account by each metric
-                # when computing dust/unprofitability). It is not used in most of the cases, and generates overhead
-                # in both size and time of execution, so ity is not added by default. Uncomment if necessary.
-
-                # result["dust_size"] = out_size + in_size
-                # result["min_size"] = min_size
-                # result["est_size"] = get_est_input_size(out, utxo["height"], p2pkh_pksize, p2sh_scriptsize,
-                #                                         nonstd_scriptsize, p2wsh_scriptsize)}
-
-                # Updates the dictionary with the remaining data from out, and stores it in disk.
-                result.update(out)
-                fout.write(ujson.dumps(result) + '\n')
+        yield get_outpoint_key(utxo['tx_id'], utxo['index']), (line, utxo)
+
+
+def _read_keyed_groups(fin):
+    """
+    Reads a delta file (from diff_chainstates), grouping the consecutive entries that share the same key (a coin can
+    be both spent and created if its value has changed).
+
+    :param fin: Delta file.
+    :type fin: file
+    :return: Generator of (key, list of utxos) tuples.
+    """
+
+    group_key, group = None, []
+    for key, (_, utxo) in _read_keyed(fin):
+        if key != group_key and group:
+            yield group_key, group
+            group = []
+        group_key = key
+        group.append(utxo)
+
+    if group:
+        yield group_key, group
+
+
+def utxo_dump_delta(fin_name, prev_fin_name, fout_name, coin, count_p2sh=False, non_std_only=False,
+                    fdelta_name=None):
+    """
+    Updates a previous utxo dump (from utxo_dump) using a delta file (from diff_chainstates), so the metadata is only
+    computed for the created utxos. The result is the same as running utxo_dump over the new chainstate, as long as the
+    same parameters (and estimation data) are used.
+
+    :param fin_name: Name of the delta file.
+    :type fin_name: str
+    :param prev_fin_name: Name of the previous utxo dump (of the old chainstate).
+    :type prev_fin_name: str
+    :param fout_name: Name of the file where the updated data will be stored.
+    :type fout_name: str
+    :param coin: Currency that will be analysed
+    :type coin: str
+    :param count_p2sh: Whether or not count P2SH outputs in the analysis
+    :type count_p2sh: bool
+    :param non_std_only: Whether or not run the analysis only with non-standard outputs
+    :type non_std_only: bool
+    :param fdelta_name: Name of the file where the delta of the utxo dump will be stored (can be used to update a
+    previous dust file with aggregate_dust_np). None by default (not stored).
+    :type fdelta_name: str
+    :return: None
+    :rtype: None
+    """
+
+    fin = open_dump(fin_name)
+    fprev = open_dump(prev_fin_name)
+    fout = open_dump(fout_name, 'w')
+    fdelta = open_dump(fdelta_name, 'w') if fdelta_name else None
+
+    estimation_data = load_estimation_data(coin)
+
+    # Both files are sorted in chainstate order, so they can be merged in a single pass.
+    for key, prev, delta in merge_walk(_read_keyed(fprev), _read_keyed_groups(fin)):
+        if delta is None:
+            # Utxo not affected by the delta.
+            fout.write(prev[0])
+            continue
+
+        for utxo in delta:
+            if utxo['delta'] == -1:
+                # Spent utxos are removed (they may be missing from the previous dump if they were filtered out).
+                if prev is not None:
+                    if fdelta:
+                        prev[1]['delta'] = -1
+                        fdelta.write(ujson.dumps(prev[1]) + '\n')
+                    prev = None
+            else:
+                if prev is not None:
+                    raise Exception("The delta file does not match the previous utxo dump (created utxo found).")
+
+                result = get_utxo_metadata(utxo, coin, estimation_data, count_p2sh, non_std_only)
+
+                if result is not None:
+                    fout.write(ujson.dumps(result) + '\n')
+                    if fdelta:
+                        result['delta'] = 1
+                        fdelta.write(ujson.dumps(result) + '\n')
+
     fin.close()
+    fprev.close()
     fout.close()
+    if fdelta:
+        fdelta.close()
@@ -1,40 +1,208 @@
 from bitcoin_tools.analysis.status import *
+from bitcoin_tools.analysis.status.columnar import ColumnReader, find_columnar, iter_dump
+from bitcoin_tools.analysis.status.compression import open_dump
+from collections import Counter, OrderedDict
+from array import array
+import numpy as np
 import ujson
 
 
 def get_samples(x_attribute, fin_name):
     """
-    Reads data from .json files and creates a list with the attribute of interest values.
+    Reads data from .json files and creates an array with the attribute of interest values.
+
+    If the file is a columnar dump (or it has an up to date columnar sidecar, see columnar.build_sidecar), only the
+    requested columns are loaded (memory-mapped). Otherwise, the file is streamed and only the requested fields are
+    extracted from every line.
 
     :param x_attribute: Attribute to plot (must be a key in the dictionary of the dumped data).
     :type x_attribute: str or list
     :param fin_name: Input file from which data is loaded.
     :type fin_name: str
-    :return: A dictionary with x_attribute as keys and a list of the requested samples as values.
+    :return: A dictionary with x_attribute as keys and an array of the requested samples as values.
     :rtype: dict
     """
 
-    fin = open(CFG.data_path + fin_name, 'r')
     samples = dict()
 
     if not isinstance(x_attribute, list):
         x_attribute = [x_attribute]
 
-    # Create one list per each attribute requested
-    for attribute in x_attribute:
-        samples[attribute] = []
+    columnar_name = find_columnar(fin_name)
 
-    for line in fin:
-        data = ujson.loads(line[:-1])
+    if columnar_name:
+        reader = ColumnReader(columnar_name)
+        for attribute in x_attribute:
+            samples[attribute] = to_array(reader.get_column(attribute))
 
-        for attribute in samples:
-            samples[attribute].append(data[attribute])
+    else:
+        # Create one buffer per each attribute requested
+        buffers = [SampleBuffer() for _ in x_attribute]
 
-    fin.close()
+        fin = open_dump(fin_name)
+
+        for line in fin:
+            values = extract_fields(line, x_attribute)
+
+            # Lines that can not be handled by the field extractor are fully parsed.
+            if values is None:
+                data = ujson.loads(line[:-1])
+                values = [data[attribute] for attribute in x_attribute]
+
+            for buf, value in zip(buffers, values):
+                buf.append(value)
+
+        fin.close()
+
+        for attribute, buf in zip(x_attribute, buffers):
+            samples[attribute] = buf.to_array()
 
     return samples
 
 
+def is_top_level(line, i):
+    """
+    Checks whether a position of a json line is at the top level of the object (neither in a nested object or list nor
+    in a string).
+
+    :param line: Json line.
+    :type line: str
+    :param i: Position in the line.
+    :type i: int
+    :return: True if the position is at the top level, False otherwise.
+    :rtype: bool
+    """
+
+    prefix = line[:i]
+
+    # Most lines have no nested data (or escaped strings) before the position, so no scan is needed.
+    if '{' not in prefix[1:] and '[' not in prefix and '\\' not in prefix:
+        return True
+
+    depth = 0
+    in_string = False
+    k = 0
+
+    while k < i:
+        c = line[k]
+        if in_string:
+            if c == '\\':
+                k += 1
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in '{[':
+            depth += 1
+        elif c in '}]':
+            depth -= 1
+        k += 1
+
+    return depth == 1 and not in_string
+
+
+def extract_fields(line, attributes):
+    """
+    Extracts the values of some fields from a json line without parsing the whole object. Only top level scalar values
+    that are not escaped are extracted (which is the case for all the attributes in the STATUS dumps), and None is
+    returned otherwise (e.g. if an attribute is only found in a nested object), so the line can be fully parsed instead.
+
+    :param line: Json line.
+    :type line: str
+    :param attributes: Keys of the fields to be extracted.
+    :type attributes: list of str
+    :return: The list of values, or None if they can not be extracted.
+    :rtype: list
+    """
+
+    values = []
+
+    for attribute in attributes:
+        key = '"' + attribute + '":'
+        i = line.find(key)
+
+        # Keys of nested objects are skipped.
+        while i >= 0 and not is_top_level(line, i):
+            i = line.find(key, i + 1)
+
+        if i < 0:
+            return None
+
+        i += len(attribute) + 3
+
+        if line[i] == '"':
+            j = line.find('"', i + 1) + 1
+            value = line[i:j]
+            if '\\' in value:
+                return None
+            values.append(value[1:-1])
+        elif line[i] in '{[':
+            return None
+        else:
+            j = line.find(',', i)
+            if j < 0:
+                j = line.find('}', i)
+            value = line[i:j]
+            try:
+                values.append(int(value))
+            except ValueError:
+                values.append(ujson.loads(value))
+
+    return values
+
+
+class SampleBuffer(object):
+    """ Accumulates samples of an attribute. Integer samples are stored in a compact typed array (8 bytes per sample),
+    so memory is bounded by the size of the column. If any non-integer sample is found, the buffer falls back to a
+    list.
+    """
+
+    def __init__(self):
+        self.values = array('l')
+
+    def append(self, value):
+        if isinstance(self.values, array):
+            # Booleans are ints for Python, but they should be kept as they are.
+            if type(value) in (int, long) and -2 ** 63 <= value < 2 ** 63:
+                self.values.append(value)
+                return
+            self.values = self.values.tolist()
+
+        self.values.append(value)
+
+    def to_array(self):
+        """ Builds a numpy array with the accumulated samples.
+
+        :return: The samples.
+        :rtype: numpy.ndarray
+        """
+
+        if isinstance(self.values, array):
+            return np.frombuffer(self.values, dtype=np.int_)
+
+        return to_array(self.values)
+
+
+def to_array(values):
+    """
+    Converts a list of samples into a numpy array. Numeric samples are converted to a numeric array, while the rest
+    (e.g. strings and booleans, or numbers mixed with None) are kept as objects.
+
+    :param values: Samples.
+    :type values: list or numpy.ndarray
+    :return: The samples.
+    :rtype: numpy.ndarray
+    """
+
+    if isinstance(values, np.ndarray):
+        return values
+
+    if all(type(v) in (int, long, float) for v in values):
+        return np.array(values)
+
+    return np.array(values, dtype=object)
+
+
 def get_filtered_samples(x_attribute, fin_name, filtr):
     """
     Reads data from .json files and creates a list with the attribute of interest values.
@@ -49,35 +217,298 @@ def get_filtered_samples(x_attribute, fin_name, filtr):
     :rtype: list
     """
 
-    fin = open(CFG.data_path + fin_name, 'r')
+    collector = FilteredCollector(x_attribute, filtr)
+    run_consumers(fin_name, [collector])
 
-    if not isinstance(filtr, list):
-        filtr = [filtr]
+    return collector.get_samples()
 
-    # Defines the empty list of samples
-    samples = []
 
-    # For each filter in filters (if there is more than one), creates an empty list inside samples. I this way, a same
-    # attribute can be filtered using multiple filters but just reading once from disk.
-    if len(filtr) != 1:
-        for _ in filtr:
-            samples.append([])
+class SampleCollector(object):
+    """ Collects the values of some attributes from a stream of samples (same output as get_samples). """
 
-    # Read file
-    for line in fin:
-        data = ujson.loads(line[:-1])
+    def __init__(self, x_attribute):
+        if not isinstance(x_attribute, list):
+            x_attribute = [x_attribute]
+
+        self.attributes = x_attribute
+        self.buffers = [SampleBuffer() for _ in x_attribute]
+
+    def add(self, data):
+        for attribute, buf in zip(self.attributes, self.buffers):
+            buf.append(data[attribute])
+
+    def get_samples(self):
+        """ Gets the collected samples.
 
+        :return: A dictionary with the attributes as keys and an array of the collected samples as values.
+        :rtype: dict
+        """
+
+        return {attribute: buf.to_array() for attribute, buf in zip(self.attributes, self.buffers)}
+
+
+class FilteredCollector(object):
+    """ Collects the values of an attribute from a stream of samples, using one or more filters (same output as
+    get_filtered_samples).
+    """
+
+    def __init__(self, x_attribute, filtr):
+        if not isinstance(filtr, list):
+            filtr = [filtr]
+
+        self.attribute = x_attribute
+        self.filtr = filtr
+        self.samples = [[] for _ in filtr]
+
+    def add(self, data):
         # For each filter, we filter the data and add the filtered result in the proper list.
-        for i, f in enumerate(filtr):
+        for i, f in enumerate(self.filtr):
             if filter_sample(data, f):
-                # We append the sample to samples Depending on the number of filters (list / list of lists).
-                if len(filtr) > 1:
-                    samples[i].append(data[x_attribute])
-                else:
-                    samples.append(data[x_attribute])
+                self.samples[i].append(data[self.attribute])
+
+    def get_samples(self):
+        """ Gets the collected samples.
+
+        :return: A list of samples if there is a single filter, or a list of lists (one per filter) otherwise.
+        :rtype: list
+        """
+
+        if len(self.filtr) == 1:
+            return self.samples[0]
+
+        return self.samples
+
+
+class ValueCounter(object):
+    """ Counts the occurrences of each value of some attributes (optionally filtered) from a stream of samples. Counts
+    hold all the information needed to build a cdf (see analysis.plots.get_cdf_from_counts) or a pie chart, using memory
+    proportional to the number of different values instead of to the number of samples.
+    """
+
+    def __init__(self, x_attribute, filtr=None):
+        if not isinstance(x_attribute, list):
+            x_attribute = [x_attribute]
+
+        self.attributes = x_attribute
+        self.filtr = filtr
+        self.counts = {attribute: Counter() for attribute in x_attribute}
+
+    def add(self, data):
+        if self.filtr is None or filter_sample(data, self.filtr):
+            for attribute in self.attributes:
+                self.counts[attribute][data[attribute]] += 1
+
+    def get_counts(self):
+        """ Gets the counted values.
+
+        :return: A dictionary with the attributes as keys and a Counter of their values as values.
+        :rtype: dict
+        """
+
+        return self.counts
+
+
+class SketchCollector(object):
+    """ Feeds the values of some attributes from a stream of samples to streaming summaries (see analysis.sketches), so
+    cdfs can be built without holding all the samples in memory. Values are buffered and fed in chunks.
+    """
+
+    def __init__(self, sketches, chunk_size=100000):
+        self.sketches = sketches
+        self.attributes = list(sketches)
+        self.chunk_size = chunk_size
+        self.pending = []
+
+    def add(self, data):
+        self.add_values([data[attribute] for attribute in self.attributes])
+
+    def add_values(self, values):
+        """ Adds the values of a sample, in the same order as the attributes of the collector.
+
+        :param values: Values of the sample.
+        :type values: list
+        :return: None
+        :rtype: None
+        """
+
+        self.pending.append(values)
+
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ Feeds the buffered values to the summaries.
+
+        :return: None
+        :rtype: None
+        """
+
+        if self.pending:
+            pending, self.pending = self.pending, []
+            for attribute, column in zip(self.attributes, zip(*pending)):
+                self.sketches[attribute].update(column)
+
+    def get_sketches(self):
+        """ Gets the summaries, once all the buffered values have been fed.
+
+        :return: A dictionary with the attributes as keys and their summaries as values.
+        :rtype: dict
+        """
+
+        self.flush()
+
+        return self.sketches
+
+
+def get_sketches(sketches, fin_name, chunk_size=100000):
+    """
+    Feeds the values of some attributes of a dumped file to streaming summaries (see analysis.sketches), chunk by chunk.
+    Columnar dumps (or json dumps with an up to date columnar sidecar) are fed column by column, while json dumps are
+    streamed extracting only the requested fields.
+
+    :param sketches: Summaries to be fed, keyed by attribute (e.g. {"amount": KLLSketch(), "out_type": CountHistogram()}).
+    :type sketches: dict
+    :param fin_name: Input file from which data is loaded.
+    :type fin_name: str
+    :param chunk_size: Number of samples fed at once.
+    :type chunk_size: int
+    :return: The fed summaries.
+    :rtype: dict
+    """
+
+    columnar_name = find_columnar(fin_name)
+
+    if columnar_name:
+        reader = ColumnReader(columnar_name)
+        for start in range(0, len(reader), chunk_size):
+            for attribute, sketch in sketches.items():
+                sketch.update(reader.get_column(attribute, start, start + chunk_size))
+
+        return sketches
+
+    collector = SketchCollector(sketches, chunk_size)
+
+    fin = open_dump(fin_name)
+
+    for line in fin:
+        values = extract_fields(line, collector.attributes)
+
+        # Lines that can not be handled by the field extractor are fully parsed.
+        if values is None:
+            data = ujson.loads(line[:-1])
+            values = [data[attribute] for attribute in collector.attributes]
+
+        collector.add_values(values)
+
     fin.close()
 
-    return samples
+    return collector.get_sketches()
+
+
+def run_consumers(fin_name, consumers):
+    """
+    Reads a dumped file (either json or columnar) once, feeding every sample to all the given consumers (any object with
+    an add(sample) method, such as SampleCollector, FilteredCollector, ValueCounter, SketchCollector or
+    utils.DustAccumulator).
+
+    :param fin_name: Input file from which data is loaded.
+    :type fin_name: str
+    :param consumers: Consumers to be fed.
+    :type consumers: list
+    :return: None
+    :rtype: None
+    """
+
+    adds = [consumer.add for consumer in consumers]
+
+    for data in iter_dump(fin_name):
+        for add in adds:
+            add(data)
+
+
+class AnalysisEngine(object):
+    """ Runs several analysis over the same files reading every file just once. Analysis register the consumers they need
+    for each file together with a callback (to plot or print the results). When the engine is run, each file is streamed
+    once feeding all its registered consumers, and the callbacks are then called in the same order they were
+    registered.
+    """
+
+    def __init__(self):
+        self.consumers = OrderedDict()
+        self.callbacks = []
+
+    def register(self, fin_name, consumers, callback=None):
+        """
+        Registers the consumers of a given file.
+
+        :param fin_name: Input file from which data will be loaded.
+        :type fin_name: str
+        :param consumers: Consumers to be fed with the samples from the file.
+        :type consumers: list
+        :param callback: Function to be called once all the files have been read.
+        :type callback: function
+        :return: None
+        :rtype: None
+        """
+
+        self.consumers.setdefault(fin_name, []).extend(consumers)
+
+        if callback:
+            self.callbacks.append(callback)
+
+    def pop_consumers(self, fin_name):
+        """
+        Removes the consumers registered for a given file, so they can be fed by the process that generates the file
+        instead (see data_dump.dump_chainstate), and the file does not need to be read.
+
+        :param fin_name: Input file from which data would be loaded.
+        :type fin_name: str
+        :return: The consumers registered for the file.
+        :rtype: list
+        """
+
+        return self.consumers.pop(fin_name, [])
+
+    def run(self):
+        """
+        Reads all the registered files and calls the registered callbacks.
+
+        :return: None
+        :rtype: None
+        """
+
+        for fin_name, consumers in self.consumers.items():
+            print "Reading " + fin_name + " (" + str(len(consumers)) + " consumers)."
+            run_consumers(fin_name, consumers)
+
+        for callback in self.callbacks:
+            callback()
+
+        self.consumers = OrderedDict()
+        self.callbacks = []
+
+
+def schedule_analysis(engine, fin_name, consumers, callback):
+    """
+    Registers an analysis in a given engine, or runs it straight away if there is no engine.
+
+    :param engine: Engine where the analysis will be registered, or None.
+    :type engine: AnalysisEngine
+    :param fin_name: Input file from which data will be loaded.
+    :type fin_name: str
+    :param consumers: Consumers to be fed with the samples from the file.
+    :type consumers: list
+    :param callback: Function to be called with the results.
+    :type callback: function
+    :return: None
+    :rtype: None
+    """
+
+    if engine is None:
+        run_consumers(fin_name, consumers)
+        callback()
+    else:
+        engine.register(fin_name, consumers, callback)
 
 
 def filter_sample(sample, filtr):
@@ -112,4 +543,4 @@ def get_unique_values(x_attribute, fin_name):
 
     samples = get_samples(x_attribute, fin_name=fin_name)
 
-    return list(set(samples))
+    return list(set(samples[x_attribute]))
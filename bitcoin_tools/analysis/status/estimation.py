@@ -0,0 +1,438 @@
+"""
+Generator of the estimation data used to compute non_profitable_est (see utils.load_estimation_data), from the block
+files of a local node (see core/block.py):
+
+    p2pkh_pubkey_avg_size_height_output.json    average size of the public keys revealed when spending the P2PKH outputs
+                                                created at every height.
+    p2sh.json                                   average scriptSig size of the P2SH inputs.
+    nonstd.json                                 average scriptSig size of the non-standard inputs.
+    p2wsh.json                                  average witness size of the P2WSH inputs.
+
+Block files do not hold the outputs spent by every input, so inputs are classified by the shape of their scriptSig and
+witness (see classify_input). Public key sizes are attributed to the height the spent output was created at by joining
+every P2PKH spend with the transaction it spends. Both sides of the join are identified by the first 8 bytes of the
+transaction id, and they are spread over N_BUCKETS files on disk, so the join is done one bucket at a time.
+
+Block ranges are scanned in parallel, and the state of the generator (per-height sums and counts, joined transactions
+and last processed block) is kept in a state folder next to the estimation data. Later runs only scan the blocks found
+after the last processed one. Spends of old outputs found in them still update the averages of old heights.
+"""
+
+from bitcoin_tools import CFG
+from bitcoin_tools.core.block import BlockView, index_blocks, load_block_file, get_xor_key, map_block_files
+from bitcoin_tools.analysis.status.utils import parse_script_ops
+from bitcoin_tools.utils import read_varint
+from struct import unpack_from
+from getopt import getopt
+from sys import argv
+import numpy as np
+import ujson
+import os
+
+
+STATE_DIR = "state"
+STATE_FILE = "state.npz"
+N_BUCKETS = 64
+
+INPUT_OTHER, INPUT_P2PKH, INPUT_P2SH, INPUT_NONSTD, INPUT_P2WSH = range(5)
+SCALAR_FILES = {INPUT_P2SH: "p2sh.json", INPUT_NONSTD: "nonstd.json", INPUT_P2WSH: "p2wsh.json"}
+
+# Transactions with P2PKH outputs (first 8 bytes of the tx_id and height), and P2PKH spends (first 8 bytes of the
+# spent tx_id and size of the revealed public key).
+CREATED = np.dtype([("tx", "<u8"), ("height", "<i4")])
+SPENT = np.dtype([("tx", "<u8"), ("pk_size", "<u1")])
+
+
+def is_p2pkh(script):
+    """
+    Checks whether a raw output script is a P2PKH one (OP_DUP OP_HASH160 <20 bytes> OP_EQUALVERIFY OP_CHECKSIG).
+
+    :param script: The script to be checked.
+    :type script: str
+    :return: True if the script is P2PKH, False otherwise.
+    :rtype: bool
+    """
+
+    return len(script) == 25 and script[:3] == b"\x76\xa9\x14" and script[23:] == b"\x88\xac"
+
+
+def is_signature(data):
+    """
+    Checks whether some pushed data looks like a DER encoded signature (followed by the sighash byte).
+
+    :param data: Pushed data.
+    :type data: str
+    :return: True if the data is a signature, False otherwise.
+    :rtype: bool
+    """
+
+    return 9 <= len(data) <= 73 and data[:1] == b"\x30" and ord(data[1]) == len(data) - 3
+
+
+def get_witness_items(tx, index):
+    """
+    Gets the witness items of an input, along with the serialized size of the whole witness.
+
+    :param tx: Transaction.
+    :type tx: TXView
+    :param index: Index of the input.
+    :type index: int
+    :return: The witness items and the size of the witness.
+    :rtype: list of str, int
+    """
+
+    start = tx.witness_offsets[index]
+    n_items, o = read_varint(tx.raw, start)
+
+    items = []
+    for _ in range(n_items):
+        item_len, o = read_varint(tx.raw, o)
+        items.append(tx.raw[o:o + item_len])
+        o += item_len
+
+    return items, o - start
+
+
+def classify_input(tx, index, script_sig):
+    """
+    Classifies an input by the shape of its scriptSig and witness:
+
+        P2PKH       a signature and a 33-byte (compressed) or 65-byte (uncompressed) public key.
+        P2WSH       empty scriptSig, and a witness that is neither P2WPKH (signature and public key) nor taproot.
+        P2SH        push-only scriptSig whose last push is a script (the redeem script), including nested segwit.
+        non-std     any other scriptSig that is not a P2PK or bare multisig one (only signatures).
+
+    :param tx: Transaction.
+    :type tx: TXView
+    :param index: Index of the input.
+    :type index: int
+    :param script_sig: Raw scriptSig of the input.
+    :type script_sig: str
+    :return: The class of the input and its size (public key size for P2PKH, scriptSig size for P2SH and non-standard,
+    witness size for P2WSH, 0 otherwise).
+    :rtype: int, int
+    """
+
+    if not script_sig:
+        if not tx.segwit:
+            return INPUT_OTHER, 0
+
+        items, witness_size = get_witness_items(tx, index)
+
+        if not items or (len(items) == 2 and len(items[1]) == 33):
+            return INPUT_OTHER, 0
+
+        # Taproot key path (a single signature) and script path (the last item is a control block) spends.
+        control = items[-1]
+        if len(items) == 1 and len(control) in [64, 65]:
+            return INPUT_OTHER, 0
+        if len(control) >= 33 and (len(control) - 33) % 32 == 0 and ord(control[0]) & 0xfe == 0xc0:
+            return INPUT_OTHER, 0
+
+        return INPUT_P2WSH, witness_size
+
+    ops = parse_script_ops(script_sig)
+
+    # Push-only scripts only have pushes and small integers (up to OP_16).
+    if ops is None or any(opcode > 0x60 for opcode, _, _ in ops):
+        return INPUT_NONSTD, len(script_sig)
+
+    pushes = [script_sig[start:end] for opcode, start, end in ops]
+
+    if len(ops) == 2 and is_signature(pushes[0]):
+        pk = pushes[1]
+        if (len(pk) == 33 and pk[:1] in b"\x02\x03") or (len(pk) == 65 and pk[:1] == b"\x04"):
+            return INPUT_P2PKH, len(pk)
+
+    # P2PK and bare multisig spends (OP_0 followed by signatures).
+    if all(is_signature(push) for push in pushes[1 if ops[0][0] == 0 and len(ops) > 1 else 0:]):
+        return INPUT_OTHER, 0
+
+    if pushes[-1] and parse_script_ops(pushes[-1]) is not None:
+        return INPUT_P2SH, len(script_sig)
+
+    return INPUT_NONSTD, len(script_sig)
+
+
+def _scan_blocks(args):
+    """
+    Scans a range of blocks. Runs inside the worker processes of update_estimation_data.
+
+    :param args: Blocks to be scanned, as (height, hash, path, offset) tuples (see core.block.index_blocks), and the
+    obfuscation key of the block files.
+    :type args: tuple
+    :return: Transactions with P2PKH outputs (CREATED array), P2PKH spends (SPENT array), and the sum and count of the
+    sizes of the P2SH, non-standard and P2WSH inputs.
+    :rtype: numpy.ndarray, numpy.ndarray, dict
+    """
+
+    entries, xor_key = args
+
+    files = dict()
+    created = []
+    spent = []
+    sizes = dict((input_class, [0, 0]) for input_class in SCALAR_FILES)
+
+    for height, _, fin_name, offset in entries:
+        if fin_name not in files:
+            files[fin_name] = load_block_file(fin_name, xor_key)
+
+        for i, tx in enumerate(BlockView(files[fin_name], offset).iter_txs()):
+            if any(is_p2pkh(script) for script in tx.raw_scriptPubKey):
+                created.append((unpack_from('<Q', tx.get_txid(bin))[0], height))
+
+            # The coinbase input spends nothing.
+            if i == 0:
+                continue
+
+            for j, script_sig in enumerate(tx.raw_scriptSig):
+                input_class, size = classify_input(tx, j, script_sig)
+
+                if input_class == INPUT_P2PKH:
+                    # The spent tx_id is read straight from the input (first 8 bytes).
+                    spent.append((unpack_from('<Q', tx.raw, tx.input_offsets[j])[0], size))
+                elif input_class in sizes:
+                    sizes[input_class][0] += size
+                    sizes[input_class][1] += 1
+
+    return np.array(created, dtype=CREATED), np.array(spent, dtype=SPENT), sizes
+
+
+class EstimationState(object):
+    """ State of the estimation data generator, stored in a folder (see STATE_DIR) next to the estimation data. Bucket
+    files are only appended to, and their sizes are recorded in the state file along with the rest of the state, so
+    data appended by an interrupted run is dropped when the state is loaded again. The state file (meta data and
+    per-height sums and counts) is replaced at once, so an interrupted store leaves the previous state untouched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        try:
+            with np.load(os.path.join(path, STATE_FILE)) as data:
+                self.meta = ujson.loads(str(data["meta"]))
+                self.p2pkh_sums = data["p2pkh_sums"]
+                self.p2pkh_counts = data["p2pkh_counts"]
+        except IOError:
+            self.meta = {"height": -1, "tip": None, "buckets": [0] * N_BUCKETS,
+                         "sizes": dict((str(c), [0, 0]) for c in SCALAR_FILES)}
+            self.p2pkh_sums = np.zeros(0, dtype=np.float64)
+            self.p2pkh_counts = np.zeros(0, dtype=np.int64)
+
+            if not os.path.exists(path):
+                os.makedirs(path)
+
+        # Drop whatever an interrupted run may have appended.
+        for bucket, rows in enumerate(self.meta["buckets"]):
+            fin_name = self.get_bucket_name(bucket)
+            if os.path.exists(fin_name):
+                with open(fin_name, 'r+b') as f:
+                    f.truncate(rows * CREATED.itemsize)
+
+            spent_name = self.get_bucket_name(bucket, "spent")
+            if os.path.exists(spent_name):
+                os.remove(spent_name)
+
+    def get_bucket_name(self, bucket, kind="created"):
+        return os.path.join(self.path, "{}_{:02d}.bin".format(kind, bucket))
+
+    def add(self, created, spent, sizes):
+        """ Adds the results of a block range (see _scan_blocks).
+
+        :return: None
+        :rtype: None
+        """
+
+        for kind, data in [("created", created), ("spent", spent)]:
+            buckets = data["tx"] % N_BUCKETS
+            for bucket in np.unique(buckets).tolist():
+                with open(self.get_bucket_name(bucket, kind), 'ab') as f:
+                    data[buckets == bucket].tofile(f)
+
+        for input_class, (total, count) in sizes.items():
+            self.meta["sizes"][str(input_class)][0] += total
+            self.meta["sizes"][str(input_class)][1] += count
+
+    def join(self):
+        """ Joins the P2PKH spends added so far with the transactions they spend, adding the size of the revealed public
+        keys to the height of the spent outputs. Joined spends are removed.
+
+        :return: None
+        :rtype: None
+        """
+
+        for bucket in range(N_BUCKETS):
+            created = np.fromfile(self.get_bucket_name(bucket), dtype=CREATED) \
+                if os.path.exists(self.get_bucket_name(bucket)) else np.zeros(0, dtype=CREATED)
+            self.meta["buckets"][bucket] = len(created)
+
+            spent_name = self.get_bucket_name(bucket, "spent")
+            if not os.path.exists(spent_name):
+                continue
+
+            spent = np.fromfile(spent_name, dtype=SPENT)
+
+            created = created[np.argsort(created["tx"], kind='mergesort')]
+            pos = np.minimum(np.searchsorted(created["tx"], spent["tx"]), max(len(created) - 1, 0))
+
+            if len(created):
+                found = created["tx"][pos] == spent["tx"]
+                heights = created["height"][pos[found]]
+                pk_sizes = spent["pk_size"][found]
+
+                if len(heights):
+                    size = int(heights.max()) + 1
+                    if size > len(self.p2pkh_sums):
+                        self.p2pkh_sums = np.concatenate([self.p2pkh_sums, np.zeros(size - len(self.p2pkh_sums))])
+                        self.p2pkh_counts = np.concatenate([self.p2pkh_counts,
+                                                            np.zeros(size - len(self.p2pkh_counts), dtype=np.int64)])
+
+                    self.p2pkh_sums += np.bincount(heights, weights=pk_sizes, minlength=len(self.p2pkh_sums))
+                    self.p2pkh_counts += np.bincount(heights, minlength=len(self.p2pkh_counts))
+
+            os.remove(spent_name)
+
+    def store(self, height, tip):
+        """ Stores the state, once all the blocks up to a given height have been added and joined.
+
+        :param height: Last processed height.
+        :type height: int
+        :param tip: Hash of the last processed block.
+        :type tip: str
+        :return: None
+        :rtype: None
+        """
+
+        self.meta["height"] = height
+        self.meta["tip"] = tip
+
+        fout_name = os.path.join(self.path, STATE_FILE)
+
+        with open(fout_name + ".tmp", 'wb') as f:
+            np.savez(f, meta=np.array(ujson.dumps(self.meta)), p2pkh_sums=self.p2pkh_sums,
+                     p2pkh_counts=self.p2pkh_counts)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.rename(fout_name + ".tmp", fout_name)
+
+
+def store_estimation_data(state, fout_dir):
+    """
+    Builds the estimation data files from the state of the generator.
+
+    Every height up to the last processed one gets a P2PKH public key size, so the file covers a contiguous range of
+    heights (see load_estimation_data). Heights with no spent P2PKH outputs take the average of the closest previous
+    height with data (or the first one with data, for the first heights).
+
+    :param state: State of the generator.
+    :type state: EstimationState
+    :param fout_dir: Folder where the files are stored.
+    :type fout_dir: str
+    :return: None
+    :rtype: None
+    """
+
+    n_heights = state.meta["height"] + 1
+    sums = np.zeros(n_heights)
+    counts = np.zeros(n_heights, dtype=np.int64)
+    n = min(n_heights, len(state.p2pkh_sums))
+    sums[:n], counts[:n] = state.p2pkh_sums[:n], state.p2pkh_counts[:n]
+
+    with_data = np.flatnonzero(counts)
+    if len(with_data):
+        # Forward fill: every height takes the last height with data up to it.
+        last = np.maximum.accumulate(np.where(counts > 0, np.arange(n_heights), with_data[0]))
+        avg = sums[last] / counts[last]
+    else:
+        print "Warning: No P2PKH spends found. Uncompressed public keys will be assumed."
+        avg = np.full(n_heights, 65.0)
+
+    data = dict((str(height), round(size, 2)) for height, size in enumerate(avg.tolist()))
+    files = [("p2pkh_pubkey_avg_size_height_output.json", data)]
+
+    for input_class, fout_name in sorted(SCALAR_FILES.items()):
+        total, count = state.meta["sizes"][str(input_class)]
+        if not count:
+            print "Warning: No inputs found for {}. 0 will be used.".format(fout_name)
+        files.append((fout_name, round(total / float(count), 1) if count else 0.0))
+
+    for fout_name, data in files:
+        with open(os.path.join(fout_dir, fout_name + ".tmp"), 'w') as f:
+            f.write(ujson.dumps(data))
+        os.rename(os.path.join(fout_dir, fout_name + ".tmp"), os.path.join(fout_dir, fout_name))
+
+
+def update_estimation_data(coin=CFG.default_coin, blocks_dir=CFG.blocks_path, network="main", n_workers=1,
+                           range_size=1000, confirmations=6):
+    """
+    Updates the estimation data of a given coin (under CFG.estimated_data_dir) with the blocks found in a local blocks
+    folder. Only the blocks after the last processed one are scanned.
+
+    :param coin: Currency the data is computed for.
+    :type coin: str
+    :param blocks_dir: Path of the blocks folder.
+    :type blocks_dir: str
+    :param network: Network the block files belong to (see core.block.iter_block_file).
+    :type network: str
+    :param n_workers: Number of worker processes used to index and scan the blocks.
+    :type n_workers: int
+    :param range_size: Number of blocks scanned by a worker at once.
+    :type range_size: int
+    :param confirmations: Number of blocks left out at the tip of the chain, so reorganizations do not affect the
+    processed blocks.
+    :type confirmations: int
+    :return: Last processed height.
+    :rtype: int
+    """
+
+    fout_dir = CFG.estimated_data_dir + coin
+    state = EstimationState(os.path.join(fout_dir, STATE_DIR))
+
+    chain = index_blocks(blocks_dir, network, n_workers)
+    chain = chain[:max(len(chain) - confirmations, 0)]
+
+    last_height = state.meta["height"]
+    if last_height >= 0 and (last_height >= len(chain) or chain[last_height][1] != state.meta["tip"]):
+        raise Exception("The last processed block ({}, at height {}) is not in the main chain of {}. Remove {} to start "
+                        "over.".format(state.meta["tip"], last_height, blocks_dir, state.path))
+
+    entries = chain[last_height + 1:]
+    if not entries:
+        print "Estimation data is up to date (height {}).".format(last_height)
+        return last_height
+
+    print "Scanning blocks {} to {}.".format(entries[0][0], entries[-1][0])
+
+    xor_key = get_xor_key(blocks_dir)
+    ranges = [(entries[i:i + range_size], xor_key) for i in range(0, len(entries), range_size)]
+
+    # Ranges are scanned in parallel, but added in order.
+    for created, spent, sizes in map_block_files(_scan_blocks, ranges, n_workers):
+        state.add(created, spent, sizes)
+
+    state.join()
+    state.store(entries[-1][0], entries[-1][1])
+    store_estimation_data(state, fout_dir)
+
+    return entries[-1][0]
+
+
+if __name__ == '__main__':
+
+    # Default params
+    coin = CFG.default_coin
+    network = "main"
+    n_workers = 1
+
+    opts, _ = getopt(argv[1:], 'c:n:w:', ['coin=', 'network=', 'workers='])
+
+    for opt, arg in opts:
+        if opt in ['-c', '--coin']:
+            coin = arg
+        elif opt in ['-n', '--network']:
+            network = arg
+        elif opt in ['-w', '--workers']:
+            n_workers = int(arg)
+
+    update_estimation_data(coin, CFG.blocks_path, network, n_workers)
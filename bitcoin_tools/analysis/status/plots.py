@@ -1,7 +1,7 @@
 from bitcoin_tools.analysis.plots import plot_distribution, plot_pie
 from collections import Counter
 import numpy as np
-from bitcoin_tools.analysis.status.data_processing import get_samples
+from bitcoin_tools.analysis.status.data_processing import get_samples, SampleCollector
 
 
 def plots_from_samples(xs, ys, ylabel="Number of txs", xlabel=None, log_axis=None, save_fig=False, legend=None,
@@ -49,8 +49,8 @@ def plot_pie_chart_from_samples(samples, title="", labels=None, groups=None, col
     """
     Generates pie charts from UTXO/tx data extracted from utxo_dump.
 
-    :param samples: Samples to be printed (from get_samples)
-    :type: list
+    :param samples: Samples to be printed (from get_samples), or their counts (from ValueCounter)
+    :type: list or Counter
     :param title: Title of the chart.
     :type title: str
     :param labels: List of labels (one label for each piece of the pie)
@@ -69,8 +69,13 @@ def plot_pie_chart_from_samples(samples, title="", labels=None, groups=None, col
     :rtype: None
     """
 
-    # Count occurrences
-    ctr = Counter(samples)
+    # Count occurrences (unless they have already been counted)
+    if isinstance(samples, Counter):
+        ctr = samples
+        n_samples = sum(ctr.values())
+    else:
+        ctr = Counter(samples)
+        n_samples = len(samples)
 
     # Sum occurrences that belong to the same pie group
     values = []
@@ -85,12 +90,12 @@ def plot_pie_chart_from_samples(samples, title="", labels=None, groups=None, col
     if len(labels) == len(groups) + 1:
         # We assume the last group is "others"
         current_sum = sum(values)
-        values.append(len(samples) - current_sum)
+        values.append(n_samples - current_sum)
 
     plot_pie(values, labels, title, colors, save_fig=save_fig, font_size=font_size, labels_out=labels_out)
 
 
-def overview_from_file(tx_fin_name, utxo_fin_name):
+def overview_from_file(tx_fin_name, utxo_fin_name, engine=None):
     """
     Prints a summary of basic stats.
 
@@ -98,15 +103,45 @@ def overview_from_file(tx_fin_name, utxo_fin_name):
     :type tx_fin_name: str
     :param utxo_fin_name: Parsed transactions input file from which data is loaded.
     :type utxo_fin_name: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
+    :return: None
+    :rtype: None
+    """
+
+    tx_attributes = ['num_utxos', 'total_len', 'height']
+    utxo_attributes = "register_len"
+
+    if engine is None:
+        print_overview(get_samples(tx_attributes, fin_name=tx_fin_name),
+                       get_samples(utxo_attributes, fin_name=utxo_fin_name))
+    else:
+        tx_collector = SampleCollector(tx_attributes)
+        utxo_collector = SampleCollector(utxo_attributes)
+
+        engine.register(tx_fin_name, [tx_collector])
+        engine.register(utxo_fin_name, [utxo_collector],
+                        lambda: print_overview(tx_collector.get_samples(), utxo_collector.get_samples()))
+
+
+def print_overview(tx_samples, utxo_samples):
+    """
+    Prints a summary of basic stats from transaction and utxo samples.
+
+    :param tx_samples: Transaction samples (num_utxos, total_len and height).
+    :type tx_samples: dict
+    :param utxo_samples: UTXO samples (register_len).
+    :type utxo_samples: dict
     :return: None
     :rtype: None
     """
 
-    samples = get_samples(['num_utxos', 'total_len', 'height'], fin_name=tx_fin_name)
+    samples = tx_samples
 
     print "\t Max height: ", str(max(samples['height']))
     print "\t Num. of tx: ", str(len(samples['num_utxos']))
-    print "\t Num. of UTXOs: ", str(sum(samples['num_utxos']))
+    print "\t Num. of UTXOs: ", str(np.sum(samples['num_utxos']))
     print "\t Avg. num. of UTXOs per tx: ", str(np.mean(samples['num_utxos']))
     print "\t Std. num. of UTXOs per tx: ", str(np.std(samples['num_utxos']))
     print "\t Median num. of UTXOs per tx: ", str(np.median(samples['num_utxos']))
@@ -115,7 +150,7 @@ def overview_from_file(tx_fin_name, utxo_fin_name):
 
     print "\t Size of the (serialized) UTXO set: ", str(np.sum(samples[len_attribute]))
 
-    samples = get_samples("register_len", fin_name=utxo_fin_name)
+    samples = utxo_samples
     len_attribute = "register_len"
 
     print "\t Avg. size per register: ", str(np.mean(samples[len_attribute]))
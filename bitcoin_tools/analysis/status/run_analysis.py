@@ -1,20 +1,25 @@
-from bitcoin_tools.analysis.plots import get_cdf
-from bitcoin_tools.analysis.status.data_dump import transaction_dump, utxo_dump
-from bitcoin_tools.analysis.status.utils import parse_ldb, aggregate_dust_np
-from data_processing import get_samples, get_filtered_samples
+from bitcoin_tools.analysis.plots import get_cdf, get_cdf_from_counts
+from bitcoin_tools.analysis.status.data_dump import transaction_dump, utxo_dump, dump_chainstate
+from bitcoin_tools.analysis.status.utils import parse_ldb, get_chainstate_tip, DustAccumulator
+from bitcoin_tools.analysis.status.cache import StageCache, get_fingerprint, get_estimation_data_hash
+from data_processing import FilteredCollector, ValueCounter, SketchCollector, AnalysisEngine, schedule_analysis
+from bitcoin_tools.analysis.sketches import KLLSketch
 from bitcoin_tools.analysis.status.plots import plot_pie_chart_from_samples, overview_from_file, plots_from_samples
 from bitcoin_tools import CFG
 from getopt import getopt
 from sys import argv
 
 
-def set_out_names(count_p2sh, non_std_only):
+def set_out_names(count_p2sh, non_std_only, compression=None):
     """
     Set the name of the input / output files from the experiment depending on the given flags.
     :param count_p2sh: Whether P2SH should be taken into account.
     :type count_p2sh: bool
     :param non_std_only: Whether the experiment will be run only considering non standard outputs.
     :type non_std_only: bool
+    :param compression: Extension of the codec used to compress the dumps ('gz', 'zst' or 'lz4', see compression.py),
+    or None to store them as plain text.
+    :type compression: str
     :return: Four string representing the names of the utxo, parsed_txs, parsed_utxos and dust file names.
     :rtype: str, str, str, str
     """
@@ -36,6 +41,11 @@ def set_out_names(count_p2sh, non_std_only):
     f_parsed_utxos += ".json"
     f_dust += ".json"
 
+    if compression:
+        f_utxos += "." + compression
+        f_parsed_txs += "." + compression
+        f_parsed_utxos += "." + compression
+
     return f_utxos, f_parsed_txs, f_parsed_utxos, f_dust
 
 
@@ -43,8 +53,8 @@ def non_std_outs_analysis(samples):
     """
     Perform the non standard out analysis for a given set of samples.
 
-    :param samples: List of samples that will form the chart.
-    :type samples: list
+    :param samples: List of samples (or their counts) that will form the chart.
+    :type samples: list or Counter
     :return: None
     :rtype: None
     """
@@ -69,12 +79,17 @@ def non_std_outs_analysis(samples):
                                                    "#A69229", "#B69229", "#F69229"], labels_out=True)
 
 
-def tx_based_analysis(tx_fin_name):
+def tx_based_analysis(tx_fin_name, engine=None, eps=0.001):
     """
     Performs a transaction based analysis from a given input file (resulting from a transaction dump of the chainstate)
 
     :param tx_fin_name: Input file path which contains the chainstate transaction dump.
     :type: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
+    :param eps: Rank error bound of the cdf of attributes with too many distinct values to be counted (total_value).
+    :type eps: float
     :return: None
     :rtype: None
     """
@@ -94,24 +109,42 @@ def tx_based_analysis(tx_fin_name):
     pie_groups = [[[1], [0]]]
     pie_colors = [["#165873", "#428C5C"]]
 
-    samples = get_samples(x_attributes + [x_attr_pie],  fin_name=tx_fin_name)
-    samples_pie = samples.pop(x_attr_pie)
+    # Only the number of occurrences of each value is needed to build both the cdfs and the pie charts, but for
+    # attributes with (almost) as many distinct values as samples an approximate cdf is built with a sketch instead.
+    sketched = ['total_value']
+    counter = ValueCounter([x for x in x_attributes if x not in sketched] + [x_attr_pie])
+    sketches = SketchCollector({x: KLLSketch(eps) for x in sketched})
+
+    def plot():
+        samples = counter.get_counts()
+        samples_pie = samples.pop(x_attr_pie)
+        cdfs = {x: sketch.get_cdf(normalize=True) for x, sketch in sketches.get_sketches().items()}
 
-    for attribute, label, log, out in zip(x_attributes, xlabels, log_axis, out_names):
-        xs, ys = get_cdf(samples[attribute], normalize=True)
-        plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of txs")
+        for attribute, label, log, out in zip(x_attributes, xlabels, log_axis, out_names):
+            if attribute in cdfs:
+                xs, ys = cdfs[attribute]
+            else:
+                xs, ys = get_cdf_from_counts(samples[attribute], normalize=True)
+            plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of txs")
 
-    for label, out, groups, colors in (zip(xlabels_pie, out_names_pie, pie_groups, pie_colors)):
-        plot_pie_chart_from_samples(samples=samples_pie, save_fig=out, labels=label, title="", groups=groups,
-                                    colors=colors, labels_out=True)
+        for label, out, groups, colors in (zip(xlabels_pie, out_names_pie, pie_groups, pie_colors)):
+            plot_pie_chart_from_samples(samples=samples_pie, save_fig=out, labels=label, title="", groups=groups,
+                                        colors=colors, labels_out=True)
 
+    schedule_analysis(engine, tx_fin_name, [counter, sketches], plot)
 
-def utxo_based_analysis(utxo_fin_name):
+
+def utxo_based_analysis(utxo_fin_name, engine=None, eps=0.001):
     """
     Performs a utxo based analysis from a given input file (resulting from a utxo dump of the chainstate)
 
     :param utxo_fin_name: Input file path which contains the chainstate utxo dump.
     :type: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
+    :param eps: Rank error bound of the cdf of attributes with too many distinct values to be counted (amount).
+    :type eps: float
     :return: None
     :rtype: None
     """
@@ -134,22 +167,34 @@ def utxo_based_analysis(utxo_fin_name):
     x_attribute_special = 'non_std_type'
 
     # Since the attributes for the pie chart are already included in the normal chart, we won't pass them to the
-    # sampling function.
-    samples = get_samples(x_attributes + [x_attribute_special], fin_name=utxo_fin_name)
-    samples_special = samples.pop(x_attribute_special)
-
-    for attribute, label, log, out in zip(x_attributes, xlabels, log_axis, out_names):
-        xs, ys = get_cdf(samples[attribute], normalize=True)
-        plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of UTXOs")
-
-    for attribute, label, out, groups in (zip(x_attributes_pie, xlabels_pie, out_names_pie, pie_groups)):
-        plot_pie_chart_from_samples(samples=samples[attribute], save_fig=out, labels=label, title="", groups=groups,
-                                    colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"], labels_out=True)
-    # Special case: non-standard
-    non_std_outs_analysis(samples_special)
-
-
-def dust_analysis(utxo_fin_name, f_dust, fltr=None):
+    # counter. Amounts are summarized with a sketch, since there can be as many distinct values as utxos.
+    sketched = ['amount']
+    counter = ValueCounter([x for x in x_attributes if x not in sketched] + [x_attribute_special])
+    sketches = SketchCollector({x: KLLSketch(eps) for x in sketched})
+
+    def plot():
+        samples = counter.get_counts()
+        samples_special = samples.pop(x_attribute_special)
+        cdfs = {x: sketch.get_cdf(normalize=True) for x, sketch in sketches.get_sketches().items()}
+
+        for attribute, label, log, out in zip(x_attributes, xlabels, log_axis, out_names):
+            if attribute in cdfs:
+                xs, ys = cdfs[attribute]
+            else:
+                xs, ys = get_cdf_from_counts(samples[attribute], normalize=True)
+            plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of UTXOs")
+
+        for attribute, label, out, groups in (zip(x_attributes_pie, xlabels_pie, out_names_pie, pie_groups)):
+            plot_pie_chart_from_samples(samples=samples[attribute], save_fig=out, labels=label, title="",
+                                        groups=groups, colors=["#165873", "#428C5C", "#4EA64B", "#ADD96C"],
+                                        labels_out=True)
+        # Special case: non-standard
+        non_std_outs_analysis(samples_special)
+
+    schedule_analysis(engine, utxo_fin_name, [counter, sketches], plot)
+
+
+def dust_analysis(utxo_fin_name, f_dust, fltr=None, engine=None):
     """
     Performs a dust analysis by aggregating al the dust of a utxo dump file.
 
@@ -159,15 +204,31 @@ def dust_analysis(utxo_fin_name, f_dust, fltr=None):
     :type f_dust: str
     :param fltr: Filter to be applied to the samples. None by default.
     :type fltr: function
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
     :return: None
     :rtype: None
     """
 
     # Generate plots for dust analysis (including percentage scale).
-    # First, the dust accumulation file is generated
-    data = aggregate_dust_np(utxo_fin_name, fout_name=f_dust, fltr=fltr)
+    # First, the dust is aggregated while the file is read
+    dust = DustAccumulator(fltr=fltr)
+
+    schedule_analysis(engine, utxo_fin_name, [dust], lambda: plot_dust(dust.store(f_dust)))
+
+
+def plot_dust(data):
+    """
+    Generates the dust analysis plots from aggregated dust data.
+
+    :param data: Aggregated dust data (from aggregate_dust_np or DustAccumulator).
+    :type data: dict
+    :return: None
+    :rtype: None
+    """
 
-    # # Or we can load it from a dust file if we have already created it
+    # # Data can also be loaded from a dust file if we have already created it
     # data = load(open(CFG.data_path + f_dust))
 
     dict_labels = [["dust_utxos", "np_utxos", "npest_utxos"],
@@ -195,13 +256,16 @@ def dust_analysis(utxo_fin_name, f_dust, fltr=None):
                            xlabel='Fee rate (sat./byte)', ylabel=ylabel)
 
 
-def dust_analysis_all_fees(utxo_fin_name):
+def dust_analysis_all_fees(utxo_fin_name, engine=None):
     """
     Performs a dust analysis for all fee rates, that is, up until all samples are considered dust (plot shows cdf up
     until 1).
 
     :param utxo_fin_name: Input file path which contains the chainstate utxo dump.
     :type: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
     :return: None
     :rtype: None
     """
@@ -212,25 +276,34 @@ def dust_analysis_all_fees(utxo_fin_name):
     legends = [["Dust", "Non-profitable min.", "Non-profitable est."]]
     log_axis = ['x']
 
-    for attribute, label, log, out, legend in zip(x_attributes, xlabels, log_axis, out_names, legends):
-        samples = get_samples(attribute, fin_name=utxo_fin_name)
-        xs = []
-        ys = []
-        for a in attribute:
-            x, y = get_cdf(samples[a], normalize=True)
-            xs.append(x)
-            ys.append(y)
+    counters = [ValueCounter(attribute) for attribute in x_attributes]
 
-        plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of UTXOs",
-                           legend=legend, legend_loc=4)
+    def plot():
+        for attribute, counter, label, log, out, legend in zip(x_attributes, counters, xlabels, log_axis, out_names,
+                                                               legends):
+            samples = counter.get_counts()
+            xs = []
+            ys = []
+            for a in attribute:
+                x, y = get_cdf_from_counts(samples[a], normalize=True)
+                xs.append(x)
+                ys.append(y)
 
+            plots_from_samples(xs=xs, ys=ys, xlabel=label, log_axis=log, save_fig=out, ylabel="Number of UTXOs",
+                               legend=legend, legend_loc=4)
 
-def utxo_based_analysis_with_filters(utxo_fin_name):
+    schedule_analysis(engine, utxo_fin_name, counters, plot)
+
+
+def utxo_based_analysis_with_filters(utxo_fin_name, engine=None):
     """
     Performs an utxo data analysis using different filters, to obtain for examples the amount of SegWit outputs.
 
     :param utxo_fin_name: Input file path which contains the chainstate utxo dump.
     :type: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
     :return: None
     :rtype: None
     """
@@ -262,27 +335,35 @@ def utxo_based_analysis_with_filters(utxo_fin_name):
     comparative = [True, True, False, False]
     legend_loc = 2
 
-    samples = get_filtered_samples(x_attribute, fin_name=utxo_fin_name, filtr=filters)
+    collector = FilteredCollector(x_attribute, filters)
+
+    def plot():
+        samples = collector.get_samples()
+
+        for out, legend, comp in zip(out_names, legends, comparative):
+            xs = []
+            ys = []
+            for _ in range(len(legend)):
+                x, y = get_cdf(samples.pop(0), normalize=True)
+                xs.append(x)
+                ys.append(y)
 
-    for out, legend, comp in zip(out_names, legends, comparative):
-        xs = []
-        ys = []
-        for _ in range(len(legend)):
-            x, y = get_cdf(samples.pop(0), normalize=True)
-            xs.append(x)
-            ys.append(y)
+            plots_from_samples(xs=xs, ys=ys, xlabel=xlabel, save_fig=out, legend=legend, legend_loc=legend_loc,
+                               ylabel="Number of UTXOs")
 
-        plots_from_samples(xs=xs, ys=ys, xlabel=xlabel, save_fig=out, legend=legend, legend_loc=legend_loc,
-                           ylabel="Number of UTXOs")
+    schedule_analysis(engine, utxo_fin_name, [collector], plot)
 
 
-def tx_based_analysis_with_filters(tx_fin_name):
+def tx_based_analysis_with_filters(tx_fin_name, engine=None):
     """
     Performs a transaction data analysis using different filters, to obtain for example the amount of coinbase
     transactions.
 
     :param tx_fin_name: Input file path which contains the chainstate transaction dump.
     :type: str
+    :param engine: Engine where the analysis is registered (so files are read along with other analysis), or None to
+    run it straight away.
+    :type engine: AnalysisEngine
     :return: None
     :rtype: None
     """
@@ -292,16 +373,23 @@ def tx_based_analysis_with_filters(tx_fin_name):
     out_names = ['tx_height_coinbase']
     filters = [lambda x: x["coinbase"]]
 
-    samples = get_filtered_samples(x_attributes, fin_name=tx_fin_name, filtr=filters)
-    xs, ys = get_cdf(samples, normalize=True)
+    collector = FilteredCollector(x_attributes, filters)
 
-    for label, out in zip(xlabels, out_names):
-        plots_from_samples(xs=xs, ys=ys, xlabel=label, save_fig=out, ylabel="Number of txs")
+    def plot():
+        xs, ys = get_cdf(collector.get_samples(), normalize=True)
 
+        for label, out in zip(xlabels, out_names):
+            plots_from_samples(xs=xs, ys=ys, xlabel=label, save_fig=out, ylabel="Number of txs")
 
-def run_experiment(coin, chainstate, count_p2sh, non_std_only):
+    schedule_analysis(engine, tx_fin_name, [collector], plot)
+
+
+def run_experiment(coin, chainstate, count_p2sh, non_std_only, streaming=False, n_workers=1, use_cache=True,
+                   resume=False, compression=None):
     """
-    Runs the whole experiment. You may comment the parts of it you are not interested in to save time.
+    Runs the whole experiment. Every step is a stage of the pipeline, identified by a fingerprint of its parameters and
+    inputs (see cache.py), so the steps whose outputs are already up to date are skipped, and only the ones affected by
+    a change (e.g. a new chainstate tip, new estimation data or a different count_p2sh flag) are run again.
 
     :param coin: Coin to be used in the experiment (bitcoin, litecoin, bitcoin cash, ...)
     :type coin: str
@@ -311,46 +399,113 @@ def run_experiment(coin, chainstate, count_p2sh, non_std_only):
     :type count_p2sh: bool
     :param non_std_only: Whether the experiment is performed only counting non standard outputs.
     :type non_std_only:bool
+    :param streaming: Whether the decoded utxos are streamed from the chainstate straight into the transaction and utxo
+    dumps (and the analysis), instead of being stored in an intermediate file.
+    :type streaming: bool
+    :param n_workers: Number of worker processes used to parse the chainstate and aggregate the transactions.
+    :type n_workers: int
+    :param use_cache: Whether the stages that are already up to date are skipped (True by default).
+    :type use_cache: bool
+    :param resume: Whether an interrupted parsing of the chainstate is resumed from its last checkpoint (see parse_ldb).
+    :type resume: bool
+    :param compression: Extension of the codec used to compress the dumps ('gz', 'zst' or 'lz4'), or None to store them
+    as plain text.
+    :type compression: str
     :return:
     """
 
-    # The following analysis reads/writes from/to large data files. Some of the steps can be ignored if those files have
-    # already been created (if more updated data is not requited). Otherwise lot of time will be put in re-parsing large
-    # files.
-
     # Set the name of the output data files
-    f_utxos, f_parsed_txs, f_parsed_utxos, f_dust = set_out_names(count_p2sh, non_std_only)
-
-    # Parse all the data in the chainstate.
-    print "Parsing the chainstate."
-    parse_ldb(f_utxos, fin_name=chainstate)
-
-    # Parses transactions and utxos from the dumped data.
-    print "Adding meta-data for transactions and UTXOs."
-    transaction_dump(f_utxos, f_parsed_txs)
-    utxo_dump(f_utxos, f_parsed_utxos, coin, count_p2sh=count_p2sh, non_std_only=non_std_only)
-
-    # Print basic stats from data
-    print "Running overview analysis."
-    overview_from_file(f_parsed_txs, f_parsed_utxos)
-
-    # Generate plots from tx data (from f_parsed_txs)
-    print "Running transaction based analysis."
-    tx_based_analysis(f_parsed_txs)
-
-    # Generate plots from utxo data (from f_parsed_utxos)
-    print "Running UTXO based analysis."
-    utxo_based_analysis(f_parsed_utxos)
-
-    # # Aggregates dust and generates plots.
-    print "Running dust analysis."
-    dust_analysis(f_parsed_utxos, f_dust)
-    dust_analysis_all_fees(f_parsed_utxos)
-
-    # Generate plots with filters
-    print "Running analysis with filters."
-    utxo_based_analysis_with_filters(f_parsed_utxos)
-    tx_based_analysis_with_filters(f_parsed_txs)
+    f_utxos, f_parsed_txs, f_parsed_utxos, f_dust = set_out_names(count_p2sh, non_std_only, compression)
+
+    # Fingerprints of every stage. Parsed data depends on the chainstate tip, utxo metadata also depends on the
+    # estimation data, and the analysis depend on the parsed data they read.
+    cache = StageCache(enabled=use_cache)
+    fp_utxos = get_fingerprint("parse_ldb", {"tip": get_chainstate_tip(chainstate)})
+    fp_txs = get_fingerprint("transaction_dump", inputs=[fp_utxos])
+    fp_parsed_utxos = get_fingerprint("utxo_dump", {"coin": coin, "count_p2sh": count_p2sh,
+                                                    "non_std_only": non_std_only},
+                                      inputs=[fp_utxos, get_estimation_data_hash(coin)])
+
+    # All the analysis are registered in the same engine, so each parsed file is read just once. Results (stats and
+    # plots) are generated in the same order the analysis are registered. Analysis are only registered if their
+    # results are not up to date.
+    engine = AnalysisEngine()
+    analysis = [("overview", get_fingerprint("overview", inputs=[fp_txs, fp_parsed_utxos]), []),
+                ("tx_analysis", get_fingerprint("tx_analysis", inputs=[fp_txs]), []),
+                ("utxo_analysis", get_fingerprint("utxo_analysis", inputs=[fp_parsed_utxos]), []),
+                ("dust_analysis", get_fingerprint("dust_analysis", inputs=[fp_parsed_utxos]), [f_dust])]
+    pending = [(stage, fp, outputs) for stage, fp, outputs in analysis if not cache.is_cached(stage, fp, outputs)]
+
+    for stage, fp, outputs in analysis:
+        if (stage, fp, outputs) not in pending:
+            print "{} is up to date. Skipping.".format(stage)
+        else:
+            # Forgotten until the engine is run, so an interrupted run is never taken as a valid one.
+            cache.store(stage, None, outputs)
+
+    stages = [stage for stage, _, _ in pending]
+
+    if "overview" in stages:
+        # Print basic stats from data
+        overview_from_file(f_parsed_txs, f_parsed_utxos, engine=engine)
+
+    if "tx_analysis" in stages:
+        # Generate plots from tx data (from f_parsed_txs)
+        tx_based_analysis(f_parsed_txs, engine=engine)
+
+    if "utxo_analysis" in stages:
+        # Generate plots from utxo data (from f_parsed_utxos)
+        utxo_based_analysis(f_parsed_utxos, engine=engine)
+
+    if "dust_analysis" in stages:
+        # # Aggregates dust and generates plots.
+        dust_analysis(f_parsed_utxos, f_dust, engine=engine)
+
+    if "utxo_analysis" in stages:
+        dust_analysis_all_fees(f_parsed_utxos, engine=engine)
+
+        # Generate plots with filters
+        utxo_based_analysis_with_filters(f_parsed_utxos, engine=engine)
+
+    if "tx_analysis" in stages:
+        tx_based_analysis_with_filters(f_parsed_txs, engine=engine)
+
+    dumps = [("transaction_dump", fp_txs, [f_parsed_txs]), ("utxo_dump", fp_parsed_utxos, [f_parsed_utxos])]
+    outdated = [(stage, fp, outputs) for stage, fp, outputs in dumps if not cache.is_cached(stage, fp, outputs)]
+
+    if streaming and outdated:
+        # Decoded utxos flow from the chainstate into the transaction and utxo dumps, that are stored and handed to the
+        # analysis at the same time.
+        for stage, fp, outputs in dumps:
+            cache.store(stage, None, outputs)
+
+        print "Parsing the chainstate and adding meta-data for transactions and UTXOs."
+        dump_chainstate(chainstate, f_parsed_txs, f_parsed_utxos, coin, count_p2sh=count_p2sh,
+                        non_std_only=non_std_only, tx_consumers=engine.pop_consumers(f_parsed_txs),
+                        utxo_consumers=engine.pop_consumers(f_parsed_utxos), n_workers=n_workers)
+
+        for stage, fp, outputs in dumps:
+            cache.store(stage, fp, outputs)
+
+    elif outdated:
+        # Parse all the data in the chainstate (skipped if it has already been parsed up to the same tip, unless the
+        # cache is disabled).
+        print "Parsing the chainstate."
+        cache.run("parse_ldb", fp_utxos, [f_utxos], parse_ldb, f_utxos, fin_name=chainstate, skip_same_tip=use_cache,
+                  n_workers=n_workers, resume=resume)
+
+        # Parses transactions and utxos from the dumped data.
+        print "Adding meta-data for transactions and UTXOs."
+        cache.run("transaction_dump", fp_txs, [f_parsed_txs], transaction_dump, f_utxos, f_parsed_txs,
+                  n_workers=n_workers)
+        cache.run("utxo_dump", fp_parsed_utxos, [f_parsed_utxos], utxo_dump, f_utxos, f_parsed_utxos, coin,
+                  count_p2sh=count_p2sh, non_std_only=non_std_only)
+
+    print "Running the analysis."
+    engine.run()
+
+    for stage, fp, outputs in pending:
+        cache.store(stage, fp, outputs)
 
 
 if __name__ == '__main__':
@@ -360,7 +515,14 @@ if __name__ == '__main__':
     count_p2sh = True
     coin = CFG.default_coin
 
-    opts, _ = getopt(argv[1:], 'c:pn', ['coin=', 'count_p2sh', 'non_std'])
+    streaming = False
+    n_workers = 1
+    use_cache = True
+    resume = False
+    compression = None
+
+    opts, _ = getopt(argv[1:], 'c:pnsw:frz:', ['coin=', 'count_p2sh', 'non_std', 'streaming', 'workers=', 'force',
+                                               'resume', 'compression='])
 
     for opt, arg in opts:
         if opt in ['c', '--coin']:
@@ -369,6 +531,16 @@ if __name__ == '__main__':
             count_p2sh = True
         elif opt in ['n', '--non_std_only']:
             non_std_only = True
+        elif opt in ['-s', '--streaming']:
+            streaming = True
+        elif opt in ['-w', '--workers']:
+            n_workers = int(arg)
+        elif opt in ['-f', '--force']:
+            use_cache = False
+        elif opt in ['-r', '--resume']:
+            resume = True
+        elif opt in ['-z', '--compression']:
+            compression = arg
 
     # When not using a snapshot, we directly use the chainstate under btc_core_dir (actually that's its default value)
     chainstate = CFG.chainstate_path
@@ -376,4 +548,5 @@ if __name__ == '__main__':
     # When using snapshots of the chainstate, specify the path to the chainstate snapshot
     # chainstate = path_to_snapshot
 
-    run_experiment(coin, chainstate, count_p2sh, non_std_only)
+    run_experiment(coin, chainstate, count_p2sh, non_std_only, streaming=streaming, n_workers=n_workers,
+                   use_cache=use_cache, resume=resume, compression=compression)
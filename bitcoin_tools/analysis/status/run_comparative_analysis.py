@@ -144,13 +144,20 @@ def run_experiment(f_dust, f_parsed_utxos, f_parsed_txs):
     # Get dust files from different dates to compare (Change / Add the ones you'll need)
     compare_dust(dust_files=dust_files, legend=legend)
 
-    # Dust comparision counting only P2PKH outputs
-    dust_files = ['height-' + str(i) + 'K/' + f_dust + '_p2pkh_only.json' for i in range(100, 550, 50)]
+    # Dust comparision counting only P2PKH, P2SH and native SegWit outputs. Each parsed file is read once for all the
+    # filters.
+    filters = {'p2pkh': lambda x: x['out_type'] == 0,
+               'p2sh': lambda x: x['out_type'] == 1,
+               'segwit': lambda x: x['non_std_type'] in ['P2WPKH', 'P2WSH']}
 
-    for utxo_fin, dust_fout in zip(fin_names, dust_files):
-         aggregate_dust_np(utxo_fin, dust_fout, fltr=lambda x: x['out_type'] == 0)
+    dust_files = {name: ['height-' + str(i) + 'K/' + f_dust + '_' + name + '_only.json' for i in range(100, 550, 50)]
+                  for name in filters}
 
-    compare_dust(dust_files=dust_files, legend=legend, suffix='_p2pkh')
+    for i, utxo_fin in enumerate(fin_names):
+        aggregate_dust_np(utxo_fin, {name: dust_files[name][i] for name in filters}, fltr=filters)
+
+    for name in sorted(filters):
+        compare_dust(dust_files=dust_files[name], legend=legend, suffix='_' + name)
 
     # Comparative analysis between different snapshots
     # UTXO amount comparison
@@ -1,26 +1,48 @@
-from bitcoin_tools import CFG
+"""
+Fork comparison between two UTXO sets (e.g. Bitcoin and Bitcoin Cash). Both sets are walked at once in key order (a
+merge-join, see utils.merge_walk), so outpoints are counted in constant memory, no matter how big the sets are. Sets can
+be given either as chainstates (LevelDB folders) or as decoded dumps (parse_ldb output), which are already sorted in
+chainstate key order.
 
+If the inputs are not sorted, the number of common outpoints can still be estimated with a Bloom filter of one of the
+sets (see estimate_fork_overlap), which takes around 1.2 bytes per outpoint instead of holding the whole key set.
+"""
+
+from bitcoin_tools.analysis.status.compression import open_dump
+from bitcoin_tools.analysis.status.columnar import iter_dump, is_columnar, ColumnReader
+from bitcoin_tools.analysis.status.utils import merge_walk, get_outpoint_key, get_outpoint, get_obfuscation_key, \
+    Deobfuscator, read_b128
+from binascii import unhexlify
+from bitcoin_tools.analysis.sketches import BloomFilter
+from argparse import ArgumentParser
+
+import plyvel
 import ujson
-import pickle
+import os
+
+
+# Height of the last block shared by Bitcoin and Bitcoin Cash.
+FORK_HEIGHT = 478558
 
 
 def load_data(fin_name):
     """
-    Returns a set of keys in a given UTXO set (specified by its decoded_utxos.json file)
+    Returns a set of outpoints in a given UTXO set (specified by its decoded_utxos.json file). Outpoints are kept packed
+    (see utils.pack_outpoint) instead of as hex keys.
 
     :param fin_name: path of the decoded_utxos.json file
-    :return: a set with keys
+    :return: a set with packed outpoints
     """
     keys = set()
-    fin = open(CFG.data_path + fin_name, 'r')
+    fin = open_dump(fin_name)
     for line in fin:
         data = ujson.loads(line[:-1])
-        keys.add(data["key"])
+        keys.add(get_outpoint(unhexlify(data["key"])))
     fin.close()
     return keys
 
 
-def count_before_fork(fin_name, fork_height=478558):
+def count_before_fork(fin_name, fork_height=FORK_HEIGHT):
     """
     Counts how many UTXOs are there before and after a given height (in an UTXO set specified by its
     decoded_utxos.json file)
@@ -31,7 +53,7 @@ def count_before_fork(fin_name, fork_height=478558):
     """
 
     before, after = 0, 0
-    fin = open(CFG.data_path + fin_name, 'r')
+    fin = open_dump(fin_name)
     for line in fin:
         data = ujson.loads(line[:-1])
         if data["value"]["height"] <= fork_height:
@@ -42,30 +64,236 @@ def count_before_fork(fin_name, fork_height=478558):
     return before, after
 
 
+def iter_dump_heights(fin_name):
+    """
+    Iterates over the outpoints of a decoded utxo dump (see parse_ldb), in chainstate key order.
+
+    :param fin_name: Name of the decoded utxo dump (json or columnar).
+    :type fin_name: str
+    :return: Generator of (key, height) tuples, where key is the chainstate key of the outpoint.
+    """
+
+    last_key = None
+
+    for key, height in _iter_dump_keys(fin_name):
+        # The merge-join relies on the order of the dump, so an unsorted input would silently give wrong counts.
+        if last_key is not None and key <= last_key:
+            raise Exception("{} is not sorted in chainstate key order.".format(fin_name))
+        last_key = key
+
+        yield key, height
+
+
+def _iter_dump_keys(fin_name, chunk_size=100000):
+    """
+    Iterates over the outpoints of a decoded utxo dump, as they are stored. Transaction ids of columnar dumps are read
+    raw, so they are never turned into hex.
+
+    :param fin_name: Name of the decoded utxo dump (json or columnar).
+    :type fin_name: str
+    :param chunk_size: Number of rows read at once from columnar dumps.
+    :type chunk_size: int
+    :return: Generator of (key, height) tuples.
+    """
+
+    if is_columnar(fin_name):
+        reader = ColumnReader(fin_name)
+        for start in range(0, len(reader), chunk_size):
+            outpoints = reader.get_outpoints(start, start + chunk_size)
+            heights = reader.get_column("height", start, start + chunk_size).tolist()
+            for tx_id, index, height in zip(outpoints["tx_id"], outpoints["index"].tolist(), heights):
+                yield get_outpoint_key(tx_id.tostring(), index), height
+    else:
+        for utxo in iter_dump(fin_name):
+            yield get_outpoint_key(utxo["tx_id"], utxo["index"]), utxo["height"]
+
+
+def iter_chainstate_heights(fin_name):
+    """
+    Iterates over the outpoints of a chainstate, in key order. Only the height of every coin is decoded.
+
+    :param fin_name: Name of the LevelDB folder of the chainstate.
+    :type fin_name: str
+    :return: Generator of (key, height) tuples.
+    """
+
+    db = plyvel.DB(fin_name, compression=None)
+    snapshot = db.snapshot()
+    deobfuscator = Deobfuscator(get_obfuscation_key(snapshot))
+
+    try:
+        for key, o_value in snapshot.iterator(prefix=b'C'):
+            # The height is in the first varint of the coin (code = height << 1 | coinbase), which takes at most 5
+            # bytes, so the rest of the value does not need to be de-obfuscated.
+            code, _ = read_b128(bytearray(deobfuscator.deobfuscate(o_value[:8])))
+            yield key, code >> 1
+    finally:
+        snapshot.close()
+        db.close()
+
+
+def iter_heights(fin_name, check_order=True):
+    """
+    Iterates over the outpoints of a UTXO set, either a chainstate or a decoded utxo dump.
+
+    :param fin_name: Name of the LevelDB folder of the chainstate, or of the decoded utxo dump.
+    :type fin_name: str
+    :param check_order: Whether dumps are checked to be sorted in key order (see iter_dump_heights). Only needed by
+    compare_forks.
+    :type check_order: bool
+    :return: Generator of (key, height) tuples, in key order (dumps are given as they are stored if check_order is not
+    set).
+    """
+
+    # Every LevelDB folder has a CURRENT file (pointing to its manifest).
+    if os.path.isfile(os.path.join(fin_name, "CURRENT")):
+        return iter_chainstate_heights(fin_name)
+    elif check_order:
+        return iter_dump_heights(fin_name)
+    else:
+        return _iter_dump_keys(fin_name)
+
+
+def compare_forks(iter_a, iter_b, fork_height=FORK_HEIGHT):
+    """
+    Compares two UTXO sets by walking both of them at once in key order.
+
+    :param iter_a: (key, height) iterator of the first set, sorted by key (see iter_heights).
+    :type iter_a: iterator
+    :param iter_b: (key, height) iterator of the second set, sorted by key (see iter_heights).
+    :type iter_b: iterator
+    :param fork_height: Last block in common.
+    :type fork_height: int
+    :return: Number of outpoints in both sets (common), only in one of them (only_a, only_b), and with height before
+    (<= fork_height) and after the fork in each set (before_a, after_a, before_b, after_b).
+    :rtype: dict
+    """
+
+    stats = dict.fromkeys(["common", "only_a", "only_b", "before_a", "after_a", "before_b", "after_b"], 0)
+
+    for _, height_a, height_b in merge_walk(iter_a, iter_b):
+        if height_a is None:
+            stats["only_b"] += 1
+        elif height_b is None:
+            stats["only_a"] += 1
+        else:
+            stats["common"] += 1
+
+        if height_a is not None:
+            stats["before_a" if height_a <= fork_height else "after_a"] += 1
+        if height_b is not None:
+            stats["before_b" if height_b <= fork_height else "after_b"] += 1
+
+    return stats
+
+
+def iter_batches(iterator, batch_size):
+    """
+    Groups the entries of a (key, height) iterator in batches.
+
+    :param iterator: (key, height) iterator.
+    :type iterator: iterator
+    :param batch_size: Number of entries per batch.
+    :type batch_size: int
+    :return: Generator of (keys, heights) tuples, with up to batch_size entries each.
+    """
+
+    batch = []
+
+    for entry in iterator:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield zip(*batch)
+            batch = []
+
+    if batch:
+        yield zip(*batch)
+
+
+def estimate_fork_overlap(iter_a, iter_b, capacity, fork_height=FORK_HEIGHT, error_rate=0.001, batch_size=100000):
+    """
+    Estimates the comparison of two UTXO sets (same output as compare_forks) when they can not be walked in key order.
+    The keys of the first set are added to a Bloom filter, which is then queried with the keys of the second one.
+    Before and after fork counts are exact, while common, only_a and only_b are estimated (false positives of the
+    filter are discounted from the number of common outpoints).
+
+    :param iter_a: (key, height) iterator of the first set.
+    :type iter_a: iterator
+    :param iter_b: (key, height) iterator of the second set.
+    :type iter_b: iterator
+    :param capacity: Expected number of outpoints in the first set (used to size the filter).
+    :type capacity: int
+    :param fork_height: Last block in common.
+    :type fork_height: int
+    :param error_rate: False positive rate of the filter.
+    :type error_rate: float
+    :param batch_size: Number of keys added to (or looked up in) the filter at once.
+    :type batch_size: int
+    :return: Estimated comparison (see compare_forks).
+    :rtype: dict
+    """
+
+    stats = dict.fromkeys(["common", "only_a", "only_b", "before_a", "after_a", "before_b", "after_b"], 0)
+    bloom = BloomFilter(capacity, error_rate)
+    hits = 0
+
+    for keys, heights in iter_batches(iter_a, batch_size):
+        bloom.update(keys)
+        before = sum(1 for height in heights if height <= fork_height)
+        stats["before_a"] += before
+        stats["after_a"] += len(heights) - before
+
+    for keys, heights in iter_batches(iter_b, batch_size):
+        hits += int(bloom.contains(keys).sum())
+        before = sum(1 for height in heights if height <= fork_height)
+        stats["before_b"] += before
+        stats["after_b"] += len(heights) - before
+
+    n_a = stats["before_a"] + stats["after_a"]
+    n_b = stats["before_b"] + stats["after_b"]
+
+    # Every key of b that is not in a is found in the filter with probability fp_rate, so the number of hits is
+    # common + (n_b - common) * fp_rate.
+    fp_rate = bloom.get_error_rate()
+    common = int(round(max(hits - n_b * fp_rate, 0) / (1 - fp_rate)))
+
+    stats["common"] = min(common, n_a, n_b)
+    stats["only_a"] = n_a - stats["common"]
+    stats["only_b"] = n_b - stats["common"]
+
+    return stats
+
+
 if __name__ == '__main__':
 
     """
-    Analyses two chainstates, belonging to a fork of the same coin:
-    * Counts how many UTXOs they have in common
-    * Counts how many UTXOs with height < fork_height exist in each set
+    Analyses two UTXO sets (chainstates or decoded utxo dumps), belonging to a fork of the same coin:
+    * Counts how many UTXOs they have in common (and only in one of them)
+    * Counts how many UTXOs with height <= fork_height exist in each set
     """
 
-    decoded_utxo_files = ["0.15-20180206/decoded_utxos.json", "bu-0.15-20180206/decoded_utxos.json"]
+    parser = ArgumentParser()
+    parser.add_argument('utxo_sets', nargs=2, help='Chainstate folders or decoded utxo dumps (relative to the data '
+                                                   'path) of both sides of the fork.')
+    parser.add_argument('-f', '--fork-height', type=int, default=FORK_HEIGHT, help='Last block in common.')
+    parser.add_argument('-b', '--bloom', type=int, default=None, metavar='CAPACITY',
+                        help='Estimate the overlap with a Bloom filter of the first set (sized for CAPACITY outpoints) '
+                             'instead of a merge-join. Only needed if the sets are not sorted in key order.')
+    args = parser.parse_args()
 
-    # Intersection
-    keys_btc = load_data(decoded_utxo_files[0])
-    keys_bu = load_data(decoded_utxo_files[1])
-    # For btc vs bu on 2018-02-06: 41 GB mem
-    set_int = keys_bu.intersection(keys_btc)
-    # For btc vs bu on 2018-02-06: 42.6 GB
-    print("There are {} UTXOs in common".format(len(set_int)))
-    pickle.dump(set_int, open("bu_btc_keys_intersect.pickle", "wb"))
+    set_a, set_b = args.utxo_sets
 
-    # After/before fork
-    before_btc, after_btc = count_before_fork(decoded_utxo_files[0])
-    before_bu, after_bu = count_before_fork(decoded_utxo_files[1])
+    if args.bloom:
+        stats = estimate_fork_overlap(iter_heights(set_a, check_order=False), iter_heights(set_b, check_order=False),
+                                      args.bloom, args.fork_height)
+    else:
+        # For btc vs bu on 2018-02-06, building both key sets took 42.6 GB of memory. The merge-join only keeps the
+        # current entry of each set.
+        stats = compare_forks(iter_heights(set_a), iter_heights(set_b), args.fork_height)
 
-    print("Bitcoin UTXO set has {} UTXOs with height <= fork date (of a total of {})".
-          format(before_btc, before_btc + after_btc))
-    print("BitcoinCash UTXO set has {} UTXOs with height <= fork date  (of a total of {})".
-          format(before_bu, before_bu + after_bu))
+    print("There are {} UTXOs in common ({} only in {}, {} only in {})".format(stats["common"], stats["only_a"], set_a,
+                                                                              stats["only_b"], set_b))
+    print("{} has {} UTXOs with height <= fork date (of a total of {})".
+          format(set_a, stats["before_a"], stats["before_a"] + stats["after_a"]))
+    print("{} has {} UTXOs with height <= fork date (of a total of {})".
+          format(set_b, stats["before_b"], stats["before_b"] + stats["after_b"]))
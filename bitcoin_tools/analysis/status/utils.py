@@ -1,13 +1,24 @@
+import os
 import plyvel
+import numpy as np
 from binascii import hexlify, unhexlify
 import ujson
 from math import ceil
-from copy import deepcopy
+from collections import deque, OrderedDict
+from struct import Struct
+from multiprocessing import Pool
 from bitcoin_tools.analysis.status import *
+from bitcoin_tools.analysis.status.columnar import DECODED_UTXOS, OUTPOINT, ColumnReader, open_writer, encode_chunk, \
+    iter_dump, find_columnar, get_raw_tx_id
+from bitcoin_tools.analysis.status.compression import open_dump
 from bitcoin_tools.utils import change_endianness, encode_varint
 from bitcoin_tools.core.script import OutputScript
+from bitcoin.core.script import OPCODE_NAMES
 from bitcoin_tools.core.keys import get_uncompressed_pk
 
+# Classes of the scripts that are not compressed in the chainstate (see classify_scripts).
+SCRIPT_OTHER, SCRIPT_MULTISIG, SCRIPT_P2WPKH, SCRIPT_P2WSH, SCRIPT_OPRETURN = range(5)
+
 
 def txout_compress(n):
     """ Compresses the Satoshi amount of a UTXO to be stored in the LevelDB. Code is a port from the Bitcoin Core C++
@@ -176,7 +187,7 @@ def parse_b128(utxo, offset=0):
     return data, offset
 
 
-def decode_utxo(coin, outpoint):
+def decode_utxo(coin, outpoint, raw_ids=False):
     """
     Decodes a LevelDB serialized UTXO for Bitcoin core v 0.15 onwards. The serialized format is defined in the Bitcoin
     Core source code as outpoint:coin.
@@ -200,6 +211,8 @@ def decode_utxo(coin, outpoint):
     :type coin: str
     :param outpoint: The outpoint to be decoded (extracted from the chainstate)
     :type outpoint: str
+    :param raw_ids: Whether the transaction id is given back raw (32 bytes) instead of hex.
+    :type raw_ids: bool
     :return; The decoded UTXO.
     :rtype: dict
     """
@@ -210,7 +223,7 @@ def decode_utxo(coin, outpoint):
     # Check the provided outpoint has at least the minimum length (1 byte of key code, 32 bytes tx id, 1 byte index)
     assert len(outpoint) >= 68
     # Get the transaction id (LE) by parsing the next 32 bytes of the outpoint.
-    tx_id = outpoint[2:66]
+    tx_id = unhexlify(outpoint[2:66]) if raw_ids else outpoint[2:66]
     # Finally get the transaction index by decoding the remaining bytes as a b128 VARINT
     tx_index = b128_decode(outpoint[66:])
 
@@ -256,6 +269,84 @@ def decode_utxo(coin, outpoint):
     return {'tx_id': tx_id, 'index': tx_index, 'coinbase': coinbase, 'out': out, 'height': height}
 
 
+def read_b128(data, offset=0):
+    """ Reads a base-128 varint from a bytearray, starting at a given offset. Bytes-native counterpart of
+    parse_b128 + b128_decode, that avoids the hex round-trip by reading the integer value of each byte directly.
+
+    :param data: Serialized data from which the varint will be read.
+    :type data: bytearray
+    :param offset: Offset where the beginning of the varint is located in the data.
+    :type offset: int
+    :return: The decoded value, and the offset of the byte located right after it.
+    :rtype: int, int
+    """
+
+    n = 0
+    while True:
+        d = data[offset]
+        offset += 1
+        n = n << 7 | d & 0x7F
+        if d & 0x80:
+            n += 1
+        else:
+            return n, offset
+
+
+def decode_utxo_bytes(coin, outpoint, raw_ids=False):
+    """
+    Decodes a LevelDB serialized UTXO for Bitcoin core v 0.15 onwards, working directly with the raw bytes read from
+    the LevelDB instead of their hex representation. The output is the same as the one of decode_utxo, so both can be
+    used interchangeably. Refer to decode_utxo for a description of the serialization format.
+
+    :param coin: The coin to be decoded (extracted from the chainstate and de-obfuscated)
+    :type coin: str
+    :param outpoint: The outpoint to be decoded (extracted from the chainstate)
+    :type outpoint: str
+    :param raw_ids: Whether the transaction id is given back raw (32 bytes) instead of hex.
+    :type raw_ids: bool
+    :return; The decoded UTXO.
+    :rtype: dict
+    """
+
+    # Check that the input data corresponds to a transaction and that it has at least the minimum length (1 byte of
+    # key code, 32 bytes tx id, 1 byte index)
+    assert outpoint[:1] == b'C'
+    assert len(outpoint) >= 34
+
+    tx_id = outpoint[1:33] if raw_ids else hexlify(outpoint[1:33])
+    tx_index, _ = read_b128(bytearray(outpoint), 33)
+
+    # Indexing a bytearray returns ints, so varints can be parsed without any hex conversion.
+    data = bytearray(coin)
+
+    code, offset = read_b128(data)
+    height = code >> 1
+    coinbase = code & 0x01
+
+    amount, offset = read_b128(data, offset)
+    amount = txout_decompress(amount)
+
+    out_type, offset = read_b128(data, offset)
+
+    if out_type in [0, 1]:
+        data_size = 20
+    elif out_type in [2, 3, 4, 5]:
+        # The out_type byte is also the first byte of the (compressed) public key.
+        data_size = 33
+        offset -= 1
+    else:
+        data_size = out_type - NSPECIALSCRIPTS
+
+    script = coin[offset:]
+
+    # Assert that the script hash the expected length
+    assert len(script) == data_size
+
+    out = {'amount': amount, 'out_type': out_type, 'data': hexlify(script)}
+
+    return {'tx_id': tx_id, 'index': tx_index, 'coinbase': coinbase, 'out': out, 'height': height}
+
+
 def decompress_script(compressed_script, script_type):
     """ Takes CScript as stored in leveldb and returns it in uncompressed form
     (de)compression scheme is defined in bitcoin/src/compressor.cpp
@@ -316,56 +407,634 @@ def display_decoded_utxo(decoded_utxo):
     print "Block height: " + str(decoded_utxo['height'])
 
 
-def parse_ldb(fout_name, fin_name=CFG.chainstate_path, decode=True):
+def get_shard_ranges(n_shards, prefix=b'C'):
+    """
+    Splits the outpoint keyspace of the chainstate into n_shards contiguous ranges, using the first byte of the
+    transaction id as the partition key. Ranges are returned in keyspace order, so concatenating the data parsed from
+    each of them gives the same result as a single pass over the whole keyspace.
+
+    :param n_shards: Number of ranges in which the keyspace will be split (between 1 and 256).
+    :type n_shards: int
+    :param prefix: Prefix of the keys to be split (b'C' for UTXOs).
+    :type prefix: str
+    :return: A list of (start, stop) key pairs, where start is inclusive and stop is exclusive.
+    :rtype: list of tuple
+    """
+
+    if not 1 <= n_shards <= 256:
+        raise Exception("The number of shards must be between 1 and 256.")
+
+    bounds = [i * 256 // n_shards for i in range(n_shards)] + [256]
+
+    ranges = []
+    for lower, upper in zip(bounds[:-1], bounds[1:]):
+        start = prefix + chr(lower)
+        # The last shard ends right after the prefix (e.g. b'D' for b'C').
+        stop = prefix + chr(upper) if upper < 256 else chr(ord(prefix) + 1)
+        ranges.append((start, stop))
+
+    return ranges
+
+
+def parse_entry(key, value, decode=True, raw_ids=False):
+    """
+    Parses a raw (key, value) entry from the chainstate, decoding it if necessary.
+
+    :param key: Raw outpoint, as read from the LevelDB.
+    :type key: str
+    :param value: Raw coin, already de-obfuscated.
+    :type value: str
+    :param decode: Whether the parsed data is decoded or not (default: True)
+    :type decode: bool
+    :param raw_ids: Whether the transaction id of decoded UTXOs is given back raw (32 bytes) instead of hex.
+    :type raw_ids: bool
+    :return: The decoded UTXO, or the coin (hex) if decode is not set.
+    :rtype: dict or hex str
+    """
+
+    # If the decode flag is passed, we also decode the utxo before storing it. This is really useful when running
+    # a full analysis since will avoid decoding the whole utxo set twice (once for the utxo and once for the tx
+    # based analysis)
+    if decode:
+        utxo = decode_utxo_bytes(value, key, raw_ids)
+        utxo['len'] = len(key) + len(value)
+    else:
+        utxo = hexlify(value)
+
+    return utxo
+
+
+def _parse_chunk(args):
+    """
+    Parses a chunk of raw chainstate entries into json lines. Runs inside the worker processes of parse_ldb.
+
+    :param args: Shard id, obfuscation key, decode flag, output format and list of raw (key, value) entries.
+    :type args: tuple
+    :return: The shard id, the encoded chunk (see encode_chunk, or the list of parsed entries if the format is None), the
+    number of parsed entries, the maximum height found in the chunk (None if the entries are not decoded or the
+    chunk is empty) and the last key of the chunk (None if the chunk is empty).
+    :rtype: int, str, int, int, str
+    """
+
+    shard, o_key, decode, fmt, chunk = args
+
+    # The whole chunk is de-obfuscated at once.
+    values = Deobfuscator(o_key).deobfuscate_batch([o_value for _, o_value in chunk])
+
+    # Columnar dumps store transaction ids raw, so there is no point in turning them into hex.
+    raw_ids = fmt == "columnar"
+    utxos = [parse_entry(key, value, decode, raw_ids) for (key, _), value in zip(chunk, values)]
+
+    height = max([utxo['height'] for utxo in utxos]) if decode and utxos else None
+
+    # If no format is given, the parsed entries are returned as they are.
+    if fmt is not None:
+        utxos = encode_chunk(utxos, fmt, DECODED_UTXOS, sort_keys=True)
+
+    return shard, utxos, len(chunk), height, chunk[-1][0] if chunk else None
+
+
+def _read_chunks(db, ranges, o_key, decode, fmt, chunk_size):
+    """
+    Iterates over the given keyspace ranges of the chainstate, yielding chunks of raw entries ready to be handed to a
+    worker process.
+
+    :param db: Open chainstate LevelDB (or snapshot).
+    :type db: plyvel.DB
+    :param ranges: Keyspace ranges (from get_shard_ranges).
+    :type ranges: list of tuple
+    :param o_key: Obfuscation key (or None if the chainstate is not obfuscated).
+    :type o_key: str
+    :param decode: Whether the parsed data is decoded or not.
+    :type decode: bool
+    :param fmt: Output format, either 'json', 'columnar' or None (parsed entries are not encoded).
+    :type fmt: str
+    :param chunk_size: Number of entries per chunk.
+    :type chunk_size: int
+    :return: Generator of (shard id, o_key, decode, fmt, chunk) tuples.
+    """
+
+    for shard, (start, stop) in enumerate(ranges):
+        chunk = []
+        for key, o_value in db.iterator(start=start, stop=stop):
+            chunk.append((key, o_value))
+            if len(chunk) == chunk_size:
+                yield shard, o_key, decode, fmt, chunk
+                chunk = []
+
+        # Empty chunks are also sent so every shard gets reported, even if it holds no data.
+        yield shard, o_key, decode, fmt, chunk
+
+
+def _parse_chunks(db, ranges, o_key, decode, fmt, chunk_size, n_workers=1):
+    """
+    Parses the given keyspace ranges of the chainstate, yielding the parsed chunks in keyspace order. If n_workers is
+    bigger than one, chunks are parsed by a pool of worker processes.
+
+    :param db: Open chainstate LevelDB (or snapshot).
+    :type db: plyvel.DB
+    :param ranges: Keyspace ranges (from get_shard_ranges).
+    :type ranges: list of tuple
+    :param o_key: Obfuscation key (or None if the chainstate is not obfuscated).
+    :type o_key: str
+    :param decode: Whether the parsed data is decoded or not.
+    :type decode: bool
+    :param fmt: Output format, either 'json', 'columnar' or None (parsed entries are not encoded).
+    :type fmt: str
+    :param chunk_size: Number of entries per chunk.
+    :type chunk_size: int
+    :param n_workers: Number of worker processes.
+    :type n_workers: int
+    :return: Generator of parsed chunks (as returned by _parse_chunk).
+    """
+
+    chunks = _read_chunks(db, ranges, o_key, decode, fmt, chunk_size)
+
+    if n_workers <= 1:
+        for args in chunks:
+            yield _parse_chunk(args)
+        return
+
+    pool = Pool(n_workers)
+
+    # Chunks are submitted through a bounded window, so the parent does not read the whole chainstate into memory if
+    # the workers fall behind. Results are collected in submission order, which keeps the output sorted.
+    pending = deque()
+    max_pending = 4 * n_workers
+
+    try:
+        for args in chunks:
+            pending.append(pool.apply_async(_parse_chunk, (args,)))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+        pool.close()
+
+    except:
+        pool.terminate()
+        raise
+
+    finally:
+        pool.join()
+
+
+def get_manifest_name(fout_name):
+    """
+    Gets the name of the manifest file that describes a given parse_ldb output file.
+
+    :param fout_name: Name of the parse_ldb output file.
+    :type fout_name: str
+    :return: The name of the manifest file.
+    :rtype: str
+    """
+
+    return fout_name + ".manifest"
+
+
+def load_manifest(fout_name):
+    """
+    Loads the manifest of a given parse_ldb output file.
+
+    :param fout_name: Name of the parse_ldb output file.
+    :type fout_name: str
+    :return: The manifest, or None if there is no manifest for the given file.
+    :rtype: dict
+    """
+
+    try:
+        with open(CFG.data_path + get_manifest_name(fout_name)) as f:
+            return ujson.load(f)
+    except IOError:
+        return None
+
+
+def get_checkpoint_name(fout_name):
+    """
+    Gets the name of the checkpoint file of a given parse_ldb output file (see parse_ldb).
+
+    :param fout_name: Name of the parse_ldb output file.
+    :type fout_name: str
+    :return: The name of the checkpoint file.
+    :rtype: str
+    """
+
+    return fout_name + ".checkpoint"
+
+
+def load_checkpoint(fout_name):
+    """
+    Loads the checkpoint of an unfinished parse_ldb run.
+
+    :param fout_name: Name of the parse_ldb output file.
+    :type fout_name: str
+    :return: The checkpoint, or None if there is no checkpoint for the given file.
+    :rtype: dict
+    """
+
+    try:
+        with open(CFG.data_path + get_checkpoint_name(fout_name)) as f:
+            return ujson.load(f)
+    except IOError:
+        return None
+
+
+def store_checkpoint(fout_name, checkpoint):
+    """
+    Stores the checkpoint of a parse_ldb run. The checkpoint file is replaced at once, so a crash while storing it
+    leaves the previous checkpoint untouched.
+
+    :param fout_name: Name of the parse_ldb output file.
+    :type fout_name: str
+    :param checkpoint: Checkpoint to be stored.
+    :type checkpoint: dict
+    :return: None
+    :rtype: None
+    """
+
+    f_name = CFG.data_path + get_checkpoint_name(fout_name)
+
+    with open(f_name + ".tmp", 'w') as f:
+        f.write(ujson.dumps(checkpoint))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.rename(f_name + ".tmp", f_name)
+
+
+def resume_ranges(ranges, last_key):
+    """
+    Trims the given keyspace ranges so they start right after a given key (the keys up to it have already been parsed).
+
+    :param ranges: Keyspace ranges (from get_shard_ranges).
+    :type ranges: list of tuple
+    :param last_key: Last parsed key.
+    :type last_key: str
+    :return: The trimmed ranges. Completed ranges are kept (empty), so shard ids do not change.
+    :rtype: list of tuple
+    """
+
+    # Smallest key bigger than last_key.
+    next_key = last_key + b'\x00'
+
+    return [(max(start, min(next_key, stop)), stop) for start, stop in ranges]
+
+
+def get_best_block(db, deobfuscator):
+    """
+    Gets the hash of the block a chainstate is updated to (stored under the B key).
+
+    Bitcoin Core erases the B key (and stores the H key instead) while a flush of the chainstate is in progress. Such a
+    chainstate is not consistent, so an exception is raised in that case.
+
+    :param db: Open chainstate LevelDB (or snapshot).
+    :type db: plyvel.DB
+    :param deobfuscator: De-obfuscator for the chainstate values.
+    :type deobfuscator: Deobfuscator
+    :return: The block hash (Big Endian), or None if the chainstate has no best block.
+    :rtype: hex str
+    """
+
+    o_best_block = db.get(b'B')
+
+    if o_best_block is None:
+        if db.get(b'H') is not None:
+            raise Exception("The chainstate was copied in the middle of a flush (head blocks key found), so it is not "
+                            "consistent. Stop bitcoind properly before copying it.")
+        return None
+
+    return change_endianness(hexlify(deobfuscator.deobfuscate(o_best_block)))
+
+
+def get_chainstate_tip(fin_name=CFG.chainstate_path):
+    """
+    Gets the hash of the block a chainstate is updated to, without parsing it.
+
+    :param fin_name: Name of the LevelDB folder (CFG.chainstate_path by default)
+    :type fin_name: str
+    :return: The block hash (Big Endian), or None if the chainstate has no best block.
+    :rtype: hex str
+    """
+
+    db = plyvel.DB(fin_name, compression=None)
+
+    try:
+        return get_best_block(db, Deobfuscator(get_obfuscation_key(db)))
+    finally:
+        db.close()
+
+
+def parse_ldb(fout_name, fin_name=CFG.chainstate_path, decode=True, n_workers=1, n_shards=16, chunk_size=10000,
+              skip_same_tip=False, fmt="json", resume=False, checkpoint_every=10 ** 6):
     """
     Parsed data from the chainstate LevelDB and stores it in a output file.
+
+    Data is read from a LevelDB snapshot, and the best block of the chainstate (B key) is checked before and after the
+    scan. The best block hash, the height of the tip (the highest height found amongst the UTXOs, since the coinbase
+    of the tip can not be spent yet) and the number of parsed entries are stored in a manifest next to the output file
+    (see get_manifest_name), so every output can be tied to an exact chain tip.
+
+    If n_workers is bigger than one, the keyspace is split into n_shards ranges (by the first byte of the transaction
+    id), and the de-obfuscation, decoding and serialization of the entries is performed by a pool of worker processes.
+    Notice that LevelDB holds an exclusive lock on the database folder, so the iteration itself is done by the parent
+    process, that feeds the workers with chunks of raw entries. Results are written in keyspace order, so the output
+    file is identical to the one generated by a single process.
+
+    Every checkpoint_every entries, the output is flushed to disk and a checkpoint is stored next to it (see
+    get_checkpoint_name), with the last key written and the state of the output (e.g. its size). If the parsing is
+    interrupted, it can be resumed (resume=True): the output is truncated to the checkpoint and the chainstate is
+    iterated from the next key onwards. Notice that a parsing can only be resumed if the chainstate is still at the same
+    tip, since the output has to correspond to a single one.
+
     :param fout_name: Name of the file to output the data.
     :type fout_name: str
     :param fin_name: Name of the LevelDB folder (CFG.chainstate_path by default)
     :type fin_name: str
     :param decode: Whether the parsed data is decoded before stored or not (default: True)
     :type decode: bool
-    :return: None
-    :rtype: None
+    :param n_workers: Number of worker processes used to parse the data (default: 1, no parallelism).
+    :type n_workers: int
+    :param n_shards: Number of keyspace ranges in which the chainstate is split when parsing in parallel.
+    :type n_shards: int
+    :param chunk_size: Number of entries processed (and de-obfuscated) at once.
+    :type chunk_size: int
+    :param skip_same_tip: Whether to skip the parsing if the output file already exists and its manifest matches the
+    tip of the chainstate (default: False).
+    :type skip_same_tip: bool
+    :param fmt: Output format, either 'json' (default) or 'columnar' (see columnar.py). Columnar dumps can only be
+    created for decoded data.
+    :type fmt: str
+    :param resume: Whether to resume an interrupted parsing from its last checkpoint (if any).
+    :type resume: bool
+    :param checkpoint_every: Number of entries between checkpoints (0 or None for no checkpoints).
+    :type checkpoint_every: int
+    :return: The manifest of the output file.
+    :rtype: dict
     """
 
     prefix = b'C'
 
-    # Output file
-    fout = open(CFG.data_path + fout_name, 'w')
+    if fmt == "columnar" and not decode:
+        raise Exception("Columnar dumps can only be created for decoded data.")
+
     # Open the LevelDB
     db = plyvel.DB(fin_name, compression=None)  # Change with path to chainstate
+    # All the data is read from a snapshot, so it is consistent with a single chain tip.
+    snapshot = db.snapshot()
 
     # Load obfuscation key (if it exists)
-    o_key = db.get((unhexlify("0e00") + "obfuscate_key"))
+    o_key = get_obfuscation_key(snapshot)
+    best_block = get_best_block(snapshot, Deobfuscator(o_key))
+
+    # Check if the output is already up to date. An output with a pending checkpoint is not complete, no matter what
+    # its manifest says.
+    checkpoint = load_checkpoint(fout_name)
+    manifest = load_manifest(fout_name)
+    if skip_same_tip and checkpoint is None and manifest and manifest.get('best_block') == best_block \
+            and manifest.get('decode') == decode and manifest.get('fmt', 'json') == fmt \
+            and os.path.exists(CFG.data_path + fout_name):
+        print "{} is already parsed up to block {}. Skipping.".format(fout_name, best_block)
+        snapshot.close()
+        db.close()
+        return manifest
+
+    # The output is about to be rewritten, so its manifest is removed until the parsing is complete (otherwise, an
+    # interrupted parsing would leave a partial output next to a manifest of the same tip).
+    if os.path.exists(CFG.data_path + get_manifest_name(fout_name)):
+        os.remove(CFG.data_path + get_manifest_name(fout_name))
+
+    ranges = get_shard_ranges(n_shards if n_workers > 1 else 1, prefix)
+    counts = [0] * len(ranges)
+    height = None
+    current_shard = 0
+
+    if checkpoint and resume:
+        if checkpoint['best_block'] != best_block or checkpoint['decode'] != decode or checkpoint['fmt'] != fmt \
+                or len(checkpoint['counts']) != len(ranges):
+            snapshot.close()
+            db.close()
+            raise Exception("The checkpoint of {} does not match the current parsing (the chainstate tip, the format or "
+                            "the number of shards have changed). Parse it again without resuming.".format(fout_name))
+
+        counts, height = checkpoint['counts'], checkpoint['height']
+        ranges = resume_ranges(ranges, unhexlify(checkpoint['last_key']))
+
+        print "Resuming {} from key {} ({} entries already parsed).".format(fout_name, checkpoint['last_key'],
+                                                                           sum(counts))
+
+        fout = open_writer(fout_name, fmt, DECODED_UTXOS, sort_keys=True, state=checkpoint['writer'])
 
-    # If the key exists, the leading byte indicates the length of the key (8 byte by default). If there is no key,
-    # 8-byte zeros are used (since the key will be XORed with the given values).
-    if o_key is not None:
-        o_key = hexlify(o_key)[2:]
+    else:
+        if resume:
+            print "No checkpoint found for {}. Parsing from the beginning.".format(fout_name)
+
+        # Checkpoints of previous runs do not correspond to the new output.
+        if os.path.exists(CFG.data_path + get_checkpoint_name(fout_name)):
+            os.remove(CFG.data_path + get_checkpoint_name(fout_name))
+
+        fout = open_writer(fout_name, fmt, DECODED_UTXOS, sort_keys=True)
+
+    since_checkpoint = 0
 
     # For every UTXO (identified with a leading 'c'), the key (tx_id) and the value (encoded utxo) is displayed.
-    # UTXOs are obfuscated using the obfuscation key (o_key), in order to get them non-obfuscated, a XOR between the
-    # value and the key (concatenated until the length of the value is reached) if performed).
-    for key, o_value in db.iterator(prefix=prefix):
-        serialized_length = len(key) + len(o_value)
-        key = hexlify(key)
-        if o_key is not None:
-            utxo = deobfuscate_value(o_key, hexlify(o_value))
+    # UTXOs are obfuscated using the obfuscation key (o_key), in order to get them non-obfuscated, a XOR between
+    # the value and the key (concatenated until the length of the value is reached) if performed). Entries are
+    # processed in chunks so the de-obfuscation can be performed in batches.
+    try:
+        for shard, encoded, n, chunk_height, last_key in _parse_chunks(snapshot, ranges, o_key, decode, fmt,
+                                                                      chunk_size, n_workers):
+            fout.write_chunk(encoded)
+            counts[shard] += n
+            if chunk_height is not None:
+                height = max(height, chunk_height) if height is not None else chunk_height
+
+            since_checkpoint += n
+            if checkpoint_every and since_checkpoint >= checkpoint_every and last_key is not None:
+                store_checkpoint(fout_name, {"best_block": best_block, "decode": decode, "fmt": fmt,
+                                             "last_key": hexlify(last_key), "counts": counts, "height": height,
+                                             "writer": fout.get_state()})
+                since_checkpoint = 0
+
+            # Chunks are returned in keyspace order, so a shard is completed once a chunk from the next one is
+            # received.
+            if shard != current_shard:
+                print "Shard {}/{} parsed ({} entries).".format(current_shard + 1, len(ranges), counts[current_shard])
+                current_shard = shard
+
+        print "Shard {}/{} parsed ({} entries).".format(current_shard + 1, len(ranges), counts[current_shard])
+
+    except:
+        # The chainstate is released so the parsing can be resumed (the output is left as it is, since it is truncated
+        # to the last checkpoint when resuming).
+        snapshot.close()
+        db.close()
+        raise
+
+    finally:
+        fout.close()
+
+    # Check whether the chainstate has been modified during the scan. The output is consistent with the snapshot
+    # anyway, but it may not correspond to the current state of the chainstate anymore.
+    if get_best_block(db, Deobfuscator(o_key)) != best_block:
+        print "Warning: The chainstate has been updated during the scan. Parsed data corresponds to block {}." \
+            .format(best_block)
+
+    snapshot.close()
+    db.close()
+
+    manifest = {"best_block": best_block, "height": height, "chainstate": fin_name, "decode": decode, "fmt": fmt,
+                "entries": sum(counts)}
+
+    with open(CFG.data_path + get_manifest_name(fout_name), 'w') as f:
+        f.write(ujson.dumps(manifest))
+
+    # The parsing is complete, so there is nothing left to resume.
+    if os.path.exists(CFG.data_path + get_checkpoint_name(fout_name)):
+        os.remove(CFG.data_path + get_checkpoint_name(fout_name))
+
+    return manifest
+
+
+def iter_chainstate(fin_name=CFG.chainstate_path, n_workers=1, n_shards=16, chunk_size=10000):
+    """
+    Iterates over the decoded utxos of the chainstate, in the same order (and with the same data) as they are stored by
+    parse_ldb, without storing them. Data is read from a LevelDB snapshot.
+
+    :param fin_name: Name of the LevelDB folder (CFG.chainstate_path by default)
+    :type fin_name: str
+    :param n_workers: Number of worker processes used to decode the data (default: 1, no parallelism).
+    :type n_workers: int
+    :param n_shards: Number of keyspace ranges in which the chainstate is split when decoding in parallel.
+    :type n_shards: int
+    :param chunk_size: Number of entries processed (and de-obfuscated) at once.
+    :type chunk_size: int
+    :return: Generator of decoded utxos.
+    """
+
+    db = plyvel.DB(fin_name, compression=None)
+    snapshot = db.snapshot()
+
+    o_key = get_obfuscation_key(snapshot)
+    ranges = get_shard_ranges(n_shards if n_workers > 1 else 1)
+
+    try:
+        for _, utxos, _, _, _ in _parse_chunks(snapshot, ranges, o_key, True, None, chunk_size, n_workers):
+            for utxo in utxos:
+                yield utxo
+    finally:
+        snapshot.close()
+        db.close()
+
+
+def merge_walk(iter_a, iter_b):
+    """
+    Walks two sorted (key, value) iterators at once, matching the entries that share the same key.
+
+    :param iter_a: First sorted (key, value) iterator.
+    :type iter_a: iterator
+    :param iter_b: Second sorted (key, value) iterator.
+    :type iter_b: iterator
+    :return: Generator of (key, value_a, value_b) tuples, in key order, for every key in any of the iterators. The
+    value is None for the iterator that lacks the key.
+    """
+
+    a = next(iter_a, None)
+    b = next(iter_b, None)
+
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[0] < b[0]):
+            yield a[0], a[1], None
+            a = next(iter_a, None)
+        elif a is None or b[0] < a[0]:
+            yield b[0], None, b[1]
+            b = next(iter_b, None)
         else:
-            utxo = hexlify(o_value)
+            yield a[0], a[1], b[1]
+            a = next(iter_a, None)
+            b = next(iter_b, None)
+
+
+def diff_chainstates(old_fin_name, new_fin_name, fout_name):
+    """
+    Computes the difference between two snapshots of the chainstate, by walking both LevelDBs at once in key order.
+    Only the coins created and spent between both snapshots are stored in the output (delta) file, with the same
+    format used by parse_ldb plus a "delta" field, set to 1 for created coins and -1 for spent ones. Coins whose value
+    has changed are stored as spent (old value) and then created (new value). Entries are sorted in key order, like in
+    parse_ldb.
+
+    A manifest with the best block of both chainstates and the number of created and spent coins is stored next to
+    the output file (see get_manifest_name).
+
+    The delta file can be used to update the results of a previous analysis (see utxo_dump_delta and
+    aggregate_dust_np) instead of parsing the whole new chainstate.
+
+    :param old_fin_name: Name of the LevelDB folder of the old chainstate.
+    :type old_fin_name: str
+    :param new_fin_name: Name of the LevelDB folder of the new chainstate.
+    :type new_fin_name: str
+    :param fout_name: Name of the file to output the delta.
+    :type fout_name: str
+    :return: The manifest of the delta file.
+    :rtype: dict
+    """
 
-        # If the decode flag is passed, we also decode the utxo before storing it. This is really useful when running
-        # a full analysis since will avoid decoding the whole utxo set twice (once for the utxo and once for the tx
-        # based analysis)
-        if decode:
-            utxo = decode_utxo(utxo, key)
-            utxo['len'] = serialized_length
+    prefix = b'C'
 
-        fout.write(ujson.dumps(utxo, sort_keys=True) + "\n")
+    old_db = plyvel.DB(old_fin_name, compression=None)
+    new_db = plyvel.DB(new_fin_name, compression=None)
+    old_snapshot = old_db.snapshot()
+    new_snapshot = new_db.snapshot()
+
+    old_deobfuscator = Deobfuscator(get_obfuscation_key(old_snapshot))
+    new_deobfuscator = Deobfuscator(get_obfuscation_key(new_snapshot))
+
+    # If both chainstates share the same obfuscation key (e.g. they are snapshots of the same node), raw values can be
+    # compared without de-obfuscating them.
+    same_key = old_deobfuscator.key == new_deobfuscator.key
+
+    fout = open_dump(fout_name, 'w')
+    created = 0
+    spent = 0
+
+    for key, old_value, new_value in merge_walk(old_snapshot.iterator(prefix=prefix),
+                                                new_snapshot.iterator(prefix=prefix)):
+        if old_value is not None:
+            old_value = old_value if same_key else old_deobfuscator.deobfuscate(old_value)
+        if new_value is not None:
+            new_value = new_value if same_key else new_deobfuscator.deobfuscate(new_value)
+
+        if old_value == new_value:
+            continue
+
+        if old_value is not None:
+            utxo = parse_entry(key, old_deobfuscator.deobfuscate(old_value) if same_key else old_value)
+            utxo['delta'] = -1
+            fout.write(ujson.dumps(utxo, sort_keys=True) + "\n")
+            spent += 1
+
+        if new_value is not None:
+            utxo = parse_entry(key, new_deobfuscator.deobfuscate(new_value) if same_key else new_value)
+            utxo['delta'] = 1
+            fout.write(ujson.dumps(utxo, sort_keys=True) + "\n")
+            created += 1
 
     fout.close()
-    db.close()
+
+    manifest = {"old_best_block": get_best_block(old_snapshot, old_deobfuscator),
+                "new_best_block": get_best_block(new_snapshot, new_deobfuscator),
+                "old_chainstate": old_fin_name, "new_chainstate": new_fin_name, "created": created, "spent": spent}
+
+    old_snapshot.close()
+    new_snapshot.close()
+    old_db.close()
+    new_db.close()
+
+    with open(CFG.data_path + get_manifest_name(fout_name), 'w') as f:
+        f.write(ujson.dumps(manifest))
+
+    return manifest
 
 
 def get_chainstate_lastblock(fin_name=CFG.chainstate_path):
@@ -377,116 +1046,332 @@ def get_chainstate_lastblock(fin_name=CFG.chainstate_path):
     :rtype: str
     """
 
-    # Open the chainstate
-    db = plyvel.DB(fin_name, compression=None)
+    # Open the chainstate
+    db = plyvel.DB(fin_name, compression=None)
+
+    # Load obfuscation key (if it exists) and get the de-obfuscated block hash
+    best_block = get_best_block(db, Deobfuscator(get_obfuscation_key(db)))
+
+    db.close()
+
+    return best_block
+
+
+class DustAccumulator(object):
+    """ Aggregates all the dust / non-profitable (np) utxos from parsed utxo samples (from utxo_dump function), so it can
+    be fed while a parsed utxo file is being read for other purposes as well (see data_processing.AnalysisEngine).
+
+    Samples are buffered and added in chunks to numpy arrays of fee rate bins (the number of utxos, value and data
+    length of every metric for each fee rate), either one at a time (add) or by columns (add_columns). Accumulators
+    can be merged, so different parts of a file can be aggregated separately (e.g. in different processes).
+
+    Samples from a delta file (from utxo_dump_delta) are weighted by their delta field (1 for created utxos, -1 for spent
+    ones).
+    """
+
+    # Metrics (prefix of the dust file keys and sample field) and aggregated data (suffix of the dust file keys).
+    METRICS = [("dust", "dust"), ("np", "non_profitable"), ("npest", "non_profitable_est")]
+    FIELDS = ["utxos", "value", "data_len"]
+
+    def __init__(self, fltr=None, chunk_size=100000):
+        self.fltr = fltr
+        self.chunk_size = chunk_size
+        self.n_bins = (MAX_FEE_PER_BYTE - MIN_FEE_PER_BYTE) / FEE_STEP + 1
+
+        # Bins are indexed by metric, aggregated data and fee rate.
+        self.bins = np.zeros((len(self.METRICS), len(self.FIELDS), self.n_bins), dtype=np.int64)
+
+        self.total_utxo = 0
+        self.total_value = 0
+        self.total_data_len = 0
+
+        self.pending = []
+
+    def add(self, data):
+        """
+        Adds a parsed utxo to the aggregation.
+
+        :param data: Parsed utxo.
+        :type data: dict
+        :return: None
+        :rtype: None
+        """
+
+        # Apply filter if it is set, otherwise all samples are analyzed (samples that do not match the filter are
+        # only counted in the totals, so their rates are set to null). Samples from a delta file are added (created
+        # utxos) or subtracted (spent utxos) depending on their delta.
+        if not self.fltr or self.fltr(data):
+            self.pending.append((data["dust"], data["non_profitable"], data["non_profitable_est"], data["amount"],
+                                 data["utxo_data_len"], data.get("delta", 1)))
+        else:
+            self.pending.append((None, None, None, data["amount"], data["utxo_data_len"], data.get("delta", 1)))
+
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Adds the buffered samples to the bins.
+
+        :return: None
+        :rtype: None
+        """
+
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, []
+        columns = zip(*pending)
+
+        # Null rates (no estimation data or filtered samples) are converted to NaN, so they are out of the range.
+        rates = [np.array(column, dtype=np.float64) for column in columns[:3]]
+        amounts, data_lens, weights = [np.array(column, dtype=np.int64) for column in columns[3:]]
+
+        self.add_columns(rates, amounts, data_lens, weights)
+
+    def add_columns(self, rates, amounts, data_lens, weights=None):
+        """
+        Adds a chunk of parsed utxos, given as columns, to the aggregation.
+
+        :param rates: Dust, non-profitable and estimated non-profitable rates of the utxos (rates out of the fee rate
+        range, such as NaN or NULL values, are only counted in the totals).
+        :type rates: list of numpy.ndarray
+        :param amounts: Amount of the utxos.
+        :type amounts: numpy.ndarray
+        :param data_lens: Data length of the utxos.
+        :type data_lens: numpy.ndarray
+        :param weights: Weight of each utxo (1 for created utxos, -1 for spent ones). All ones by default.
+        :type weights: numpy.ndarray
+        :return: None
+        :rtype: None
+        """
+
+        if weights is None:
+            weights = np.ones(len(amounts), dtype=np.int64)
+
+        # Weighted amounts are bounded by the coin supply, so their partial sums (as floats) are exact.
+        weighted = [weights, weights * amounts, weights * data_lens]
+
+        for m, metric_rates in enumerate(rates):
+            metric_rates = np.asarray(metric_rates)
+
+            # If the UTXO is dust for the checked range, we increment the dust count, dust value and dust length for
+            # the given threshold.
+            with np.errstate(invalid='ignore'):
+                in_range = (metric_rates >= MIN_FEE_PER_BYTE) & (metric_rates <= MAX_FEE_PER_BYTE)
+            idx = ((metric_rates[in_range] - MIN_FEE_PER_BYTE) // FEE_STEP).astype(np.int64)
+
+            for f, w in enumerate(weighted):
+                self.bins[m, f] += np.rint(np.bincount(idx, weights=w[in_range], minlength=self.n_bins)) \
+                    .astype(np.int64)
+
+        # And we increase the total counters for each read utxo.
+        self.total_utxo += int(np.sum(weighted[0]))
+        self.total_value += int(np.sum(weighted[1]))
+        self.total_data_len += int(np.sum(weighted[2]))
+
+    def merge(self, other):
+        """
+        Merges the data aggregated by another accumulator into this one.
+
+        :param other: Accumulator to be merged.
+        :type other: DustAccumulator
+        :return: This accumulator.
+        :rtype: DustAccumulator
+        """
+
+        self.flush()
+        other.flush()
+
+        self.bins += other.bins
+        self.total_utxo += other.total_utxo
+        self.total_value += other.total_value
+        self.total_data_len += other.total_data_len
+
+        return self
+
+    def get_data(self, prev_data=None):
+        """
+        Gets the aggregated data, in the dust file format.
+
+        :param prev_data: Previous dust data (as loaded from a dust file) to be updated with the aggregated data. None
+        by default.
+        :type prev_data: dict
+        :return: A dict with the aggregated data
+        :rtype: dict
+        """
+
+        self.flush()
+
+        # Since if an output is dust/non-profitable for a given threshold, it will also be for every other step onwards,
+        # we accumulate the result of a given step with the accumulated value from the previous steps (for the whole
+        # fee rate range).
+        accumulated = np.cumsum(self.bins, axis=2).tolist()
+        fee_rates = range(MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE + FEE_STEP, FEE_STEP)
+
+        data = dict()
+        for m, (metric, _) in enumerate(self.METRICS):
+            for f, field in enumerate(self.FIELDS):
+                data[metric + "_" + field] = dict(zip(fee_rates, accumulated[m][f]))
+
+        # Finally we create the output with the accumulated data.
+        data = {"dust_utxos": data["dust_utxos"], "dust_value": data["dust_value"],
+                "dust_data_len": data["dust_data_len"],
+                "np_utxos": data["np_utxos"], "np_value": data["np_value"], "np_data_len": data["np_data_len"],
+                "npest_utxos": data["npest_utxos"], "npest_value": data["npest_value"],
+                "npest_data_len": data["npest_data_len"],
+                "total_utxos": self.total_utxo, "total_value": self.total_value,
+                "total_data_len": self.total_data_len}
+
+        # If we are updating a previous dust file, the (already accumulated) previous data is added. Since the
+        # accumulation is linear, the result is the same as aggregating the updated utxo set from scratch.
+        if prev_data:
+            for k, v in prev_data.items():
+                if isinstance(v, dict):
+                    for fee_per_byte, prev_value in v.items():
+                        data[k][int(fee_per_byte)] += prev_value
+                else:
+                    data[k] += v
+
+        return data
+
+    def store(self, fout_name="dust.json", prev_fin_name=None):
+        """
+        Stores the aggregated data in a dust file.
+
+        :param fout_name: Output file name, where data will be stored.
+        :type fout_name: str
+        :param prev_fin_name: Previous dust file name, to be updated with the aggregated data. None by default.
+        :type prev_fin_name: str
+        :return: A dict with the stored data
+        :rtype: dict
+        """
+
+        prev_data = None
+        if prev_fin_name:
+            with open(CFG.data_path + prev_fin_name) as f:
+                prev_data = ujson.load(f)
+
+        data = self.get_data(prev_data)
+
+        # Store dust calculation in a file.
+        out = open(CFG.data_path + fout_name, 'w')
+        out.write(ujson.dumps(data))
+        out.close()
+
+        return data
+
+
+def _aggregate_dust_range(args):
+    """
+    Aggregates the dust of a range of rows of a columnar parsed utxo file. Runs inside the worker processes of
+    aggregate_dust_np.
+
+    :param args: Columnar file name, first row and row after the last one.
+    :type args: tuple
+    :return: The accumulator with the aggregated data.
+    :rtype: DustAccumulator
+    """
 
-    # Load obfuscation key (if it exists)
-    o_key = db.get((unhexlify("0e00") + "obfuscate_key"))
+    fin_name, start, stop = args
 
-    # Get the key itself (the leading byte indicates only its size)
-    if o_key is not None:
-        o_key = hexlify(o_key)[2:]
+    reader = ColumnReader(fin_name)
+    dust = DustAccumulator()
 
-    # Get the obfuscated block hash
-    o_height = db.get(b'B')
+    for chunk_start in range(start, stop, dust.chunk_size):
+        chunk_stop = min(chunk_start + dust.chunk_size, stop)
 
-    # Deobfuscate the height
-    height = deobfuscate_value(o_key, hexlify(o_height))
+        # Null rates are stored as NULL (negative), so they are out of the fee rate range.
+        rates = [reader.get_raw(field)[chunk_start:chunk_stop] for _, field in DustAccumulator.METRICS]
+        amounts = reader.get_column("amount", chunk_start, chunk_stop).astype(np.int64)
+        data_lens = reader.get_column("utxo_data_len", chunk_start, chunk_stop).astype(np.int64)
 
-    return change_endianness(height)
+        dust.add_columns(rates, amounts, data_lens)
 
+    return dust
 
-def aggregate_dust_np(fin_name, fout_name="dust.json", fltr=None):
+
+def aggregate_dust_np(fin_name, fout_name="dust.json", fltr=None, prev_fin_name=None, n_workers=1):
     """
     Aggregates all the dust / non-profitable (np) utxos of a given parsed utxo file (from utxo_dump function).
 
+    The function can also be used to update a previous dust file from a parsed delta file (from utxo_dump_delta). In
+    that case, samples are weighted by their delta field (1 for created utxos, -1 for spent ones) and the result is
+    added to the data in prev_fin_name. Notice that the previous dust file should have been computed with the same
+    filter.
+
+    Several filters can be applied in a single read of the file by passing a dict of named filters (None for no
+    filter), e.g. {"all": None, "p2pkh": lambda x: x["out_type"] == 0}. In that case, one dust table is aggregated per
+    filter and stored either in separate files (if fout_name is a dict with the same names) or in a single document
+    keyed by filter name (if fout_name is a str). prev_fin_name follows the same layout as fout_name.
+
+    If the file is columnar (or it has an up to date columnar sidecar) and no filter is set, data is aggregated by
+    columns, splitting the file in n_workers ranges that are aggregated in parallel.
+
     :param fin_name: Input file name, from where data wil be loaded.
     :type fin_name: str
-    :param fout_name: Output file name, where data will be stored.
-    :type fout_name: str
-    :param fltr: Filter to be applied to the samples. None by default.
-    :type fltr: function
-    :return: A dict with the aggregated data
+    :param fout_name: Output file name, where data will be stored (or a dict of file names, one per filter).
+    :type fout_name: str or dict
+    :param fltr: Filter to be applied to the samples (or a dict of named filters). None by default.
+    :type fltr: function or dict
+    :param prev_fin_name: Previous dust file name, to be updated with the data from fin_name. None by default.
+    :type prev_fin_name: str or dict
+    :param n_workers: Number of worker processes used to aggregate columnar files (default: 1, no parallelism).
+    :type n_workers: int
+    :return: A dict with the aggregated data (or a dict with the aggregated data of every filter).
     :rtype: dict
     """
 
-    # Dust calculation
-    # Input file
-    fin = open(CFG.data_path + fin_name, 'r')
-
-    dust = {fee_per_byte: 0 for fee_per_byte in range(MIN_FEE_PER_BYTE, MAX_FEE_PER_BYTE+FEE_STEP, FEE_STEP)}
-    value_dust = deepcopy(dust)
-    data_len_dust = deepcopy(dust)
-
-    np = deepcopy(dust)
-    value_np = deepcopy(dust)
-    data_len_np = deepcopy(dust)
-
-    npest = deepcopy(dust)
-    value_npest = deepcopy(dust)
-    data_len_npest = deepcopy(dust)
-
-    total_utxo = 0
-    total_value = 0
-    total_data_len = 0
-
-    for line in fin:
-        data = ujson.loads(line[:-1])
-
-        # Apply filter if it is set, otherwise all samples are analyzed (sample is only skipped if there is a filter
-        # and the data does not match the condition)
-        if not fltr or (fltr and fltr(data)):
-            # If the UTXO is dust for the checked range, we increment the dust count, dust value and dust length for the
-            # given threshold.
-            if MIN_FEE_PER_BYTE <= data['dust'] <= MAX_FEE_PER_BYTE:
-                rate = data['dust']
-                dust[rate] += 1
-                value_dust[rate] += data["amount"]
-                data_len_dust[rate] += data["utxo_data_len"]
-
-            # Same with non-profitable outputs.
-            if MIN_FEE_PER_BYTE <= data['non_profitable'] <= MAX_FEE_PER_BYTE:
-                rate = data['non_profitable']
-                np[rate] += 1
-                value_np[rate] += data["amount"]
-                data_len_np[rate] += data["utxo_data_len"]
-
-            # Same with estimated non-profitable outputs.
-            if MIN_FEE_PER_BYTE <= data['non_profitable_est'] <= MAX_FEE_PER_BYTE:
-                rate = data['non_profitable_est']
-                npest[rate] += 1
-                value_npest[rate] += data["amount"]
-                data_len_npest[rate] += data["utxo_data_len"]
+    named = isinstance(fltr, dict)
+    filters = fltr if named else {None: fltr}
+
+    columnar_name = find_columnar(fin_name) if not any(filters.values()) else None
+
+    if columnar_name:
+        rows = len(ColumnReader(columnar_name))
+        step = max(rows / max(n_workers, 1) + 1, 1)
+        ranges = [(columnar_name, start, min(start + step, rows)) for start in range(0, rows, step)]
+
+        if n_workers > 1:
+            pool = Pool(n_workers)
+            partials = pool.map(_aggregate_dust_range, ranges)
+            pool.close()
+            pool.join()
+        else:
+            partials = [_aggregate_dust_range(r) for r in ranges]
+
+        dust = DustAccumulator()
+        for partial in partials:
+            dust.merge(partial)
+
+        # Unfiltered tables are all the same.
+        dusts = {name: dust for name in filters}
+
+    else:
+        dusts = {name: DustAccumulator(fltr=f) for name, f in filters.items()}
+        adds = [dust.add for dust in dusts.values()]
+
+        # Input file (either json or columnar), read once for all the filters.
+        for data in iter_dump(fin_name):
+            for add in adds:
+                add(data)
+
+    if not named:
+        return dusts[None].store(fout_name, prev_fin_name=prev_fin_name)
+
+    # One file per filter
+    if isinstance(fout_name, dict):
+        return {name: dust.store(fout_name[name], prev_fin_name=prev_fin_name[name] if prev_fin_name else None)
+                for name, dust in dusts.items()}
+
+    # A single document keyed by filter name
+    prev_data = dict()
+    if prev_fin_name:
+        with open(CFG.data_path + prev_fin_name) as f:
+            prev_data = ujson.load(f)
+
+    data = {name: dust.get_data(prev_data.get(name)) for name, dust in dusts.items()}
 
-        # And we increase the total counters for each read utxo.
-        total_utxo = total_utxo + 1
-        total_value += data["amount"]
-        total_data_len += data["utxo_data_len"]
-
-    fin.close()
-
-    # Moreover, since if an output is dust/non-profitable for a given threshold, it will also be for every other step
-    # onwards, we accumulate the result of a given step with the accumulated value from the previous step.
-    for fee_per_byte in range(MIN_FEE_PER_BYTE+FEE_STEP, MAX_FEE_PER_BYTE, FEE_STEP):
-        dust[fee_per_byte] += dust[fee_per_byte - FEE_STEP]
-        value_dust[fee_per_byte] += value_dust[fee_per_byte - FEE_STEP]
-        data_len_dust[fee_per_byte] += data_len_dust[fee_per_byte - FEE_STEP]
-
-        np[fee_per_byte] += np[fee_per_byte - FEE_STEP]
-        value_np[fee_per_byte] += value_np[fee_per_byte - FEE_STEP]
-        data_len_np[fee_per_byte] += data_len_np[fee_per_byte - FEE_STEP]
-
-        npest[fee_per_byte] += npest[fee_per_byte - FEE_STEP]
-        value_npest[fee_per_byte] += value_npest[fee_per_byte - FEE_STEP]
-        data_len_npest[fee_per_byte] += data_len_npest[fee_per_byte - FEE_STEP]
-
-    # Finally we create the output with the accumulated data and store it.
-    data = {"dust_utxos": dust, "dust_value": value_dust, "dust_data_len": data_len_dust,
-            "np_utxos": np, "np_value": value_np, "np_data_len": data_len_np,
-            "npest_utxos": npest, "npest_value": value_npest, "npest_data_len": data_len_npest,
-            "total_utxos": total_utxo, "total_value": total_value, "total_data_len": total_data_len}
-
-    # Store dust calculation in a file.
     out = open(CFG.data_path + fout_name, 'w')
     out.write(ujson.dumps(data))
     out.close()
@@ -494,6 +1379,38 @@ def aggregate_dust_np(fin_name, fout_name="dust.json", fltr=None):
     return data
 
 
+def classify_scripts(out_types, scripts):
+    """
+    Classifies the scripts that are not compressed in the chainstate (out_type bigger than 5) into the classes used to
+    compute input sizes (see get_min_input_size_batch and get_est_input_size_batch).
+
+    :param out_types: Output types.
+    :type out_types: numpy.ndarray
+    :param scripts: Output scripts (only the ones of non compressed types are checked).
+    :type scripts: list of str
+    :return: The class of every script (SCRIPT_OTHER, SCRIPT_MULTISIG, SCRIPT_P2WPKH or SCRIPT_P2WSH, compressed types are
+    set to SCRIPT_OTHER) and the number of required signatures of multisig scripts (0 otherwise).
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+
+    classes = np.full(len(out_types), SCRIPT_OTHER, dtype=np.int8)
+    req_sigs = np.zeros(len(out_types), dtype=np.int64)
+
+    for i in np.flatnonzero(out_types >= NSPECIALSCRIPTS):
+        script = scripts[i]
+        if check_multisig(script):
+            classes[i] = SCRIPT_MULTISIG
+            req_sigs[i] = int(script[:2], 16) - 80  # OP_1 is hex 81
+        else:
+            segwit = check_native_segwit(script)
+            if segwit[0] and segwit[1] == "P2WPKH":
+                classes[i] = SCRIPT_P2WPKH
+            elif segwit[0] and segwit[1] == "P2WSH":
+                classes[i] = SCRIPT_P2WSH
+
+    return classes, req_sigs
+
+
 def check_multisig(script, std=True):
     """
     Checks whether a given script is a multisig one. By default, only standard multisig script are accepted.
@@ -528,17 +1445,153 @@ def check_multisig_type(script):
     :return: "multisig-m-n" or False
     """
 
-    if len(OutputScript.deserialize(script).split()) > 2:
-        m = OutputScript.deserialize(script).split()[0]
-        n = OutputScript.deserialize(script).split()[-2]
-        op_multisig = OutputScript.deserialize(script).split()[-1]
+    script_class, m, n = classify_script(unhexlify(script))
 
-        if op_multisig == "OP_CHECKMULTISIG" and script[2:4] in ["21", "41"]:
-            return "multisig-" + str(m) + "-" + str(n)
+    if script_class == SCRIPT_MULTISIG:
+        return "multisig-" + str(m) + "-" + str(n)
 
     return False
 
 
+def parse_script_ops(script):
+    """
+    Splits a raw script into its operations, without decoding them.
+
+    :param script: The script to be parsed.
+    :type script: str
+    :return: List of (opcode, start, end) tuples, where start and end delimit the data pushed by the operation (start ==
+    end for operations that push no data), or None if the script is malformed (truncated push).
+    :rtype: list of tuple
+    """
+
+    data = bytearray(script)
+    ops = []
+    i = 0
+
+    while i < len(data):
+        opcode = data[i]
+        i += 1
+
+        if opcode > 0x4e:
+            ops.append((opcode, i, i))
+            continue
+
+        # Push operations (OP_0, direct pushes and OP_PUSHDATA1/2/4).
+        if opcode < 0x4c:
+            size = opcode
+        else:
+            n_bytes = {0x4c: 1, 0x4d: 2, 0x4e: 4}[opcode]
+            if i + n_bytes > len(data):
+                return None
+            size = sum(data[i + k] << (8 * k) for k in range(n_bytes))
+            i += n_bytes
+
+        if i + size > len(data):
+            return None
+
+        ops.append((opcode, i, i + size))
+        i += size
+
+    return ops
+
+
+def get_script_token(script, op):
+    """
+    Gets the human readable representation of a script operation, as found in OutputScript.deserialize (numbers for
+    small integers, <hex> for pushed data and opcode names otherwise).
+
+    :param script: The raw script the operation belongs to.
+    :type script: str
+    :param op: Operation (from parse_script_ops).
+    :type op: tuple
+    :return: The token (int for small integers, str otherwise).
+    :rtype: int or str
+    """
+
+    opcode, start, end = op
+
+    if opcode == 0:
+        return 0
+    elif opcode <= 0x4e:
+        return "<" + hexlify(script[start:end]) + ">"
+    elif 0x51 <= opcode <= 0x60:
+        return opcode - 0x50
+    else:
+        return OPCODE_NAMES.get(opcode, "CScriptOp(0x%x)" % opcode)
+
+
+class ScriptClassifier(object):
+    """ Classifies raw output scripts into SCRIPT_MULTISIG (along with their m and n values), SCRIPT_P2WPKH, SCRIPT_P2WSH,
+    SCRIPT_OPRETURN or SCRIPT_OTHER. Scripts are parsed once at the byte level, following the same rules as the
+    deserialized scripts used to (a multisig script ends with OP_CHECKMULTISIG and starts with m and a 33 or 65-byte
+    public key push).
+
+    Non-standard scripts are mostly bare multisig ones built from a few templates, so results are kept in a LRU cache
+    of cache_size entries keyed by the script bytes.
+    """
+
+    def __init__(self, cache_size=2 ** 16):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def classify(self, script):
+        """ Classifies a raw output script.
+
+        :param script: The script to be classified.
+        :type script: str
+        :return: The class of the script and, for multisig scripts, its m and n values (None otherwise). m and n are
+        ints, unless the script has something else than a small integer in their place (then, their tokens are given).
+        :rtype: int, int, int
+        """
+
+        if script in self.cache:
+            result = self.cache.pop(script)
+        else:
+            result = self._classify(script)
+
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+
+        self.cache[script] = result
+
+        return result
+
+    @staticmethod
+    def _classify(script):
+        # The second byte has to push a public key (33 or 65 bytes) and the last one has to be OP_CHECKMULTISIG.
+        if len(script) > 2 and script[1] in b"\x21\x41" and script[-1] == b"\xae":
+            ops = parse_script_ops(script)
+            if ops is not None and len(ops) > 2 and ops[-1][0] == 0xae:
+                return SCRIPT_MULTISIG, get_script_token(script, ops[0]), get_script_token(script, ops[-2])
+
+        if len(script) == 22 and script[:2] == b"\x00\x14":
+            return SCRIPT_P2WPKH, None, None
+
+        if len(script) == 34 and script[:2] == b"\x00\x20":
+            return SCRIPT_P2WSH, None, None
+
+        if script[:1] == b"\x6a":
+            return SCRIPT_OPRETURN, None, None
+
+        return SCRIPT_OTHER, None, None
+
+
+SCRIPT_CLASSIFIER = ScriptClassifier()
+
+
+def classify_script(script):
+    """
+    Classifies a raw output script (see ScriptClassifier), sharing a single cache across calls.
+
+    :param script: The script to be classified.
+    :type script: str
+    :return: The class of the script and, for multisig scripts, its m and n values.
+    :rtype: int, int, int
+    """
+
+    return SCRIPT_CLASSIFIER.classify(script)
+
+
 def check_opreturn(script):
     """
     Checks whether a given script is an OP_RETURN one.
@@ -681,14 +1734,16 @@ def load_estimation_data(coin):
     Returns estimation data for public key sizes, and P2SH, non-std and P2WSH input/witness script sizes. If no
     estimation data is available, returns a tuple of None values.
 
+    Public key sizes are given as a height-indexed array (see get_p2pkh_est_table and get_p2pkh_est).
+
     :param coin: string (bitcoin, bitcoincash or litecoin)
-    :return: 5-element tuple: a dictionary 3 floats and a int, with estimation data by height (dict), average estimation
-    data (floats) and the maximum height at which we have estimation data (int).
+    :return: 5-element tuple: an array, 3 floats and a int, with estimation data by height (numpy.ndarray), average
+    estimation data (floats) and the maximum height at which we have estimation data (int).
     """
 
     try:
         with open(CFG.estimated_data_dir + coin + "/p2pkh_pubkey_avg_size_height_output.json") as f:
-            p2pkh_pksize = ujson.load(f)
+            p2pkh_pksize = get_p2pkh_est_table(ujson.load(f))
             max_height = len(p2pkh_pksize)
 
         with open(CFG.estimated_data_dir + coin + "/p2sh.json") as f:
@@ -719,8 +1774,8 @@ def get_est_input_size(out, height, p2pkh_pksize, p2sh_scriptsize, nonstd_script
     :type out: dict
     :param height: Block height where the utxo was created. Used to set P2PKH min_size.
     :type height: int
-    :param p2pkh_pksize: Estimation data for P2PKH outputs.
-    :type p2pkh_pksize: dict
+    :param p2pkh_pksize: Estimation data for P2PKH outputs (from load_estimation_data).
+    :type p2pkh_pksize: numpy.ndarray
     :param p2sh_scriptsize: Estimation data for P2SH outputs.
     :type p2sh_scriptsize: float
     :param nonstd_scriptsize: Estimation data for non-standard outputs.
@@ -761,10 +1816,7 @@ def get_est_input_size(out, height, p2pkh_pksize, p2sh_scriptsize, nonstd_script
 
     if out_type is 0:
         # P2PKH
-        if height >= max_height:
-            p2pkh_est_data = p2pkh_pksize[str(max_height - 1)]
-        else:
-            p2pkh_est_data = p2pkh_pksize[str(height)]
+        p2pkh_est_data = get_p2pkh_est(p2pkh_pksize, height)
         scriptSig = 74 + p2pkh_est_data  # PUSH sig (1 byte) + sig (72 bytes) + PUSH pk (1 byte) + PK est
         scriptSig_len = 1
     elif out_type is 1:
@@ -801,12 +1853,195 @@ def get_est_input_size(out, height, p2pkh_pksize, p2sh_scriptsize, nonstd_script
     return fixed_size + var_size
 
 
-def get_utxo(tx_id, index, fin_name=CFG.chainstate_path):
+def get_min_input_size_batch(out_types, heights, classes, req_sigs, count_p2sh=False, coin="bitcoin",
+                             compressed_pk_height=0):
+    """
+    Vectorized version of get_min_input_size, computing the minimum input size of a batch of outputs at once.
+
+    :param out_types: Output types.
+    :type out_types: numpy.ndarray
+    :param heights: Block heights where the utxos were created.
+    :type heights: numpy.ndarray
+    :param classes: Script classes (from classify_scripts).
+    :type classes: numpy.ndarray
+    :param req_sigs: Required signatures of multisig scripts (from classify_scripts).
+    :type req_sigs: numpy.ndarray
+    :param count_p2sh: Whether P2SH should be taken into account.
+    :type count_p2sh: bool
+    :param: Coin to be used in the analysis (default: bitcoin).
+    :type coin: str
+    :param compressed_pk_height: Height at which compressed public keys where first used (see get_min_input_size).
+    :type compressed_pk_height: int
+    :return: The minimum input size of every output.
+    :rtype: numpy.ndarray
+    """
+
+    # Fixed size: prev_tx_id (32 bytes) + prev_out_index (4 bytes) + nSequence (4 bytes)
+    fixed_size = 32 + 4 + 4
+
+    if coin in ["bitcoin", "bitcoincash"]:
+        height_limit = 173480
+    elif coin == "litecoin":
+        height_limit = 110000
+    else:
+        height_limit = compressed_pk_height
+        if height_limit == 0:
+            print "Warning: You are calculating the minimum input size for a coin other than Bitcoin, " \
+                  "Bitcoin Cash and Litecoin. By default the height ar which compressed public keys where first " \
+                  "used is not set, so 0 is used. Consider changing the compressed_pk_height "
+
+    # Variable size (scriptSig_len + scriptSig) of the compressed types, indexed by out_type.
+    var_sizes = np.array([1 + 106,  # P2PKH (compressed keys)
+                          1 + 1 if count_p2sh else -fixed_size,  # P2SH
+                          1 + 72, 1 + 72, 1 + 72, 1 + 72],  # P2PK
+                         dtype=np.int64)
+
+    var_size = var_sizes[np.minimum(out_types, NSPECIALSCRIPTS - 1)]
+
+    # P2PKH with uncompressed keys
+    var_size[(out_types == 0) & (heights < height_limit)] = 1 + 138
+
+    # Non compressed types
+    other = out_types >= NSPECIALSCRIPTS
+    multisig_sig = 1 + (req_sigs * 72)
+    var_size[other] = 1
+    var_size[other & (classes == SCRIPT_P2WPKH)] = 1 + 27
+    multisig = other & (classes == SCRIPT_MULTISIG)
+    var_size[multisig] = ((multisig_sig + 255) // 256 + multisig_sig)[multisig]
+
+    return fixed_size + var_size
+
+
+def get_p2pkh_est_table(p2pkh_pksize):
+    """
+    Builds a height-indexed table from the P2PKH estimation data (p2pkh_pubkey_avg_size_height_output.json), so public
+    key sizes are looked up by position instead of by (string) height. Sizes are stored as float32 (which takes around
+    a tenth of the memory of the dictionary) as long as every size can be represented exactly, and as float64 otherwise,
+    so estimations are never altered.
+
+    :param p2pkh_pksize: Estimation data for P2PKH outputs, with the public key size of every height from 0 onwards.
+    :type p2pkh_pksize: dict
+    :return: The estimated public key size for every height.
+    :rtype: numpy.ndarray
+    """
+
+    table = np.full(len(p2pkh_pksize), np.nan)
+
+    for height, size in p2pkh_pksize.iteritems():
+        if not 0 <= int(height) < len(table):
+            raise Exception("Estimation data for P2PKH outputs must cover every height from 0 onwards (found height {} "
+                            "in data for {} heights).".format(height, len(table)))
+        table[int(height)] = size
+
+    missing = np.flatnonzero(np.isnan(table))
+    if len(missing):
+        raise Exception("There is no estimation data for P2PKH outputs at height {}.".format(missing[0]))
+
+    compact = table.astype(np.float32)
+    if np.array_equal(compact.astype(np.float64), table):
+        return compact
+
+    return table
+
+
+def get_p2pkh_est(p2pkh_pksize, heights):
+    """
+    Gets the estimated public key size of the P2PKH outputs created at given heights. Heights past the last one with
+    estimation data get the last available estimation.
+
+    :param p2pkh_pksize: Estimation data for P2PKH outputs (from load_estimation_data).
+    :type p2pkh_pksize: numpy.ndarray
+    :param heights: Block height (or heights) where the outputs were created.
+    :type heights: int or numpy.ndarray
+    :return: The estimated public key size (or sizes).
+    :rtype: float or numpy.ndarray
+    """
+
+    if np.isscalar(heights):
+        return float(p2pkh_pksize[min(heights, len(p2pkh_pksize) - 1)])
+
+    return p2pkh_pksize[np.minimum(heights, len(p2pkh_pksize) - 1)].astype(np.float64)
+
+
+def get_est_input_size_batch(out_types, heights, classes, req_sigs, p2pkh_pksize, p2sh_scriptsize, nonstd_scriptsize,
+                             p2wsh_scriptsize):
+    """
+    Vectorized version of get_est_input_size, computing the estimated input size of a batch of outputs at once. The
+    result is exactly the same as the one of the scalar version.
+
+    If no estimation data is available, returns NaN.
+
+    :param out_types: Output types.
+    :type out_types: numpy.ndarray
+    :param heights: Block heights where the utxos were created.
+    :type heights: numpy.ndarray
+    :param classes: Script classes (from classify_scripts).
+    :type classes: numpy.ndarray
+    :param req_sigs: Required signatures of multisig scripts (from classify_scripts).
+    :type req_sigs: numpy.ndarray
+    :param p2pkh_pksize: Estimation data for P2PKH outputs (from load_estimation_data).
+    :type p2pkh_pksize: numpy.ndarray
+    :param p2sh_scriptsize: Estimation data for P2SH outputs.
+    :type p2sh_scriptsize: float
+    :param nonstd_scriptsize: Estimation data for non-standard outputs.
+    :type nonstd_scriptsize: float
+    :param p2wsh_scriptsize: Estimation data fot P2WSH outputs.
+    :type p2wsh_scriptsize: float
+    :return: The estimated input size of every output.
+    :rtype: numpy.ndarray
+    """
+
+    if p2pkh_pksize is None:
+        # If no estimation data is available, return Nan.
+        return np.full(len(out_types), float('nan'))
+
+    # Fixed size: prev_tx_id (32 bytes) + prev_out_index (4 bytes) + nSequence (4 bytes)
+    fixed_size = 32 + 4 + 4
+
+    # If we don't have updated estimation data, a warning will be displayed and the last estimation point will be used
+    # for the rest of values.
+    max_height = len(p2pkh_pksize)
+    outdated = np.count_nonzero(heights >= max_height)
+    if outdated:
+        print "Warning: There is no estimation data for {} utxos. The last available estimation will be used." \
+            .format(outdated)
+
+    # Sizes are added in the same order than in the scalar version, so floating point results are bit-identical.
+    p2sh_size = fixed_size + (int(ceil(p2sh_scriptsize / float(256))) + p2sh_scriptsize)
+    p2wsh_sig = ceil(p2wsh_scriptsize / 4.0)
+    p2wsh_size = fixed_size + (int(ceil(p2wsh_sig / float(256))) + p2wsh_sig)
+    nonstd_size = fixed_size + (int(ceil(nonstd_scriptsize / float(256))) + nonstd_scriptsize)
+
+    # Sizes of the compressed types (other than P2PKH), indexed by out_type.
+    sizes = np.array([0, p2sh_size, fixed_size + 1 + 73, fixed_size + 1 + 73, fixed_size + 1 + 73,
+                      fixed_size + 1 + 73], dtype=np.float64)
+
+    size = sizes[np.minimum(out_types, NSPECIALSCRIPTS - 1)]
+
+    # P2PKH
+    p2pkh = out_types == 0
+    p2pkh_est_data = get_p2pkh_est(p2pkh_pksize, heights[p2pkh])
+    size[p2pkh] = fixed_size + (1 + (74 + p2pkh_est_data))
+
+    # Non compressed types
+    other = out_types >= NSPECIALSCRIPTS
+    multisig_sig = 1 + (req_sigs * 73)
+    size[other] = nonstd_size
+    size[other & (classes == SCRIPT_P2WPKH)] = fixed_size + 1 + 27
+    size[other & (classes == SCRIPT_P2WSH)] = p2wsh_size
+    multisig = other & (classes == SCRIPT_MULTISIG)
+    size[multisig] = (fixed_size + ((multisig_sig + 255) // 256 + multisig_sig))[multisig]
+
+    return size
+
+
+def get_utxo(tx_id, index=None, fin_name=CFG.chainstate_path):
     """
-    Gets a UTXO from the chainstate identified by a given transaction id and index.
+    Gets a UTXO from the chainstate identified by a given transaction id and index (or by a packed outpoint).
     If the requested UTXO does not exist, return None.
 
-    :param tx_id: Transaction ID that identifies the UTXO you are looking for.
+    :param tx_id: Transaction ID that identifies the UTXO you are looking for (hex or raw), or a packed outpoint (see
+    pack_outpoint) if no index is given.
     :type tx_id: str
     :param index: Index that identifies the specific output.
     :type index: int
@@ -816,28 +2051,12 @@ def get_utxo(tx_id, index, fin_name=CFG.chainstate_path):
     :rtype: str, str
     """
 
-    prefix = b'C'
-    outpoint = prefix + unhexlify(tx_id + b128_encode(index))
-
-    # Open the LevelDB
-    db = plyvel.DB(fin_name, compression=None)  # Change with path to chainstate
-
-    # Load obfuscation key (if it exists)
-    o_key = db.get((unhexlify("0e00") + "obfuscate_key"))
-
-    # If the key exists, the leading byte indicates the length of the key (8 byte by default). If there is no key,
-    # 8-byte zeros are used (since the key will be XORed with the given values).
-    if o_key is not None:
-        o_key = hexlify(o_key)[2:]
-
-    coin = db.get(outpoint)
-
-    if coin is not None and o_key is not None:
-        coin = deobfuscate_value(o_key, hexlify(coin))
-
-    db.close()
+    # Notice that this opens and closes the LevelDB on every call. Use a ChainstateReader when looking up several UTXOs.
+    reader = ChainstateReader(fin_name)
+    outpoint, coin = reader.get_raw(tx_id, index)
+    reader.close()
 
-    return hexlify(outpoint), coin
+    return outpoint, coin
 
 
 def deobfuscate_value(obfuscation_key, value):
@@ -874,6 +2093,308 @@ def deobfuscate_value(obfuscation_key, value):
     return r
 
 
+def get_obfuscation_key(db):
+    """
+    Loads the obfuscation key from an open chainstate LevelDB.
+
+    :param db: Open chainstate LevelDB (or snapshot).
+    :type db: plyvel.DB
+    :return: The obfuscation key, or None if the chainstate is not obfuscated.
+    :rtype: str
+    """
+
+    o_key = db.get((unhexlify("0e00") + "obfuscate_key"))
+
+    # If the key exists, the leading byte indicates the length of the key (8 byte by default).
+    if o_key is not None:
+        o_key = o_key[1:]
+
+    return o_key
+
+
+class Deobfuscator(object):
+    """ De-obfuscates raw values parsed from the chainstate. Values are XORed with the obfuscation key concatenated
+    with itself until the length of the value is reached. Extended keys are built once per value length and cached,
+    and the XOR is performed with numpy, so it can be applied to a whole batch of values at once.
+
+    If no obfuscation key is provided (the chainstate is not obfuscated), values are returned untouched.
+    """
+
+    def __init__(self, obfuscation_key):
+        # An empty key is equivalent to no obfuscation at all.
+        self.key = obfuscation_key or None
+        self.extended_keys = dict()
+
+    def get_extended_key(self, length):
+        """ Gets the obfuscation key extended to a given length.
+
+        :param length: Length of the extended key.
+        :type length: int
+        :return: The extended key.
+        :rtype: str
+        """
+
+        extended_key = self.extended_keys.get(length)
+
+        if extended_key is None:
+            extended_key = (self.key * (length // len(self.key) + 1))[:length]
+            self.extended_keys[length] = extended_key
+
+        return extended_key
+
+    def deobfuscate(self, value):
+        """ De-obfuscates a single value.
+
+        :param value: Obfuscated value.
+        :type value: str
+        :return: The de-obfuscated value.
+        :rtype: str
+        """
+
+        if self.key is None:
+            return value
+
+        return np.bitwise_xor(np.frombuffer(value, dtype=np.uint8),
+                              np.frombuffer(self.get_extended_key(len(value)), dtype=np.uint8)).tostring()
+
+    def deobfuscate_batch(self, values):
+        """ De-obfuscates a list of values at once. Values are concatenated into a single buffer (and so are their
+        extended keys), so a single XOR is performed for the whole batch.
+
+        :param values: Obfuscated values.
+        :type values: list of str
+        :return: The de-obfuscated values, in the same order.
+        :rtype: list of str
+        """
+
+        if self.key is None or not values:
+            return list(values)
+
+        data = np.frombuffer(b''.join(values), dtype=np.uint8)
+        keys = np.frombuffer(b''.join([self.get_extended_key(len(value)) for value in values]), dtype=np.uint8)
+        clear = np.bitwise_xor(data, keys).tostring()
+
+        result = []
+        offset = 0
+        for value in values:
+            result.append(clear[offset:offset + len(value)])
+            offset += len(value)
+
+        return result
+
+
+# Packed outpoints share their layout with the OUTPOINT dtype (32 raw bytes of tx_id + little-endian uint32 index).
+OUTPOINT_STRUCT = Struct("<32sI")
+
+
+def pack_outpoint(tx_id, index):
+    """
+    Packs an outpoint in its binary form (36 bytes, see columnar.OUTPOINT). Packed outpoints take less than half the
+    memory of a (hex tx_id, index) pair and are cheaper to hash, so they are preferred to keep large sets of outpoints.
+
+    :param tx_id: Transaction ID that identifies the UTXO (as stored in the chainstate), either hex or raw.
+    :type tx_id: str
+    :param index: Index that identifies the specific output.
+    :type index: int
+    :return: The packed outpoint.
+    :rtype: str
+    """
+
+    return OUTPOINT_STRUCT.pack(get_raw_tx_id(tx_id), index)
+
+
+def unpack_outpoint(outpoint):
+    """
+    Unpacks a packed outpoint (see pack_outpoint).
+
+    :param outpoint: The packed outpoint.
+    :type outpoint: str
+    :return: The raw transaction id and the index of the outpoint.
+    :rtype: str, int
+    """
+
+    return OUTPOINT_STRUCT.unpack(outpoint)
+
+
+def get_outpoint(key):
+    """
+    Gets the packed outpoint of a given chainstate key (the reverse of get_outpoint_key).
+
+    :param key: The LevelDB key.
+    :type key: str
+    :return: The packed outpoint.
+    :rtype: str
+    """
+
+    index, _ = read_b128(bytearray(key), 33)
+
+    return OUTPOINT_STRUCT.pack(key[1:33], index)
+
+
+def get_outpoint_array(outpoints):
+    """
+    Turns a list of packed outpoints into a numpy array (of columnar.OUTPOINT items), without decoding them one by one.
+
+    :param outpoints: Packed outpoints.
+    :type outpoints: list of str
+    :return: The outpoints array.
+    :rtype: numpy.ndarray
+    """
+
+    return np.frombuffer(b"".join(outpoints), dtype=OUTPOINT)
+
+
+def get_outpoint_key(tx_id, index=None, prefix=b'C'):
+    """
+    Builds the chainstate key of a given outpoint. Since the chainstate is sorted by key, these keys can be used to
+    sort decoded utxos in the same order they are stored in the chainstate (and in the files dumped from it).
+
+    :param tx_id: Transaction ID that identifies the UTXO (as stored in the chainstate), either hex or raw, or a packed
+    outpoint (see pack_outpoint) if no index is given.
+    :type tx_id: str
+    :param index: Index that identifies the specific output.
+    :type index: int
+    :param prefix: Key prefix (b'C' for UTXOs).
+    :type prefix: str
+    :return: The LevelDB key.
+    :rtype: str
+    """
+
+    if index is None:
+        tx_id, index = OUTPOINT_STRUCT.unpack(tx_id)
+
+    return prefix + get_raw_tx_id(tx_id) + unhexlify(b128_encode(index))
+
+
+class ChainstateReader(object):
+    """ Keeps an open handle to the chainstate LevelDB, so several UTXOs can be looked up without opening and closing
+    the database (and reloading the obfuscation key) for every single one of them.
+
+    Decoded UTXOs can be optionally kept in a LRU cache of cache_size entries, which is useful when the same outpoints
+    are requested several times. Notice that cached UTXOs are shared between calls, so they should not be modified.
+
+    The reader can be used as a context manager:
+
+        with ChainstateReader(chainstate) as reader:
+            utxos = reader.get_many([(tx_id_0, index_0), (tx_id_1, index_1)])
+
+    Outpoints can be given either as (tx_id, index) pairs or packed (see pack_outpoint).
+    """
+
+    prefix = b'C'
+
+    def __init__(self, fin_name=CFG.chainstate_path, cache_size=0):
+        self.db = plyvel.DB(fin_name, compression=None)
+        self.deobfuscator = Deobfuscator(get_obfuscation_key(self.db))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        """ Closes the LevelDB handle.
+
+        :return: None
+        :rtype: None
+        """
+
+        self.db.close()
+
+    def get_key(self, tx_id, index=None):
+        """ Builds the LevelDB key of a given outpoint.
+
+        :param tx_id: Transaction ID that identifies the UTXO (as stored in the chainstate), or a packed outpoint.
+        :type tx_id: str
+        :param index: Index that identifies the specific output.
+        :type index: int
+        :return: The LevelDB key.
+        :rtype: str
+        """
+
+        return get_outpoint_key(tx_id, index, self.prefix)
+
+    def get_raw(self, tx_id, index=None):
+        """ Gets a UTXO identified by a given transaction id and index, without decoding it. Same output as get_utxo.
+
+        :param tx_id: Transaction ID that identifies the UTXO (as stored in the chainstate), or a packed outpoint.
+        :type tx_id: str
+        :param index: Index that identifies the specific output.
+        :type index: int
+        :return: A outpoint:coin pair representing the requested UTXO (coin is None if the UTXO does not exist).
+        :rtype: str, str
+        """
+
+        outpoint = self.get_key(tx_id, index)
+        coin = self.db.get(outpoint)
+
+        if coin is not None:
+            coin = hexlify(self.deobfuscator.deobfuscate(coin))
+
+        return hexlify(outpoint), coin
+
+    def get(self, tx_id, index=None):
+        """ Gets a decoded UTXO identified by a given transaction id and index.
+
+        :param tx_id: Transaction ID that identifies the UTXO (as stored in the chainstate), or a packed outpoint.
+        :type tx_id: str
+        :param index: Index that identifies the specific output.
+        :type index: int
+        :return: The decoded UTXO (as in parse_ldb), or None if it does not exist.
+        :rtype: dict
+        """
+
+        return self.get_many([tx_id if index is None else (tx_id, index)])[0]
+
+    def get_many(self, outpoints):
+        """ Gets a list of decoded UTXOs. Keys are looked up in sorted order to take advantage of the LevelDB locality,
+        and found values are de-obfuscated in a single batch.
+
+        :param outpoints: List of (tx_id, index) pairs or packed outpoints.
+        :type outpoints: list
+        :return: The decoded UTXOs (as in parse_ldb), in the same order as the given outpoints. None is returned for
+        every outpoint that does not exist.
+        :rtype: list of dict
+        """
+
+        keys = [self.get_key(*outpoint) if isinstance(outpoint, tuple) else self.get_key(outpoint)
+                for outpoint in outpoints]
+        utxos = dict()
+
+        # Look for cached UTXOs first. Hits are moved to the end of the cache (most recently used).
+        if self.cache_size:
+            for key in keys:
+                if key in self.cache:
+                    utxos[key] = self.cache.pop(key)
+                    self.cache[key] = utxos[key]
+
+        missing = sorted(set(keys).difference(utxos))
+        found = []
+        o_values = []
+        for key in missing:
+            o_value = self.db.get(key)
+            if o_value is not None:
+                found.append(key)
+                o_values.append(o_value)
+            else:
+                utxos[key] = None
+
+        for key, value in zip(found, self.deobfuscator.deobfuscate_batch(o_values)):
+            utxos[key] = parse_entry(key, value)
+
+        # Store new results in the cache, evicting the least recently used entries if it is full.
+        if self.cache_size:
+            for key in missing:
+                self.cache[key] = utxos[key]
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return [utxos[key] for key in keys]
+
+
 def roundup_rate(fee_rate, fee_step=FEE_STEP):
 
     """
@@ -905,6 +2426,31 @@ def roundup_rate(fee_rate, fee_step=FEE_STEP):
     return rate
 
 
+def roundup_rate_batch(fee_rates, fee_step=FEE_STEP):
+    """
+    Vectorized version of roundup_rate. Returns the same values (and types) than the scalar version: 0.0 for null rates,
+    None for NaN rates and integers otherwise.
+
+    :param fee_rates: Fee rates to be rounded up.
+    :type fee_rates: numpy.ndarray
+    :param fee_step: Value at which fee_rate will be round up (FEE_STEP by default)
+    :type fee_step: int
+    :return: The rounded up fee rates.
+    :rtype: list
+    """
+
+    nan = np.isnan(fee_rates)
+    safe_rates = np.where(nan, 0, fee_rates)
+
+    rates = np.where(np.mod(safe_rates, fee_step) == 0, safe_rates + fee_step,
+                     np.ceil(safe_rates / float(fee_step)) * fee_step).astype(np.int64).tolist()
+
+    for i in np.flatnonzero(safe_rates == 0):
+        rates[i] = None if nan[i] else fee_rates[i].item()
+
+    return rates
+
+
 def get_serialized_size(utxo, verbose=True):
     """
     Computes the uncompressed serialized size of an UTXO. This version is slower than get_serialized_size_fast version
@@ -976,3 +2522,27 @@ def get_serialized_size_fast(utxo):
 
     return out_size
 
+
+def get_serialized_size_batch(out_types, data_lens):
+    """
+    Vectorized version of get_serialized_size_fast, computing the uncompressed serialized size of a batch of UTXOs.
+
+    :param out_types: Output types.
+    :type out_types: numpy.ndarray
+    :param data_lens: Length (in bytes) of the stored data of every output.
+    :type data_lens: numpy.ndarray
+    :return: sizes in bytes
+    :rtype numpy.ndarray
+    """
+
+    # Script sizes of P2PKH, P2SH, P2PK compressed and P2PK uncompressed, indexed by out_type.
+    script_sizes = np.array([25, 23, 35, 35, 67, 67], dtype=np.int64)
+
+    out_size = np.where(out_types < NSPECIALSCRIPTS, script_sizes[np.minimum(out_types, NSPECIALSCRIPTS - 1)],
+                        data_lens)
+
+    # Add the number of bytes corresponding to the scriptPubKey length (varint) and 8 bytes for bitcoin value
+    varint_len = np.select([out_size < 253, out_size < 2 ** 16, out_size < 2 ** 32], [1, 3, 5], 9)
+
+    return out_size + varint_len + 8
+
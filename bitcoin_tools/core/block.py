@@ -0,0 +1,346 @@
+"""
+Reader for the block files (blk*.dat) stored by Bitcoin Core.
+
+Block files are a sequence of records, each one made of the network magic bytes, the size of the block (4 bytes, LE) and
+the serialized block. Files are preallocated by Bitcoin Core, so they may end with zeros. Blocks are stored in the order
+they are received, not in height order, so the height of every block has to be computed by linking blocks to their
+previous one (see get_main_chain).
+
+Files are memory-mapped, and blocks and transactions are lazy views (BlockView and TXView) on top of the map, so only
+the fields that are accessed are ever decoded. Since Bitcoin Core 28, block files can be obfuscated with the key stored
+in xor.dat (see get_xor_key). Obfuscated files are de-obfuscated in memory once, and then read the same way.
+"""
+
+from bitcoin_tools.core.transaction import TXView
+from bitcoin_tools.utils import read_varint
+from multiprocessing import Pool
+from binascii import hexlify
+from hashlib import sha256
+from struct import unpack_from
+from glob import glob
+import numpy as np
+import mmap
+import os
+
+
+MAGIC = {"main": b"\xf9\xbe\xb4\xd9", "test": b"\x0b\x11\x09\x07", "signet": b"\x0a\x03\xcf\x40",
+         "regtest": b"\xfa\xbf\xb5\xda"}
+
+HEADER_SIZE = 80
+
+# Previous block of the genesis block.
+NULL_HASH = "00" * 32
+
+
+class BlockView(object):
+    """ Read-only, lazy view of a serialized block (see TXView). Header fields are decoded when accessed, and
+    transactions are given as TXView objects on top of the same buffer.
+    """
+
+    def __init__(self, raw_block, offset=0, size=None):
+        """
+        :param raw_block: Buffer that holds the serialized block (e.g. a memory-mapped block file).
+        :type raw_block: bin
+        :param offset: Offset where the block starts in the buffer.
+        :type offset: int
+        :param size: Size of the block (if known, e.g. from the block file record).
+        :type size: int
+        """
+
+        self.raw = raw_block
+        self.start = offset
+        self.size = size
+        self.n_txs, self.txs_start = read_varint(raw_block, offset + HEADER_SIZE)
+
+    @property
+    def version(self):
+        return unpack_from('<i', self.raw, self.start)[0]
+
+    @property
+    def prev_block(self):
+        # Same (BE) representation used for the prev_tx_id of transactions.
+        return hexlify(self.raw[self.start + 4:self.start + 36][::-1])
+
+    @property
+    def merkle_root(self):
+        return hexlify(self.raw[self.start + 36:self.start + 68][::-1])
+
+    @property
+    def time(self):
+        return unpack_from('<I', self.raw, self.start + 68)[0]
+
+    @property
+    def bits(self):
+        return unpack_from('<I', self.raw, self.start + 72)[0]
+
+    @property
+    def nonce(self):
+        return unpack_from('<I', self.raw, self.start + 76)[0]
+
+    def get_hash(self, rtype=hex, endianness="LE"):
+        """ Computes the hash of the block (from its header).
+
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the hash is returned in BE (Big endian, as shown by block explorers and used in
+        prev_block) or LE (Little Endian, as serialized).
+        :type endianness: str
+        :return: The hash of the block.
+        :rtype: hex str or bin, depending on rtype parameter.
+        """
+
+        if rtype not in [hex, bin]:
+            raise Exception("Invalid return type (rtype). It should be either hex or bin.")
+        if endianness not in ["BE", "LE"]:
+            raise Exception("Invalid endianness type. It should be either BE or LE.")
+
+        block_hash = sha256(sha256(self.raw[self.start:self.start + HEADER_SIZE]).digest()).digest()
+
+        if endianness == "BE":
+            block_hash = block_hash[::-1]
+
+        return hexlify(block_hash) if rtype is hex else block_hash
+
+    def iter_txs(self):
+        """ Iterates over the transactions of the block.
+
+        :return: Generator of TXView objects.
+        """
+
+        offset = self.txs_start
+        for _ in range(self.n_txs):
+            tx = TXView(self.raw, offset)
+            offset = tx.end
+            yield tx
+
+
+def get_block_files(blocks_dir):
+    """
+    Lists the block files of a Bitcoin Core blocks folder, in order.
+
+    :param blocks_dir: Path of the blocks folder.
+    :type blocks_dir: str
+    :return: Paths of the blk*.dat files.
+    :rtype: list of str
+    """
+
+    return sorted(glob(os.path.join(blocks_dir, "blk*.dat")))
+
+
+def get_xor_key(blocks_dir):
+    """
+    Gets the key used to obfuscate the block files of a blocks folder (xor.dat, from Bitcoin Core 28 onwards).
+
+    :param blocks_dir: Path of the blocks folder.
+    :type blocks_dir: str
+    :return: The key, or None if the files are not obfuscated.
+    :rtype: str
+    """
+
+    try:
+        with open(os.path.join(blocks_dir, "xor.dat"), 'rb') as f:
+            key = f.read()
+    except IOError:
+        return None
+
+    # An all-zeros key is equivalent to no obfuscation at all.
+    return key if key.strip(b"\x00") else None
+
+
+def load_block_file(fin_name, xor_key=None):
+    """
+    Loads a block file. Plain files are memory-mapped, while obfuscated ones are read and de-obfuscated in memory.
+
+    :param fin_name: Path of the block file.
+    :type fin_name: str
+    :param xor_key: Obfuscation key (see get_xor_key), if any.
+    :type xor_key: str
+    :return: The content of the file.
+    :rtype: mmap.mmap or str
+    """
+
+    with open(fin_name, 'rb') as f:
+        if xor_key is None:
+            # Empty files can not be mapped.
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        data = np.fromfile(f, dtype=np.uint8)
+
+    # The key is applied from the beginning of the file, repeated as many times as needed.
+    key = np.frombuffer(xor_key, dtype=np.uint8)
+    data ^= np.resize(key, len(data))
+
+    return data.tostring()
+
+
+def iter_block_file(fin_name, network="main", xor_key=None):
+    """
+    Iterates over the blocks of a block file, in the order they are stored.
+
+    :param fin_name: Path of the block file.
+    :type fin_name: str
+    :param network: Network the file belongs to (main, test, signet or regtest), which sets the expected magic bytes.
+    :type network: str
+    :param xor_key: Obfuscation key (see get_xor_key), if any.
+    :type xor_key: str
+    :return: Generator of (offset, BlockView) tuples, where offset is the position of the block in the file. Views
+    share the buffer of the file, which is kept open as long as any of them is referenced.
+    """
+
+    data = load_block_file(fin_name, xor_key)
+    magic = MAGIC[network]
+    offset = 0
+
+    while offset + 8 <= len(data):
+        record_magic = data[offset:offset + 4]
+
+        if record_magic != magic:
+            # Preallocated space at the end of the file.
+            if record_magic == b"\x00" * 4:
+                break
+            raise Exception("Unexpected magic bytes ({}) at offset {} of {}.".format(hexlify(record_magic), offset,
+                                                                                     fin_name))
+
+        size = unpack_from('<I', data, offset + 4)[0]
+        if offset + 8 + size > len(data):
+            raise Exception("Truncated block at offset {} of {}.".format(offset, fin_name))
+
+        yield offset + 8, BlockView(data, offset + 8, size)
+        offset += 8 + size
+
+
+def index_block_file(args):
+    """
+    Indexes the blocks of a block file by only reading their headers. Can be run by the worker processes of
+    map_block_files.
+
+    :param args: Path of the block file, network and obfuscation key (see iter_block_file).
+    :type args: tuple
+    :return: List of (hash, previous hash, path, offset) tuples (hashes are BE hex, see BlockView.get_hash).
+    :rtype: list of tuple
+    """
+
+    fin_name, network, xor_key = args
+
+    return [(block.get_hash(hex, "BE"), block.prev_block, fin_name, offset)
+            for offset, block in iter_block_file(fin_name, network, xor_key)]
+
+
+def get_main_chain(index):
+    """
+    Computes the height of the blocks in the main chain, by linking every block to its previous one. The main chain is
+    the longest one starting from the genesis block (the first one found, in case of a tie). Blocks out of it (stale
+    blocks) or whose ancestors are missing are left out.
+
+    :param index: Indexed blocks, as (hash, previous hash, ...) tuples (see index_block_file).
+    :type index: list of tuple
+    :return: Dictionary with the height of every block in the main chain.
+    :rtype: dict
+    """
+
+    prev = dict((entry[0], entry[1]) for entry in index)
+    heights = {NULL_HASH: -1}
+
+    # Heights are computed iteratively (chains can be too long for recursion), walking back until a known block.
+    for block_hash in prev:
+        path = []
+        ancestor = block_hash
+        while ancestor not in heights and ancestor in prev:
+            path.append(ancestor)
+            ancestor = prev[ancestor]
+
+        # Blocks whose ancestors are missing get no height.
+        height = heights.get(ancestor)
+        for ancestor in reversed(path):
+            height = None if height is None else height + 1
+            heights[ancestor] = height
+
+    # The tip is the highest block (the first one found, in case of a tie).
+    tip = None
+    for entry in index:
+        height = heights.get(entry[0])
+        if height is not None and (tip is None or height > heights[tip]):
+            tip = entry[0]
+
+    chain = dict()
+    while tip is not None and tip != NULL_HASH:
+        chain[tip] = heights[tip]
+        tip = prev[tip]
+
+    return chain
+
+
+def map_block_files(func, args, n_workers=1):
+    """
+    Applies a function to a list of block files (or any other work items), farming them out to a pool of worker
+    processes if n_workers is bigger than one. Results are given back in order.
+
+    :param func: Function to be applied (has to be defined at module level, so it can be sent to the workers).
+    :type func: function
+    :param args: Arguments of every call (e.g. the paths of the block files).
+    :type args: list
+    :param n_workers: Number of worker processes.
+    :type n_workers: int
+    :return: Generator of results.
+    """
+
+    if n_workers <= 1:
+        for arg in args:
+            yield func(arg)
+        return
+
+    pool = Pool(n_workers)
+    try:
+        for result in pool.imap(func, args):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def index_blocks(blocks_dir, network="main", n_workers=1):
+    """
+    Indexes the blocks of the main chain stored in a blocks folder.
+
+    :param blocks_dir: Path of the blocks folder.
+    :type blocks_dir: str
+    :param network: Network the files belong to (see iter_block_file).
+    :type network: str
+    :param n_workers: Number of worker processes used to index the files.
+    :type n_workers: int
+    :return: List of (height, hash, path, offset) tuples of the blocks in the main chain, sorted by height.
+    :rtype: list of tuple
+    """
+
+    xor_key = get_xor_key(blocks_dir)
+    args = [(fin_name, network, xor_key) for fin_name in get_block_files(blocks_dir)]
+
+    index = [entry for entries in map_block_files(index_block_file, args, n_workers) for entry in entries]
+    chain = get_main_chain(index)
+
+    return sorted((chain[block_hash], block_hash, fin_name, offset) for block_hash, _, fin_name, offset in index
+                  if block_hash in chain)
+
+
+def iter_blocks(blocks_dir, network="main"):
+    """
+    Iterates over all the blocks stored in a blocks folder, in the order they are stored (not by height, see
+    index_blocks).
+
+    :param blocks_dir: Path of the blocks folder.
+    :type blocks_dir: str
+    :param network: Network the files belong to (see iter_block_file).
+    :type network: str
+    :return: Generator of BlockView objects.
+    """
+
+    xor_key = get_xor_key(blocks_dir)
+
+    for fin_name in get_block_files(blocks_dir):
+        for _, block in iter_block_file(fin_name, network, xor_key):
+            yield block
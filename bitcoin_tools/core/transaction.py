@@ -1,12 +1,13 @@
 from binascii import unhexlify, hexlify
 from copy import deepcopy
 from hashlib import sha256
+from struct import unpack_from
 from ecdsa import SigningKey
 from bitcoin_tools.core.keys import serialize_pk, ecdsa_tx_sign
 from bitcoin_tools.core.script import InputScript, OutputScript, Script, SIGHASH_ALL, SIGHASH_SINGLE, SIGHASH_NONE, \
     SIGHASH_ANYONECANPAY
 from bitcoin_tools.utils import change_endianness, encode_varint, int2bytes, is_public_key, is_btc_addr, is_script, \
-    parse_element, parse_varint, get_prev_ScriptPubKey
+    parse_element, parse_varint, get_prev_ScriptPubKey, read_varint
 
 
 class TX:
@@ -259,6 +260,21 @@ class TX:
 
         return tx
 
+    @classmethod
+    def from_bytes(cls, raw_tx, offset=0):
+        """ Builds a lazy view of a binary serialized transaction (see TXView). Fields are only decoded when accessed,
+        so it is the way to go when scanning lots of transactions for some of their fields.
+
+        :param raw_tx: Binary serialized transaction (or a buffer that contains it, such as a block).
+        :type raw_tx: bin
+        :param offset: Offset where the transaction starts in the buffer.
+        :type offset: int
+        :return: The transaction view.
+        :rtype: TXView
+        """
+
+        return TXView(raw_tx, offset)
+
     def serialize(self, rtype=hex):
         """ Serialize all the transaction fields arranged in the proper order, resulting in a hexadecimal string
         ready to be broadcast to the network.
@@ -542,3 +558,202 @@ class TX:
             print "\t decoded scriptPubKey: " + Script.deserialize(self.scriptPubKey[i].content)
 
         print "nLockTime: " + str(self.nLockTime) + " (" + int2bytes(self.nLockTime, 4) + ")"
+
+
+class TXView(object):
+    """ Read-only, lazy view of a binary serialized transaction. Instead of copying (and turning into hex) every field,
+    as TX.deserialize does, the view keeps a reference to the buffer that holds the transaction plus the offsets of its
+    inputs and outputs, found by a single pass over their lengths. Fields are decoded straight from the buffer when they
+    are accessed, and give back the same values TX.deserialize builds.
+
+    Since the buffer is not copied, a view can be built on top of a larger buffer (e.g. a whole block, or a
+    memory-mapped block file), and the end of the transaction (end attribute) tells where the next one starts. Segwit
+    serialized transactions are also supported (their witnesses are available through the witness field).
+    """
+
+    def __init__(self, raw_tx, offset=0):
+        """
+        :param raw_tx: Binary serialized transaction (or a buffer that contains it).
+        :type raw_tx: bin
+        :param offset: Offset where the transaction starts in the buffer.
+        :type offset: int
+        """
+
+        self.raw = raw_tx
+        self.start = offset
+        self.segwit = False
+
+        # Offset of the input count, where the non-witness serialization (after version) resumes.
+        self.io_start = offset + 4
+        n_inputs, o = read_varint(raw_tx, self.io_start)
+
+        # Segwit serialization: an empty input list (marker) followed by a non zero flag.
+        if n_inputs == 0 and unpack_from('<B', raw_tx, o)[0] != 0:
+            self.segwit = True
+            self.io_start = o + 1
+            n_inputs, o = read_varint(raw_tx, self.io_start)
+
+        self.inputs = n_inputs
+        self.input_offsets = []
+        for _ in range(n_inputs):
+            self.input_offsets.append(o)
+            script_len, o = read_varint(raw_tx, o + 36)
+            o += script_len + 4
+
+        self.outputs, o = read_varint(raw_tx, o)
+        self.output_offsets = []
+        for _ in range(self.outputs):
+            self.output_offsets.append(o)
+            script_len, o = read_varint(raw_tx, o + 8)
+            o += script_len
+
+        self.io_end = o
+
+        self.witness_offsets = []
+        if self.segwit:
+            for _ in range(n_inputs):
+                self.witness_offsets.append(o)
+                n_items, o = read_varint(raw_tx, o)
+                for _ in range(n_items):
+                    item_len, o = read_varint(raw_tx, o)
+                    o += item_len
+
+        self.end = o + 4
+
+        if self.end > len(raw_tx):
+            raise Exception("There is some error in the serialized transaction passed as input. Transaction can't"
+                            " be built")
+
+    def __len__(self):
+        return self.end - self.start
+
+    def _get_script(self, offset):
+        """ Gets a (length prefixed) script from the buffer.
+
+        :param offset: Offset of the script length.
+        :type offset: int
+        :return: The raw script and the offset of the byte right after it.
+        :rtype: bin, int
+        """
+
+        script_len, offset = read_varint(self.raw, offset)
+        return self.raw[offset:offset + script_len], offset + script_len
+
+    @property
+    def version(self):
+        return unpack_from('<I', self.raw, self.start)[0]
+
+    @property
+    def nLockTime(self):
+        # Same (big endian) interpretation TX.deserialize does.
+        return unpack_from('>I', self.raw, self.end - 4)[0]
+
+    @property
+    def prev_tx_id(self):
+        return [hexlify(self.raw[o:o + 32][::-1]) for o in self.input_offsets]
+
+    @property
+    def prev_out_index(self):
+        return [unpack_from('<I', self.raw, o + 32)[0] for o in self.input_offsets]
+
+    @property
+    def scriptSig_len(self):
+        return [read_varint(self.raw, o + 36)[0] for o in self.input_offsets]
+
+    @property
+    def raw_scriptSig(self):
+        return [self._get_script(o + 36)[0] for o in self.input_offsets]
+
+    @property
+    def scriptSig(self):
+        return [InputScript.from_hex(hexlify(script)) for script in self.raw_scriptSig]
+
+    @property
+    def nSequence(self):
+        # Same (big endian) interpretation TX.deserialize does.
+        return [unpack_from('>I', self.raw, self._get_script(o + 36)[1])[0] for o in self.input_offsets]
+
+    @property
+    def value(self):
+        return [unpack_from('<Q', self.raw, o)[0] for o in self.output_offsets]
+
+    @property
+    def scriptPubKey_len(self):
+        return [read_varint(self.raw, o + 8)[0] for o in self.output_offsets]
+
+    @property
+    def raw_scriptPubKey(self):
+        return [self._get_script(o + 8)[0] for o in self.output_offsets]
+
+    @property
+    def scriptPubKey(self):
+        return [OutputScript.from_hex(hexlify(script)) for script in self.raw_scriptPubKey]
+
+    @property
+    def witness(self):
+        """ Witness stack of every input (as lists of hex items), or an empty list for non-segwit transactions. """
+
+        witness = []
+        for o in self.witness_offsets:
+            n_items, o = read_varint(self.raw, o)
+            stack = []
+            for _ in range(n_items):
+                item, o = self._get_script(o)
+                stack.append(hexlify(item))
+            witness.append(stack)
+
+        return witness
+
+    def serialize(self, rtype=hex, witness=False):
+        """ Gets the serialized transaction from the buffer.
+
+        :param rtype: Whether the serialized transaction is returned as a hex str or a byte array.
+        :type rtype: hex or bin
+        :param witness: Whether the segwit serialization (with witnesses) is returned, if the transaction has it.
+        :type witness: bool
+        :return: Serialized transaction.
+        :rtype: hex str / bin
+        """
+
+        if rtype not in [hex, bin]:
+            raise Exception("Invalid return type (rtype). It should be either hex or bin.")
+
+        if witness or not self.segwit:
+            serialized_tx = self.raw[self.start:self.end]
+        else:
+            serialized_tx = self.raw[self.start:self.start + 4] + self.raw[self.io_start:self.io_end] + \
+                            self.raw[self.end - 4:self.end]
+
+        return hexlify(serialized_tx) if rtype is hex else bytes(serialized_tx)
+
+    def get_txid(self, rtype=hex, endianness="LE"):
+        """ Computes the transaction id (hash of the non-witness serialization), without building a TX object.
+
+        :param rtype: Defines the type of return, either hex str or bytes.
+        :type rtype: str or bin
+        :param endianness: Whether the id is returned in BE (Big endian) or LE (Little Endian) (default one)
+        :type endianness: str
+        :return: The hash of the transaction (i.e: transaction id)
+        :rtype: hex str or bin, depending on rtype parameter.
+        """
+
+        if rtype not in [hex, bin]:
+            raise Exception("Invalid return type (rtype). It should be either hex or bin.")
+        if endianness not in ["BE", "LE"]:
+            raise Exception("Invalid endianness type. It should be either BE or LE.")
+
+        tx_id = sha256(sha256(self.serialize(rtype=bin)).digest()).digest()
+
+        if endianness == "BE":
+            tx_id = tx_id[::-1]
+
+        return hexlify(tx_id) if rtype is hex else tx_id
+
+    def to_tx(self):
+        """ Builds a full TX object from the view (witnesses, if any, are left out since TX does not support them).
+
+        :return: The transaction.
+        :rtype: TX
+        """
+
+        return TX.deserialize(self.serialize())
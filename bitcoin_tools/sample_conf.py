@@ -10,6 +10,7 @@ address_vault = bitcoin_tools_dir + "bitcoin_addresses/"  # Address vault .
 #  STATUS parameters
 default_coin = 'bitcoin'
 chainstate_path = home_dir + ".bitcoin/chainstate"  # Path to the chainstate.
+blocks_path = home_dir + ".bitcoin/blocks"  # Path to the block files (blk*.dat).
 data_path = bitcoin_tools_dir + "data/"  # Data storage path (for IO).
 figs_path = bitcoin_tools_dir + "figs/"  # Figure store dir, where images from analysis will be stored.
 estimated_data_dir = bitcoin_tools_dir + 'estimation_data/'  # Data for non-profitability with estimations
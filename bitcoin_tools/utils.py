@@ -1,5 +1,6 @@
 from urllib2 import urlopen, Request
 from json import loads
+from struct import unpack_from
 
 
 def change_endianness(x):
@@ -90,6 +91,30 @@ def parse_varint(tx):
     return varint
 
 
+def read_varint(data, offset=0):
+    """ Reads a varint straight from serialized (binary) data, without turning it into hex. Bytes-native counterpart of
+    parse_varint + decode_varint.
+
+    :param data: Serialized data from which the varint will be read (str, bytearray, mmap, ...).
+    :type data: bin
+    :param offset: Offset where the varint is located in the data.
+    :type offset: int
+    :return: The decoded value, and the offset of the byte located right after the varint.
+    :rtype: int, int
+    """
+
+    prefix = unpack_from('<B', data, offset)[0]
+
+    if prefix <= 252:  # No prefix
+        return prefix, offset + 1
+    elif prefix == 253:  # 0xFD
+        return unpack_from('<H', data, offset + 1)[0], offset + 3
+    elif prefix == 254:  # 0xFE
+        return unpack_from('<I', data, offset + 1)[0], offset + 5
+    else:  # 0xFF
+        return unpack_from('<Q', data, offset + 1)[0], offset + 9
+
+
 def decode_varint(varint):
     """ Decodes a varint to its standard integer representation.
 
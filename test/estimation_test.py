@@ -0,0 +1,153 @@
+import os
+import shutil
+import tempfile
+import ujson
+from hashlib import sha256
+from struct import pack
+
+from bitcoin_tools import CFG
+from bitcoin_tools.core.block import MAGIC, BlockView
+from bitcoin_tools.utils import encode_varint
+from bitcoin_tools.analysis.status.estimation import update_estimation_data, classify_input, STATE_FILE, INPUT_P2PKH, \
+    INPUT_P2SH, INPUT_P2WSH, INPUT_OTHER
+
+
+# Builds a small regtest chain, with spends of P2PKH, P2SH and P2WSH outputs, and checks the estimation data generated
+# from it (see analysis/status/estimation.py).
+
+def varint(n):
+    return encode_varint(n).decode('hex')
+
+
+def push(data):
+    return chr(len(data)) + data
+
+
+def double_sha256(data):
+    return sha256(sha256(data).digest()).digest()
+
+
+def build_tx(inputs, outputs, witnesses=None):
+    # inputs: (prev_tx_id (raw, LE), prev_out_index, scriptSig), outputs: scriptPubKeys. Returns the raw tx and its id.
+    body = varint(len(inputs))
+    for prev_tx_id, prev_out_index, script_sig in inputs:
+        body += prev_tx_id + pack("<I", prev_out_index) + varint(len(script_sig)) + script_sig + "\xff" * 4
+    body += varint(len(outputs))
+    for script in outputs:
+        body += pack("<q", 1000) + varint(len(script)) + script
+
+    legacy = pack("<i", 1) + body + "\x00" * 4
+    if witnesses is None:
+        return legacy, double_sha256(legacy)
+
+    witness = "".join(varint(len(items)) + "".join(varint(len(item)) + item for item in items) for items in witnesses)
+    return pack("<i", 1) + "\x00\x01" + body + witness + "\x00" * 4, double_sha256(legacy)
+
+
+def build_block(prev_block, height, txs):
+    header = pack("<i", 2) + prev_block + "\x00" * 32 + pack("<III", 1500000000, 0x207fffff, height)
+    return header + varint(len(txs)) + "".join(txs), double_sha256(header)
+
+
+def coinbase(height, n_outputs):
+    return build_tx([("\x00" * 32, 0xffffffff, "\x01" + chr(height))], [p2pkh_script(height, i)
+                                                                         for i in range(n_outputs)])
+
+
+def p2pkh_script(height, index):
+    return "\x76\xa9\x14" + chr(height) * 19 + chr(index) + "\x88\xac"
+
+
+sig = "\x30\x44\x02\x20" + "\x11" * 32 + "\x02\x20" + "\x22" * 32 + "\x01"
+compressed_pk = "\x02" + "\x33" * 32
+uncompressed_pk = "\x04" + "\x44" * 64
+redeem_script = "\x51" + push(compressed_pk) + push(compressed_pk) + "\x52\xae"
+
+p2sh_script_sig = "\x00" + push(sig) + push(redeem_script)
+p2wsh_witness = ["", sig, redeem_script]
+p2wsh_size = len(varint(3) + "".join(varint(len(item)) + item for item in p2wsh_witness))
+
+cb_0, tx_id_0 = coinbase(0, 2)
+cb_1, tx_id_1 = coinbase(1, 1)
+cb_2, _ = coinbase(2, 1)
+cb_3, _ = coinbase(3, 1)
+
+# Height 2: spends of the outputs created at heights 0 (compressed key) and 1 (uncompressed key), and a P2SH, a P2WSH
+# and a P2WPKH spend (which is not part of the estimation data).
+spend_0, _ = build_tx([(tx_id_0, 0, push(sig) + push(compressed_pk))], [p2pkh_script(2, 1)])
+spend_1, _ = build_tx([(tx_id_1, 0, push(sig) + push(uncompressed_pk))], [p2pkh_script(2, 2)])
+spend_p2sh, _ = build_tx([("\xaa" * 32, 0, p2sh_script_sig)], ["\x6a"])
+spend_wit, _ = build_tx([("\xbb" * 32, 0, ""), ("\xcc" * 32, 0, "")], ["\x6a"], [p2wsh_witness, [sig, compressed_pk]])
+
+# Height 3: spend of the second output created at height 0 (uncompressed key).
+spend_2, _ = build_tx([(tx_id_0, 1, push(sig) + push(uncompressed_pk))], [p2pkh_script(3, 1)])
+
+blocks = []
+prev_block = "\x00" * 32
+for height, txs in enumerate([[cb_0], [cb_1], [cb_2, spend_0, spend_1, spend_p2sh, spend_wit], [cb_3, spend_2]]):
+    block, prev_block = build_block(prev_block, height, txs)
+    blocks.append(block)
+
+# Input classification
+txs = list(BlockView(blocks[2]).iter_txs())
+print "\nINPUT CLASSES"
+for tx, index, expected in [(txs[1], 0, (INPUT_P2PKH, 33)), (txs[2], 0, (INPUT_P2PKH, 65)),
+                            (txs[3], 0, (INPUT_P2SH, len(p2sh_script_sig))), (txs[4], 0, (INPUT_P2WSH, p2wsh_size)),
+                            (txs[4], 1, (INPUT_OTHER, 0))]:
+    result = classify_input(tx, index, tx.raw_scriptSig[index])
+    print result
+    assert result == expected
+
+tmp_dir = tempfile.mkdtemp()
+blocks_dir = os.path.join(tmp_dir, "blocks")
+os.makedirs(blocks_dir)
+CFG.estimated_data_dir = os.path.join(tmp_dir, "estimation_data/")
+
+# Blocks are stored out of order, as Bitcoin Core may do.
+with open(os.path.join(blocks_dir, "blk00000.dat"), 'wb') as f:
+    for block in [blocks[1], blocks[0], blocks[3], blocks[2]]:
+        f.write(MAGIC["regtest"] + pack("<I", len(block)) + block)
+
+
+def load(coin):
+    data = []
+    for fin_name in ["p2pkh_pubkey_avg_size_height_output.json", "p2sh.json", "nonstd.json", "p2wsh.json"]:
+        with open(os.path.join(CFG.estimated_data_dir, coin, fin_name)) as f:
+            data.append(ujson.load(f))
+    return data
+
+
+try:
+    print "\nFULL RUN"
+    update_estimation_data("full", blocks_dir, "regtest", confirmations=0)
+    p2pkh, p2sh, nonstd, p2wsh = load("full")
+    print p2pkh, p2sh, nonstd, p2wsh
+    # Height 0: (33 + 65) / 2, height 1: 65, heights 2 and 3 have no spends so far (last estimation is used).
+    assert p2pkh == {"0": 49.0, "1": 65.0, "2": 65.0, "3": 65.0}
+    assert (p2sh, nonstd, p2wsh) == (float(len(p2sh_script_sig)), 0.0, float(p2wsh_size))
+
+    print "\nINTERRUPTED STORE"
+    update_estimation_data("resumed", blocks_dir, "regtest", confirmations=2)
+
+    # The next run is interrupted right before replacing the state file.
+    rename = os.rename
+
+    def interrupted_rename(src, dst):
+        if dst.endswith(STATE_FILE):
+            raise KeyboardInterrupt("Interrupted store")
+        rename(src, dst)
+
+    os.rename = interrupted_rename
+    try:
+        update_estimation_data("resumed", blocks_dir, "regtest", confirmations=0)
+    except KeyboardInterrupt as e:
+        print e
+    finally:
+        os.rename = rename
+
+    update_estimation_data("resumed", blocks_dir, "regtest", confirmations=0)
+    print load("resumed")
+    assert load("resumed") == load("full")
+
+finally:
+    shutil.rmtree(tmp_dir)